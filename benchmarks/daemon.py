@@ -0,0 +1,51 @@
+import argparse
+import sys
+import os
+
+# run from a checkout, the benchmark measures the tree it lives in
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sentinel_hl.manager import SentinelHlManager
+from sentinel_hl.libraries.icmp import IcmpProber, IcmpUnavailableError
+
+class BenchmarkManager(SentinelHlManager):
+    # the real daemon, with its pid file, control socket and datastores kept in the benchmark work directory
+    def __init__(self, *, workdir: str, **kwargs) -> None:
+        self._workdir: str = workdir
+
+        super().__init__(**kwargs)
+
+    def _get_pid_filepath(self) -> str:
+        return os.path.join(self._workdir, 'sentinel-hl.pid')
+
+    def _get_control_socket_path(self) -> str:
+        return os.path.join(self._workdir, 'sentinel-hl.sock')
+
+    def _get_ssh_control_dir(self) -> str:
+        return os.path.join(self._workdir, 'ssh')
+
+    def _get_datastore_filepath(self, name: str, ext: str = 'db') -> str:
+        return os.path.join(self._workdir, f'{name}.{ext}')
+
+def _icmp_unavailable(cls) -> IcmpProber:
+    raise IcmpUnavailableError('ICMP disabled by the benchmark')
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Run the sentinel-hl daemon inside a benchmark work directory')
+
+    parser.add_argument('--workdir', required=True)
+    parser.add_argument('--config', dest='config_file', required=True)
+    parser.add_argument('--log', dest='log_file', default='')
+    parser.add_argument('--log-level', dest='log_level', default='INFO')
+    parser.add_argument('--icmp', choices=['shim', 'socket'], default='shim', help='Probe through the ping shim (scriptable host state) or the in-process ICMP prober (every loopback host answers)')
+
+    args = parser.parse_args()
+
+    if args.icmp == 'shim':
+        # loopback addresses always answer ICMP, the ping fallback is the only way to simulate hosts going down
+        IcmpProber.get = classmethod(_icmp_unavailable) # type: ignore
+
+    BenchmarkManager(workdir=args.workdir, config_file=args.config_file, log_file=args.log_file, log_level=args.log_level).run_forever()
+
+if __name__ == '__main__':
+    main()
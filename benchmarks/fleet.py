@@ -0,0 +1,107 @@
+import logging
+import asyncio
+import random
+import time
+import os
+
+__all__ = ['SimulatedHost', 'Fleet', 'WolSink']
+
+# 6 bytes of 0xff followed by the MAC address 16 times
+MAGIC_PACKET_SIZE = 102
+
+class SimulatedHost:
+    def __init__(self, index: int):
+        # 127.0.0.0/16 is left alone, a fleet of up to ~16M hosts fits in the rest of the loopback range
+        n = index + 1
+
+        self.name: str = f'host{index:05d}'
+        self.ip: str = f'127.{1 + n // 65536}.{n // 256 % 256}.{n % 256}'
+        self.mac: str = ':'.join(f'{byte:02x}' for byte in (0x02, 0x00, *n.to_bytes(4, 'big')))
+
+class Fleet:
+    # the state shared with the command shims lives in files, every shim is a short lived process:
+    # down/<ip> marks a host that does not answer, masters/<ip> an open SSH master connection
+    def __init__(self, state_dir: str, count: int, *, boot_delay: float = 0, seed: int | None = None, logger: logging.Logger | None = None):
+        self._state_dir: str = state_dir
+        self._boot_delay: float = boot_delay
+        self._random: random.Random = random.Random(seed)
+        self._logger: logging.Logger = logger or logging.getLogger(__name__)
+
+        self.hosts: list[SimulatedHost] = [SimulatedHost(index) for index in range(count)]
+        self._by_mac: dict[str, SimulatedHost] = {host.mac: host for host in self.hosts}
+
+        # first magic packet received per host
+        self.woken: dict[str, float] = {}
+        self._booting: set[str] = set()
+
+    @property
+    def state_dir(self) -> str:
+        return self._state_dir
+
+    def prepare(self, *, down_rate: float = 0) -> None:
+        os.makedirs(os.path.join(self._state_dir, 'down'), exist_ok=True)
+        os.makedirs(os.path.join(self._state_dir, 'masters'), exist_ok=True)
+        open(os.path.join(self._state_dir, 'events'), 'w').close()
+
+        for host in self.hosts:
+            if self._random.random() < down_rate:
+                self.set_down(host)
+
+    def set_down(self, host: SimulatedHost) -> None:
+        open(os.path.join(self._state_dir, 'down', host.ip), 'w').close()
+
+    def set_up(self, host: SimulatedHost) -> None:
+        try:
+            os.remove(os.path.join(self._state_dir, 'down', host.ip))
+        except FileNotFoundError:
+            pass
+
+    def is_down(self, host: SimulatedHost) -> bool:
+        return os.path.exists(os.path.join(self._state_dir, 'down', host.ip))
+
+    def events(self, kind: str) -> dict[str, float]:
+        # first event of the kind per host ip, as written by the shims
+        events: dict[str, float] = {}
+
+        with open(os.path.join(self._state_dir, 'events'), 'r') as f:
+            for line in f:
+                at, event, ip = line.split()
+
+                if event == kind:
+                    events.setdefault(ip, float(at))
+
+        return events
+
+    def wake(self, mac: str) -> None:
+        host = self._by_mac.get(mac)
+
+        if host is None:
+            self._logger.debug(f'Magic packet for unknown MAC {mac}')
+            return
+
+        self.woken.setdefault(host.ip, time.time())
+
+        # only a host that is actually down boots, it answers once the boot delay passed
+        if host.ip not in self._booting and self.is_down(host):
+            self._booting.add(host.ip)
+            asyncio.get_running_loop().call_later(self._boot_delay, self._boot, host)
+
+    def _boot(self, host: SimulatedHost) -> None:
+        self._booting.discard(host.ip)
+        self.set_up(host)
+
+class WolSink(asyncio.DatagramProtocol):
+    # receives the magic packets sent to the loopback "broadcast" address
+    def __init__(self, fleet: Fleet):
+        self._fleet: Fleet = fleet
+
+        self.packets: int = 0
+        self.invalid: int = 0
+
+    def datagram_received(self, data: bytes, addr) -> None:
+        if len(data) != MAGIC_PACKET_SIZE or data[:6] != b'\xff' * 6 or data[6:12] * 16 != data[6:]:
+            self.invalid += 1
+            return
+
+        self.packets += 1
+        self._fleet.wake(data[6:12].hex(':'))
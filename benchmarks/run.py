@@ -0,0 +1,512 @@
+import argparse
+import asyncio
+import logging
+import tempfile
+import signal
+import socket
+import shutil
+import json
+import math
+import time
+import sys
+import os
+import yaml
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from upsd import Trace, FakeUpsd
+from fleet import Fleet, WolSink
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+SHIMS_DIR = os.path.join(BENCHMARKS_DIR, 'shims')
+
+# power loss scenario, seconds from the moment the daemon reports ready
+POWER_LOSS_AT = 5
+CHARGE_FLOOR = 10
+RECHARGE_TIME = 120
+
+READY_TIMEOUT = 600
+SAMPLE_INTERVAL = 1
+
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+logger = logging.getLogger('benchmark')
+
+class ProcessSampler:
+    # CPU, memory and file descriptors of the daemon, read from /proc while it runs
+    def __init__(self, pid: int):
+        self._pid: int = pid
+
+        self.samples: int = 0
+        self.cpu: float = 0.0
+        self.children_cpu: float = 0.0
+        self.rss_max: int = 0
+        self.rss_last: int = 0
+        self.fds_max: int = 0
+        self.fds_last: int = 0
+
+    def sample(self) -> None:
+        try:
+            with open(f'/proc/{self._pid}/stat', 'r') as f:
+                # the command name may contain spaces, fields are counted from its closing parenthesis
+                fields = f.read().rsplit(')', 1)[1].split()
+
+            with open(f'/proc/{self._pid}/statm', 'r') as f:
+                rss = int(f.read().split()[1]) * PAGE_SIZE
+
+            fds = len(os.listdir(f'/proc/{self._pid}/fd'))
+        except (FileNotFoundError, ProcessLookupError, IndexError):
+            return
+
+        self.samples += 1
+        self.cpu = (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+        # reaped children only, i.e. the shims and ssh commands that already exited
+        self.children_cpu = (int(fields[13]) + int(fields[14])) / CLOCK_TICKS
+        self.rss_last = rss
+        self.rss_max = max(self.rss_max, rss)
+        self.fds_last = fds
+        self.fds_max = max(self.fds_max, fds)
+
+class NotifyListener(asyncio.DatagramProtocol):
+    # stands in for systemd: the daemon sends READY=1 once the initial discovery and checks are done
+    def __init__(self):
+        self.ready: asyncio.Event = asyncio.Event()
+        self.ready_at: float | None = None
+        self.watchdog: int = 0
+
+    def datagram_received(self, data: bytes, addr) -> None:
+        for state in data.decode(errors='replace').split('\n'):
+            if state == 'READY=1' and self.ready_at is None:
+                self.ready_at = time.time()
+                self.ready.set()
+            elif state == 'WATCHDOG=1':
+                self.watchdog += 1
+
+class Histograms:
+    # histogram families scraped from the metrics endpoint, merged across their labels
+    def __init__(self, text: str):
+        self.buckets: dict[str, dict[float, float]] = {}
+        self.sums: dict[str, float] = {}
+        self.counts: dict[str, float] = {}
+        self.values: dict[str, float] = {}
+
+        for line in text.splitlines():
+            if not line or line.startswith('#'):
+                continue
+
+            series, value = line.rsplit(' ', 1)
+            name, _, labels = series.partition('{')
+
+            if name.endswith('_bucket'):
+                le = labels.split('le="', 1)[1].split('"', 1)[0]
+                family = self.buckets.setdefault(name[:-len('_bucket')], {})
+                bound = math.inf if le == '+Inf' else float(le)
+                family[bound] = family.get(bound, 0) + float(value)
+            elif name.endswith('_sum'):
+                self.sums[name[:-len('_sum')]] = self.sums.get(name[:-len('_sum')], 0) + float(value)
+            elif name.endswith('_count'):
+                self.counts[name[:-len('_count')]] = self.counts.get(name[:-len('_count')], 0) + float(value)
+            else:
+                self.values[name] = self.values.get(name, 0) + float(value)
+
+    def count(self, name: str) -> int:
+        return int(self.counts.get(name, 0))
+
+    def mean(self, name: str) -> float | None:
+        if not self.counts.get(name):
+            return None
+
+        return self.sums[name] / self.counts[name]
+
+    def quantile(self, name: str, q: float) -> float | None:
+        # linear interpolation inside the bucket, as PromQL histogram_quantile does
+        buckets = sorted(self.buckets.get(name, {}).items())
+
+        if not buckets or not buckets[-1][1]:
+            return None
+
+        rank = q * buckets[-1][1]
+        lower, below = 0.0, 0.0
+
+        for bound, cumulative in buckets:
+            if cumulative >= rank:
+                if math.isinf(bound):
+                    return lower
+
+                return lower + (bound - lower) * ((rank - below) / (cumulative - below) if cumulative > below else 0)
+
+            lower, below = bound, cumulative
+
+        return lower
+
+class Benchmark:
+    def __init__(self, args: argparse.Namespace):
+        self._args: argparse.Namespace = args
+
+        self._workdir: str = args.workdir or tempfile.mkdtemp(prefix='sentinel-hl-bench-')
+        self._fleet: Fleet = Fleet(os.path.join(self._workdir, 'state'), args.hosts, boot_delay=args.boot_delay, seed=args.seed)
+        self._trace: Trace = self._trace_factory()
+        self._upsd: FakeUpsd = FakeUpsd({f'ups{index}': self._trace for index in range(args.ups)})
+        self._notify: NotifyListener = NotifyListener()
+        self._sink: WolSink = WolSink(self._fleet)
+
+        self._process: asyncio.subprocess.Process | None = None
+        self._sampler: ProcessSampler | None = None
+        self._metrics_port: int = self._get_free_port()
+
+    async def run(self) -> dict:
+        loop = asyncio.get_running_loop()
+
+        os.makedirs(self._workdir, exist_ok=True)
+        self._fleet.prepare(down_rate=self._args.down_rate)
+
+        await self._upsd.start()
+
+        notify_path = os.path.join(self._workdir, 'notify.sock')
+        notify_transport, _ = await loop.create_datagram_endpoint(lambda: self._notify, local_addr=notify_path, family=socket.AF_UNIX)
+        sink_transport, _ = await loop.create_datagram_endpoint(lambda: self._sink, local_addr=('127.0.0.1', 0))
+
+        config_path = self._write_config(sink_transport.get_extra_info('sockname')[1])
+
+        try:
+            started = time.time()
+            await self._start_daemon(config_path, notify_path)
+
+            sampling = asyncio.create_task(self._sample())
+
+            await self._wait_ready()
+
+            ready_at = self._notify.ready_at or time.time()
+            logger.info(f'Daemon ready after {ready_at - started:.2f}s, running scenario "{self._args.scenario}" for {self._args.duration}s')
+
+            self._upsd.start_clock()
+            await asyncio.sleep(self._args.duration)
+
+            metrics = Histograms(await self._scrape_metrics())
+            stop_time = await self._stop_daemon()
+
+            sampling.cancel()
+        finally:
+            if self._process is not None and self._process.returncode is None:
+                self._process.kill()
+                await self._process.wait()
+
+            notify_transport.close()
+            sink_transport.close()
+            await self._upsd.close()
+
+        return self._report(started, ready_at, stop_time, metrics)
+
+    def cleanup(self) -> None:
+        if not self._args.keep and not self._args.workdir:
+            shutil.rmtree(self._workdir, ignore_errors=True)
+
+    def _trace_factory(self) -> Trace:
+        if self._args.trace:
+            return Trace.load(self._args.trace)
+
+        steady = {'t': 0, 'ups.status': 'OL', 'battery.charge': 100, 'battery.runtime': 1800, 'ups.load': 40}
+
+        if self._args.scenario == 'steady':
+            return Trace([steady])
+
+        # on battery, discharging down to the floor, then back on line power and recharging
+        restored_at = POWER_LOSS_AT + self._args.discharge
+
+        return Trace([
+            steady,
+            {'t': POWER_LOSS_AT, 'ups.status': 'OB DISCHRG', 'battery.charge': 100, 'battery.runtime': 1800},
+            {'t': restored_at, 'ups.status': 'OL CHRG', 'battery.charge': CHARGE_FLOOR, 'battery.runtime': 180},
+            {'t': restored_at + RECHARGE_TIME, 'ups.status': 'OL', 'battery.charge': 100, 'battery.runtime': 1800},
+        ])
+
+    def _write_config(self, wol_port: int) -> str:
+        ups_hosts: dict[int, list[str]] = {index: [] for index in range(self._args.ups)}
+
+        for index, host in enumerate(self._fleet.hosts):
+            ups_hosts[index % self._args.ups].append(host.name)
+
+        config = {
+            'hosts': [{'name': host.name, 'ip': host.ip, 'mac': host.mac, 'ssh_user': 'root'} for host in self._fleet.hosts],
+            'hosts_policy': {
+                'mac_monitor': False,
+                'ack_status_interval': 5,
+                'wake_backoff': 0,
+                'check_interval_min': 5,
+                'probes': [{'type': 'icmp', 'count': 1, 'timeout': 1}],
+            },
+            'ups': [{'name': f'ups{index}', 'nut_id': f'ups{index}', 'nut_host': '127.0.0.1', 'nut_port': self._upsd.port, 'hosts': names} for index, names in ups_hosts.items()],
+            'ups_units_policy': {
+                'wake_cooldown': self._args.wake_cooldown,
+                'shutdown_threshold': self._args.threshold,
+                'shutdown_retry_delay': 1,
+            },
+            'wol': {'broadcast': '127.0.0.1', 'port': wol_port},
+            'metrics': {'enabled': True, 'port': self._metrics_port},
+            'ups_poll_interval': 5,
+            'hosts_check_interval': self._args.check_interval,
+            'cmd_exec_concurrency': self._args.concurrency,
+            'hosts_check_concurrency': self._args.concurrency,
+            'datastore_backend': self._args.datastore,
+        }
+
+        path = os.path.join(self._workdir, 'config.yml')
+
+        with open(path, 'w') as f:
+            yaml.safe_dump(config, f, sort_keys=False)
+
+        return path
+
+    async def _start_daemon(self, config_path: str, notify_path: str) -> None:
+        env = {
+            **os.environ,
+            'PATH': f'{SHIMS_DIR}{os.pathsep}{os.environ.get("PATH", "")}',
+            'NOTIFY_SOCKET': notify_path,
+            'WATCHDOG_USEC': str(self._args.watchdog * 1_000_000),
+            'SENTINEL_HL_BENCH_STATE': self._fleet.state_dir,
+            'SENTINEL_HL_BENCH_LATENCY': str(self._args.latency),
+            'SENTINEL_HL_BENCH_JITTER': str(self._args.jitter),
+            'SENTINEL_HL_BENCH_FAILURE_RATE': str(self._args.failure_rate),
+            'SENTINEL_HL_BENCH_SHUTDOWN_DELAY': str(self._args.shutdown_delay),
+        }
+
+        # WATCHDOG_PID is checked against the daemon pid, unknown before the start
+        env.pop('WATCHDOG_PID', None)
+
+        self._process = await asyncio.create_subprocess_exec(
+            sys.executable, os.path.join(BENCHMARKS_DIR, 'daemon.py'),
+            '--workdir', self._workdir,
+            '--config', config_path,
+            '--log', self._get_log_path(),
+            '--log-level', self._args.log_level,
+            '--icmp', self._args.icmp,
+            env=env,
+            stdin=asyncio.subprocess.DEVNULL,
+        )
+
+        self._sampler = ProcessSampler(self._process.pid)
+
+    async def _wait_ready(self) -> None:
+        assert self._process is not None
+
+        # a daemon failing to start (e.g. an invalid config) exits instead
+        ready = asyncio.ensure_future(self._notify.ready.wait())
+        exited = asyncio.ensure_future(self._process.wait())
+
+        await asyncio.wait([ready, exited], timeout=READY_TIMEOUT, return_when=asyncio.FIRST_COMPLETED)
+
+        ready.cancel()
+        exited.cancel()
+
+        if self._process.returncode is not None:
+            raise RuntimeError(f'Daemon exited with code {self._process.returncode} before being ready, see {self._get_log_path()}')
+
+        if not self._notify.ready.is_set():
+            raise RuntimeError(f'Daemon not ready after {READY_TIMEOUT}s, see {self._get_log_path()}')
+
+    async def _stop_daemon(self) -> float | None:
+        # time from SIGINT to exit, i.e. the cleanup jobs. None when the daemon had to be killed
+        assert self._process is not None and self._sampler is not None
+
+        self._sampler.sample()
+
+        started = time.monotonic()
+        self._process.send_signal(signal.SIGINT)
+
+        try:
+            await asyncio.wait_for(self._process.wait(), timeout=self._args.stop_timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f'Daemon did not stop within {self._args.stop_timeout}s, killing it')
+            return None
+
+        return time.monotonic() - started
+
+    async def _sample(self) -> None:
+        while True:
+            if self._sampler is not None:
+                self._sampler.sample()
+
+            await asyncio.sleep(SAMPLE_INTERVAL)
+
+    async def _scrape_metrics(self) -> str:
+        reader, writer = await asyncio.open_connection('127.0.0.1', self._metrics_port)
+
+        try:
+            writer.write(b'GET /metrics HTTP/1.1\r\nHost: 127.0.0.1\r\n\r\n')
+            await writer.drain()
+
+            response = await reader.read()
+        finally:
+            writer.close()
+
+        return response.split(b'\r\n\r\n', 1)[1].decode()
+
+    def _report(self, started: float, ready_at: float, stop_time: float | None, metrics: Histograms) -> dict:
+        assert self._sampler is not None
+
+        elapsed = time.time() - started
+
+        report = {
+            'hosts': self._args.hosts,
+            'ups': self._args.ups,
+            'scenario': self._args.trace or self._args.scenario,
+            'startup': {
+                'ready': round(ready_at - started, 3),
+                'check_cycle': metrics.mean('sentinel_hl_hosts_check_cycle_seconds'),
+            },
+            'checks': {
+                'count': metrics.count('sentinel_hl_host_check_duration_seconds'),
+                'duration_mean': metrics.mean('sentinel_hl_host_check_duration_seconds'),
+                'duration_p50': metrics.quantile('sentinel_hl_host_check_duration_seconds', 0.5),
+                'duration_p95': metrics.quantile('sentinel_hl_host_check_duration_seconds', 0.95),
+                'delay_p95': metrics.quantile('sentinel_hl_host_check_delay_seconds', 0.95),
+                'probe_p95': metrics.quantile('sentinel_hl_host_probe_duration_seconds', 0.95),
+            },
+            'loop': {
+                'lag_p99': metrics.quantile('sentinel_hl_loop_lag_seconds', 0.99),
+                'lag_mean': metrics.mean('sentinel_hl_loop_lag_seconds'),
+                'watchdog_pings': self._notify.watchdog,
+            },
+            'commands': {
+                'run': int(metrics.values.get('sentinel_hl_commands_total', 0)),
+                'failed': int(metrics.values.get('sentinel_hl_command_failures_total', 0)),
+                'exec_p95': metrics.quantile('sentinel_hl_command_duration_seconds', 0.95),
+            },
+            'process': {
+                'cpu': round(self._sampler.cpu, 3),
+                'cpu_percent': round(100 * self._sampler.cpu / elapsed, 1),
+                'children_cpu': round(self._sampler.children_cpu, 3),
+                'rss_max_mib': round(self._sampler.rss_max / 2**20, 1),
+                'rss_last_mib': round(self._sampler.rss_last / 2**20, 1),
+                'fds_max': self._sampler.fds_max,
+                'fds_last': self._sampler.fds_last,
+                'stop': None if stop_time is None else round(stop_time, 3),
+            },
+            'upsd': {
+                'connections': self._upsd.connections,
+                'commands': self._upsd.commands,
+            },
+        }
+
+        power = self._power_report(ready_at)
+
+        if power is not None:
+            report['power'] = power
+
+        return report
+
+    def _power_report(self, clock: float) -> dict | None:
+        # latencies in seconds from the power events, as the fake upsd started reporting them
+        lost_at = self._trace.find(lambda values: 'OB' in values.get('ups.status', ''))
+
+        if lost_at is None:
+            return None
+
+        below_at = self._trace.find(lambda values: 'OB' in values.get('ups.status', '') and float(values.get('battery.charge', 100)) <= self._args.threshold, after=lost_at)
+        restored_at = self._trace.find(lambda values: 'OL' in values.get('ups.status', ''), after=lost_at)
+
+        shutdowns = sorted(self._fleet.events('shutdown').values())
+        # hosts woken on battery were found down by a check (failure rate, hosts down at start)
+        woken = [at - clock for at in self._fleet.woken.values() if at >= clock + lost_at]
+        wakes = sorted(at for at in woken if restored_at is not None and at >= restored_at)
+
+        return {
+            'power_lost': lost_at,
+            'threshold_crossed': below_at,
+            'power_restored': restored_at,
+            'shutdowns': len(shutdowns),
+            'shutdown_from_threshold': summarize([at - clock - below_at for at in shutdowns]) if below_at is not None else None,
+            'shutdown_from_power_loss': summarize([at - clock - lost_at for at in shutdowns]),
+            'woken': len(wakes),
+            'woken_on_battery': len(woken) - len(wakes),
+            'wake_from_restore': summarize([at - restored_at for at in wakes]) if restored_at is not None else None,
+            'wol_packets': self._sink.packets,
+            'wol_invalid': self._sink.invalid,
+        }
+
+    def _get_log_path(self) -> str:
+        return os.path.join(self._workdir, 'sentinel-hl.log')
+
+    def _get_free_port(self) -> int:
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+            sock.bind(('127.0.0.1', 0))
+            return sock.getsockname()[1]
+
+def summarize(values: list[float]) -> dict | None:
+    if not values:
+        return None
+
+    values = sorted(values)
+
+    return {
+        'first': round(values[0], 3),
+        'p50': round(values[len(values) // 2], 3),
+        'p95': round(values[min(len(values) - 1, math.ceil(len(values) * 0.95) - 1)], 3),
+        'last': round(values[-1], 3),
+    }
+
+def print_report(report: dict, prefix: str = '') -> None:
+    for key, value in report.items():
+        if isinstance(value, dict):
+            print(f'{prefix}{key}:')
+            print_report(value, prefix + '  ')
+        elif isinstance(value, float):
+            print(f'{prefix}{key}: {round(value, 4)}')
+        else:
+            print(f'{prefix}{key}: {"-" if value is None else value}')
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Run the sentinel-hl daemon against a simulated fleet, offline')
+
+    parser.add_argument('--hosts', type=int, default=100, help='Number of simulated hosts. Default is 100')
+    parser.add_argument('--ups', type=int, default=1, help='Number of simulated UPS units, hosts are spread across them. Default is 1')
+    parser.add_argument('--scenario', choices=['steady', 'power-loss'], default='steady', help='steady keeps the UPS on line power, power-loss discharges it below the threshold and restores it. Default is steady')
+    parser.add_argument('--trace', help='JSON keyframes replacing the scenario trace, see upsd.py')
+    parser.add_argument('--duration', type=float, default=60, help='Seconds to run once the daemon is ready. Default is 60')
+    parser.add_argument('--discharge', type=float, default=20, help='Seconds on battery in the power-loss scenario. Default is 20')
+    parser.add_argument('--threshold', type=int, default=30, help='Shutdown threshold in %% of charge. Default is 30')
+    parser.add_argument('--wake-cooldown', type=int, default=5, help='Seconds on line power before hosts are woken. Default is 5')
+    parser.add_argument('--check-interval', type=int, default=30, help='Base host check interval. Default is 30')
+    parser.add_argument('--concurrency', type=int, default=32, help='Host check and command concurrency. Default is 32')
+    parser.add_argument('--latency', type=float, default=0.005, help='Seconds every ping / ssh shim takes. Default is 0.005')
+    parser.add_argument('--jitter', type=float, default=0.005, help='Random extra seconds added to the shim latency. Default is 0.005')
+    parser.add_argument('--failure-rate', type=float, default=0, help='Share of ping / ssh shim calls failing. Default is 0')
+    parser.add_argument('--down-rate', type=float, default=0, help='Share of hosts down at start. Default is 0')
+    parser.add_argument('--shutdown-delay', type=float, default=1, help='Seconds a host keeps answering after "shutdown now". Default is 1')
+    parser.add_argument('--boot-delay', type=float, default=2, help='Seconds a woken host takes to answer. Default is 2')
+    parser.add_argument('--icmp', choices=['shim', 'socket'], default='shim', help='Probe through the ping shim or the in-process ICMP prober (every host answers). Default is shim')
+    parser.add_argument('--datastore', choices=['shelve', 'sqlite'], default='shelve', help='Datastore backend of the daemon. Default is shelve')
+    parser.add_argument('--stop-timeout', type=float, default=60, help='Seconds to wait for the daemon to exit once signalled. Default is 60')
+    parser.add_argument('--watchdog', type=int, default=10, help='Simulated systemd WatchdogSec. Default is 10')
+    parser.add_argument('--seed', type=int, help='Seed picking the hosts down at start')
+    parser.add_argument('--workdir', help='Work directory, kept after the run. Default is a temporary directory')
+    parser.add_argument('--keep', action='store_true', help='Keep the temporary work directory')
+    parser.add_argument('--log-level', default='INFO', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'], help='Log level of the daemon. Default is INFO')
+    parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+
+    args = parser.parse_args()
+
+    if args.hosts < 1 or args.ups < 1:
+        parser.error('--hosts and --ups must be at least 1')
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(message)s', stream=sys.stderr)
+
+    benchmark = Benchmark(args)
+
+    try:
+        report = asyncio.run(benchmark.run())
+    except RuntimeError as e:
+        # the work directory is kept, the daemon log tells what went wrong
+        logger.error(str(e))
+        sys.exit(1)
+
+    benchmark.cleanup()
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,15 @@
+# sourced by the shims: sets $state, sleeps the simulated latency and sets $failed at the configured failure rate
+state=$SENTINEL_HL_BENCH_STATE
+latency=${SENTINEL_HL_BENCH_LATENCY:-0}
+failed=0
+
+if [ "${SENTINEL_HL_BENCH_JITTER:-0}" != 0 ] || [ "${SENTINEL_HL_BENCH_FAILURE_RATE:-0}" != 0 ]; then
+    # seeded with the pid, shims started within the same second must not draw the same numbers
+    read latency failed <<EOF_RANDOM
+$(awk -v seed=$$ -v latency="$latency" -v jitter="${SENTINEL_HL_BENCH_JITTER:-0}" -v rate="${SENTINEL_HL_BENCH_FAILURE_RATE:-0}" 'BEGIN { srand(seed); printf "%.6f %d\n", latency + rand() * jitter, rand() < rate }')
+EOF_RANDOM
+fi
+
+if [ "$latency" != 0 ]; then
+    sleep "$latency"
+fi
@@ -0,0 +1,182 @@
+import logging
+import asyncio
+import json
+import sys
+from bisect import bisect_right
+from typing import Callable
+
+__all__ = ['Trace', 'FakeUpsd']
+
+class Trace:
+    # keyframes of UPS variables over time, e.g. {"t": 10, "ups.status": "OB DISCHRG", "battery.charge": 100}.
+    # numeric variables are interpolated between the keyframes defining them, the others keep their last value
+    def __init__(self, keyframes: list[dict]):
+        if not keyframes:
+            raise ValueError('A trace needs at least one keyframe')
+
+        self._keyframes: list[dict] = sorted(keyframes, key=lambda keyframe: keyframe['t'])
+        self._times: list[float] = [keyframe['t'] for keyframe in self._keyframes]
+
+    @classmethod
+    def load(cls, path: str) -> 'Trace':
+        with open(path, 'r') as f:
+            return cls(json.load(f))
+
+    @property
+    def duration(self) -> float:
+        return self._times[-1]
+
+    def find(self, predicate: Callable[[dict[str, str]], bool], *, after: float = 0, step: float = 0.01) -> float | None:
+        # first time from `after` at which the reported variables match, used to time the power events
+        for index in range(int((self.duration - after) / step) + 2):
+            t = round(after + index * step, 6)
+
+            if predicate(self.at(t)):
+                return t
+
+        return None
+
+    def at(self, t: float) -> dict[str, str]:
+        index = bisect_right(self._times, t)
+        values: dict[str, str] = {}
+
+        for keyframe in self._keyframes[:max(index, 1)]:
+            for name, value in keyframe.items():
+                if name != 't':
+                    values[name] = value
+
+        # linear interpolation towards the next keyframe defining the same numeric variable
+        for name, value in list(values.items()):
+            if not isinstance(value, (int, float)):
+                continue
+
+            start = next(keyframe for keyframe in reversed(self._keyframes[:max(index, 1)]) if name in keyframe)
+            end = next((keyframe for keyframe in self._keyframes[index:] if isinstance(keyframe.get(name), (int, float))), None)
+
+            if end is not None and end['t'] > start['t'] and t > start['t']:
+                share = (t - start['t']) / (end['t'] - start['t'])
+                values[name] = value + (end[name] - value) * share
+
+        return {name: self._format(value) for name, value in values.items()}
+
+    def _format(self, value) -> str:
+        if isinstance(value, float):
+            return f'{value:.1f}'.rstrip('0').rstrip('.')
+
+        return str(value)
+
+class FakeUpsd:
+    # speaks enough of the NUT protocol for sentinel-hl: LIST VAR, GET VAR, LIST UPS, VER and LOGOUT
+    def __init__(self, traces: dict[str, Trace], *, host: str = '127.0.0.1', port: int = 0, logger: logging.Logger | None = None):
+        self._traces: dict[str, Trace] = traces
+        self._host: str = host
+        self._port: int = port
+        self._logger: logging.Logger = logger or logging.getLogger(__name__)
+
+        self._server: asyncio.AbstractServer | None = None
+        self._started: float | None = None
+
+        self.commands: int = 0
+        self.connections: int = 0
+
+    @property
+    def port(self) -> int:
+        return self._port
+
+    def start_clock(self) -> None:
+        # the traces run from here, until then every UPS reports its first keyframe
+        self._started = asyncio.get_running_loop().time()
+
+    @property
+    def elapsed(self) -> float:
+        if self._started is None:
+            return 0.0
+
+        return asyncio.get_running_loop().time() - self._started
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self._serve, self._host, self._port)
+        self._port = self._server.sockets[0].getsockname()[1]
+
+        self._logger.debug(f'Fake upsd listening on {self._host}:{self._port}')
+
+    async def close(self) -> None:
+        if self._server is None:
+            return
+
+        self._server.close()
+        await self._server.wait_closed()
+        self._server = None
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.connections += 1
+
+        try:
+            while line := await reader.readline():
+                command = line.decode().strip()
+                self.commands += 1
+
+                if command == 'LOGOUT':
+                    writer.write(b'OK Goodbye\n')
+                    break
+
+                writer.write(self._respond(command).encode())
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    def _respond(self, command: str) -> str:
+        parts = command.split(' ')
+
+        if parts == ['VER']:
+            return 'Network UPS Tools upsd 2.8.0 - fake\n'
+
+        if parts == ['LIST', 'UPS']:
+            lines = [f'UPS {name} "Simulated UPS"' for name in self._traces]
+            return '\n'.join([f'BEGIN {command}', *lines, f'END {command}']) + '\n'
+
+        if len(parts) < 3 or parts[1] != 'VAR':
+            return 'ERR UNKNOWN-COMMAND\n'
+
+        trace = self._traces.get(parts[2])
+
+        if trace is None:
+            return 'ERR UNKNOWN-UPS\n'
+
+        values = trace.at(self.elapsed)
+
+        if parts[0] == 'LIST' and len(parts) == 3:
+            lines = [f'VAR {parts[2]} {name} "{value}"' for name, value in values.items()]
+            return '\n'.join([f'BEGIN {command}', *lines, f'END {command}']) + '\n'
+
+        if parts[0] == 'GET' and len(parts) == 4:
+            if parts[3] not in values:
+                return 'ERR VAR-NOT-SUPPORTED\n'
+
+            return f'VAR {parts[2]} {parts[3]} "{values[parts[3]]}"\n'
+
+        return 'ERR INVALID-ARGUMENT\n'
+
+async def main(argv: list[str]) -> None:
+    # standalone: python benchmarks/upsd.py <port> <ups>=<trace.json> ...
+    traces = {name: Trace.load(path) for name, path in (arg.split('=', 1) for arg in argv[1:])}
+    upsd = FakeUpsd(traces, port=int(argv[0]))
+
+    await upsd.start()
+    upsd.start_clock()
+
+    print(f'Fake upsd listening on 127.0.0.1:{upsd.port}', flush=True)
+
+    await asyncio.Event().wait()
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print('Usage: upsd.py <port> <ups>=<trace.json> [...]', file=sys.stderr)
+        sys.exit(2)
+
+    try:
+        asyncio.run(main(sys.argv[1:]))
+    except KeyboardInterrupt:
+        pass
@@ -1,5 +1,6 @@
 import sys
 import os
+import json
 import argparse
 from pydantic import ValidationError
 from sentinel_hl.manager import SentinelHlManager
@@ -33,6 +34,12 @@ def main():
     clear_ack_parser = subparsers.add_parser('clear-ack', help='Clear acknowledged host')
     clear_ack_parser.add_argument('host', nargs=1, help='Host to clear acknowledgment')
 
+    status_parser = subparsers.add_parser('status', help='Show hosts status of the running daemon')
+    
+    ups_parser = subparsers.add_parser('ups', help='Show UPS units data of the running daemon')
+    
+    pending_parser = subparsers.add_parser('pending', help='Show wake / shutdown operations in progress')
+
     args = parser.parse_args()
     
     try:
@@ -58,6 +65,12 @@ def main():
         sentinel_hl.ack_host(args.host[0])
     elif args.command == 'clear-ack':
         sentinel_hl.ack_host(args.host[0], clear=True)
+    elif args.command in ('status', 'ups', 'pending'):
+        try:
+            print(json.dumps(sentinel_hl.query(args.command), indent=2))
+        except SentinelHlRuntimeError as e:
+            print(e, file=sys.stderr)
+            sys.exit(1)
     elif args.command is None:
         sentinel_hl.run_once()
 
@@ -0,0 +1,117 @@
+import logging
+import asyncio
+from typing import Awaitable, Callable
+from sentinel_hl.libraries.scheduler import Scheduler
+
+__all__ = ['AckTracker']
+
+# hosts due within this many seconds of each other are probed together
+ACK_PROBE_COALESCE = 0.25
+ACK_PROBE_GROWTH = 1.5
+
+class AckExpectation:
+    def __init__(self, status: str, probe: Callable[[], Awaitable[str | None]], deadline: float, interval: float, future: asyncio.Future):
+        self.status: str = status
+        self.probe: Callable[[], Awaitable[str | None]] = probe
+        self.deadline: float = deadline
+        self.interval: float = interval
+        self.future: asyncio.Future = future
+
+class AckTracker:
+    def __init__(self, *, interval: float = 1, interval_max: float = 5, logger: logging.Logger | None = None):
+        self._interval: float = interval
+        self._interval_max: float = max(interval, interval_max)
+        self._logger: logging.Logger = logger or logging.getLogger(__name__)
+
+        self._scheduler: Scheduler = Scheduler(coalesce=min(ACK_PROBE_COALESCE, interval / 4))
+        self._pending: dict[str, AckExpectation] = {}
+        self._task: asyncio.Task | None = None
+        self._probes: set[asyncio.Task] = set()
+
+    @property
+    def pending(self) -> dict[str, tuple[str, float]]:
+        # (desired status, seconds left) of every pending expectation
+        now = asyncio.get_event_loop().time()
+
+        return {key: (expectation.status, max(0.0, expectation.deadline - now)) for key, expectation in self._pending.items()}
+
+    def expect(self, key: str, status: str, probe: Callable[[], Awaitable[str | None]], *, timeout: float) -> asyncio.Future:
+        # the returned future resolves to True once `probe` returns `status`, or to False when the deadline passes.
+        # a new expectation for the same key replaces (and cancels) the previous one
+        loop = asyncio.get_running_loop()
+
+        self.cancel(key)
+
+        now = loop.time()
+        expectation = AckExpectation(status, probe, now + timeout, self._interval, loop.create_future())
+
+        self._pending[key] = expectation
+        self._scheduler.schedule(key, min(now + self._interval, expectation.deadline))
+
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+        return expectation.future
+
+    def cancel(self, key: str) -> None:
+        expectation = self._pending.pop(key, None)
+
+        if expectation is None:
+            return
+
+        self._scheduler.unschedule(key)
+
+        if not expectation.future.done():
+            expectation.future.cancel()
+
+    def close(self) -> None:
+        for key in list(self._pending):
+            self.cancel(key)
+
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+        for task in list(self._probes):
+            task.cancel()
+
+    async def _run(self) -> None:
+        while self._pending:
+            due = await self._scheduler.wait_due()
+
+            # each probe reschedules its own key, a slow one doesn't hold back the keys due in the meantime
+            for key, time in due:
+                task = asyncio.create_task(self._probe(key, time))
+                self._probes.add(task)
+                task.add_done_callback(self._probes.discard)
+
+    async def _probe(self, key: str, due: float) -> None:
+        expectation = self._pending.get(key)
+
+        if expectation is None:
+            return
+
+        try:
+            status = await expectation.probe()
+        except Exception as e:
+            self._logger.debug(f'Ack probe of "{key}" failed: {e}')
+            status = None
+
+        # replaced or cancelled while probing
+        if self._pending.get(key) is not expectation:
+            return
+
+        now = asyncio.get_running_loop().time()
+
+        # the last probe is scheduled at the deadline, it may be released slightly early
+        if status == expectation.status or due >= expectation.deadline or now >= expectation.deadline:
+            del self._pending[key]
+
+            if not expectation.future.done():
+                expectation.future.set_result(status == expectation.status)
+
+            return
+
+        # hosts that take long to come up or go down are probed less and less often
+        expectation.interval = min(expectation.interval * ACK_PROBE_GROWTH, self._interval_max)
+        self._scheduler.schedule(key, min(now + expectation.interval, expectation.deadline))
@@ -1,8 +1,20 @@
 import logging
 import asyncio
 import shlex
+import signal
+import time
+import os
+from sentinel_hl.libraries.icmp import IcmpProber, IcmpError, IcmpUnavailableError
+from sentinel_hl.libraries.metrics import histogram
 
-__all__ = ['CmdExec', 'CmdExecHost', 'CmdExecError', 'CmdExecProcessError']
+__all__ = ['CmdExec', 'CmdExecHost', 'CmdExecStats', 'CmdExecError', 'CmdExecProcessError', 'CmdExecTimeoutError']
+
+# commands running longer than this are killed, unless the caller gives its own timeout
+DEFAULT_TIMEOUT = 60
+# maximum number of subprocesses running at once, see CmdExec.configure_limit
+DEFAULT_LIMIT = 32
+
+EXEC_DURATION = histogram('sentinel_hl_command_duration_seconds', 'Duration of the commands run by the daemon (ssh, ping, ...).', ('command',))
 
 class CmdExecError(Exception):
     pass
@@ -12,6 +24,29 @@ class CmdExecProcessError(Exception):
         super().__init__(message)
         self.code = code
         
+class CmdExecTimeoutError(CmdExecProcessError):
+    pass
+
+class CmdExecStats:
+    def __init__(self):
+        self.count: int = 0
+        self.failures: int = 0
+        self.timeouts: int = 0
+        self.total_time: float = 0.0
+        self.max_time: float = 0.0
+        
+    def add(self, elapsed: float, *, failed: bool = False, timed_out: bool = False) -> None:
+        self.count += 1
+        self.failures += int(failed)
+        self.timeouts += int(timed_out)
+        self.total_time += elapsed
+        self.max_time = max(self.max_time, elapsed)
+        
+    def __repr__(self):
+        average = self.total_time / self.count if self.count else 0
+        
+        return f'CmdExecStats(count={self.count}, failures={self.failures}, timeouts={self.timeouts}, avg={average:.3f}s, max={self.max_time:.3f}s)'
+        
 class CmdExecHost:
     def __init__(self, host: str, port: int | None = None, user: str | None = None):
         self._host: str = host
@@ -34,26 +69,74 @@ class CmdExecHost:
         return f'CmdExecHost(host={self.host}, port={self.port}, user={self.user})'
 
 class CmdExec:
+    # extra ssh options for every remote command, see configure_ssh
+    _ssh_opts: list[str] = []
+    
+    _limit: int = DEFAULT_LIMIT
+    _semaphore: asyncio.Semaphore | None = None
+    _semaphore_loop: asyncio.AbstractEventLoop | None = None
+    
+    # execution time per command type (e.g. "ping", "ssh shutdown")
+    _stats: dict[str, CmdExecStats] = {}
+    
+    @classmethod
+    def configure_ssh(cls, options: list[str]) -> None:
+        cls._ssh_opts = list(options)
+        
+    @classmethod
+    def configure_limit(cls, limit: int) -> None:
+        if limit < 1:
+            raise ValueError('Subprocess limit must be at least 1')
+        
+        cls._limit = limit
+        cls._semaphore = None
+        
+    @classmethod
+    def get_stats(cls) -> dict[str, CmdExecStats]:
+        return dict(cls._stats)
+    
     @classmethod
-    async def exec(cls, cmd: list, *, host: CmdExecHost | None = None, input: str = '', env=None, stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE) -> str:
+    async def exec(cls, cmd: list, *, host: CmdExecHost | None = None, input: str = '', env=None, timeout: float | None = DEFAULT_TIMEOUT, stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE) -> str:
+        kind = f'ssh {cmd[0]}' if host and cmd else str(cmd[0]) if cmd else ''
+        
         if host:
             cmd = cls._gen_ssh_cmd(cmd, host)
         
+        async with cls._get_semaphore():
+            return await cls._exec(cmd, kind, input=input, env=env, timeout=timeout, stdin=stdin, stdout=stdout, stderr=stderr)
+    
+    @classmethod
+    async def _exec(cls, cmd: list, kind: str, *, input: str, env, timeout: float | None, stdin, stdout, stderr) -> str:
         logging.debug(f'Executing command: {[*cmd]}')
         
         if not env:
             env = None
+            
+        started = time.monotonic()
 
-        process = await asyncio.create_subprocess_exec(*cmd, stdin=stdin, stdout=stdout, stderr=stderr, env=env)
-
-        if input and process.stdin is not None:
-            process.stdin.write(input.encode('utf-8'))
-            process.stdin.close()
+        # in its own session, so a timeout / cancellation can kill every process it started
+        process = await asyncio.create_subprocess_exec(*cmd, stdin=stdin, stdout=stdout, stderr=stderr, env=env, start_new_session=True)
 
-        out, err = await process.communicate()
+        try:
+            if input and process.stdin is not None:
+                process.stdin.write(input.encode('utf-8'))
+                process.stdin.close()
+                
+            out, err = await asyncio.wait_for(process.communicate(), timeout=timeout)
+        except asyncio.TimeoutError:
+            await cls._kill(process)
+            cls._record(kind, started, timed_out=True)
+            raise CmdExecTimeoutError(f'Command timed out after {timeout}s', None)
+        except BaseException:
+            # cancelled (or failed), the process must not outlive its caller
+            await cls._kill(process)
+            cls._record(kind, started, failed=True)
+            raise
+        
+        cls._record(kind, started, failed=process.returncode != 0)
         
         if process.returncode != 0:
-            raise CmdExecProcessError(err.decode('utf-8').strip(), process.returncode)
+            raise CmdExecProcessError(err.decode('utf-8').strip() if err else '', process.returncode)
 
         result = ''
 
@@ -63,22 +146,85 @@ class CmdExec:
         return result
     
     @classmethod
-    async def ping(cls, host: str, count: int = 3, timeout: int = 5) -> None:
-        await cls.exec(['ping', '-c', str(count), '-W', str(timeout), host])
+    async def ping(cls, host: str, count: int = 3, timeout: float = 5) -> None:
+        try:
+            rtt = await IcmpProber.get().ping(host, count=count, timeout=timeout)
+        except IcmpUnavailableError as e:
+            # no ICMP socket available to this process, use the system ping binary instead
+            logging.debug(f'{e}. Falling back to ping command')
+            await cls.exec(['ping', '-c', str(count), '-W', str(timeout), host], timeout=count * (timeout + 1) + 1)
+            return
+        except IcmpError as e:
+            raise CmdExecProcessError(str(e), 2)
+        
+        if rtt is None:
+            raise CmdExecProcessError(f'No ICMP echo reply from {host}', 1)
+        
+    @classmethod
+    def _get_semaphore(cls) -> asyncio.Semaphore:
+        # semaphores belong to a loop, a new one is needed when the daemon restarts its loop
+        loop = asyncio.get_running_loop()
+        
+        if cls._semaphore is None or cls._semaphore_loop is not loop:
+            cls._semaphore = asyncio.Semaphore(cls._limit)
+            cls._semaphore_loop = loop
+            
+        return cls._semaphore
+    
+    @classmethod
+    async def _kill(cls, process: asyncio.subprocess.Process) -> None:
+        if process.returncode is not None:
+            return
+        
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+        
+        try:
+            await asyncio.wait_for(asyncio.shield(process.wait()), timeout=5)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            logging.debug(f'Process {process.pid} did not exit after being killed')
+            
+    @classmethod
+    def _record(cls, kind: str, started: float, *, failed: bool = False, timed_out: bool = False) -> None:
+        elapsed = time.monotonic() - started
+        
+        if kind not in cls._stats:
+            cls._stats[kind] = CmdExecStats()
+            
+        cls._stats[kind].add(elapsed, failed=failed or timed_out, timed_out=timed_out)
+        EXEC_DURATION.observe(elapsed, kind)
+        
+        logging.debug(f'Command "{kind}" finished in {elapsed:.3f}s')
+    
+    @classmethod
+    async def ssh(cls, host: CmdExecHost, ssh_opts: list[str], **kwargs) -> str:
+        # runs ssh without a remote command (e.g. -O check), only with the given options
+        return await cls.exec(['ssh', *cls._gen_ssh_opts(host, ssh_opts), cls._gen_ssh_remote(host)], **kwargs)
         
     @classmethod
     def _gen_ssh_cmd(cls, cmd: list, host: CmdExecHost) -> list:
         if not cmd or not host:
             raise CmdExecError("Command or host not specified")
 
-        ssh_opts = ['-o', 'PasswordAuthentication=No', '-o', 'BatchMode=yes']
+        return ['ssh', *cls._gen_ssh_opts(host, cls._ssh_opts), cls._gen_ssh_remote(host), 'exec', shlex.join(cmd)]
+    
+    @classmethod
+    def _gen_ssh_opts(cls, host: CmdExecHost, extra: list[str]) -> list:
+        # ssh keeps the first value given for an option, extra options come first
+        ssh_opts = [*extra, '-o', 'PasswordAuthentication=No', '-o', 'BatchMode=yes']
 
         if host.port is not None:
             ssh_opts += ['-p', str(host.port)]
-
+            
+        return ssh_opts
+    
+    @classmethod
+    def _gen_ssh_remote(cls, host: CmdExecHost) -> str:
         remote = host.host
         
         if host.user is not None:
             remote = f"{host.user}@{remote}"
 
-        return ['ssh', *ssh_opts, remote, 'exec', shlex.join(cmd)]
\ No newline at end of file
+        return remote
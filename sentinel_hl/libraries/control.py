@@ -0,0 +1,129 @@
+import logging
+import asyncio
+import json
+import inspect
+import os
+from typing import Any, Callable
+
+__all__ = ['ControlServer', 'ControlClient', 'ControlError', 'ControlUnavailableError']
+
+# a request or response is a single JSON object per line
+CONTROL_LINE_LIMIT = 1024 * 1024
+CONTROL_TIMEOUT = 5
+
+class ControlError(Exception):
+    pass
+
+class ControlUnavailableError(ControlError):
+    pass
+
+class ControlServer:
+    def __init__(self, path: str, handlers: dict[str, Callable[..., Any]], *, logger: logging.Logger | None = None):
+        self._path: str = path
+        self._handlers: dict[str, Callable[..., Any]] = handlers
+        self._logger: logging.Logger = logger or logging.getLogger(__name__)
+
+        self._server: asyncio.AbstractServer | None = None
+
+    async def start(self) -> None:
+        directory = os.path.dirname(self._path)
+
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        # left behind by a daemon that did not stop cleanly, the pid file already guards against a second daemon
+        if os.path.exists(self._path):
+            os.remove(self._path)
+
+        self._server = await asyncio.start_unix_server(self._serve, path=self._path, limit=CONTROL_LINE_LIMIT)
+
+        # commands change the daemon state, only its user may send them
+        os.chmod(self._path, 0o600)
+
+        self._logger.debug(f'Control socket listening on {self._path}')
+
+    async def close(self) -> None:
+        if self._server is None:
+            return
+
+        self._server.close()
+        await self._server.wait_closed()
+        self._server = None
+
+        try:
+            os.remove(self._path)
+        except FileNotFoundError:
+            pass
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while line := await reader.readline():
+                writer.write(json.dumps(await self._handle(line)).encode() + b'\n')
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError) as e:
+            self._logger.debug(f'Control connection closed: {e}')
+        finally:
+            writer.close()
+
+    async def _handle(self, line: bytes) -> dict:
+        try:
+            request = json.loads(line)
+            command = request.pop('command')
+        except (ValueError, KeyError, AttributeError, TypeError):
+            return {'ok': False, 'error': 'Invalid request'}
+
+        handler = self._handlers.get(command)
+
+        if handler is None:
+            return {'ok': False, 'error': f'Unknown command "{command}"'}
+
+        # checked up front, a TypeError raised inside the handler is a bug to log, not a bad request
+        try:
+            inspect.signature(handler).bind(**request)
+        except TypeError:
+            return {'ok': False, 'error': f'Invalid arguments for command "{command}"'}
+
+        try:
+            result = handler(**request)
+
+            if asyncio.iscoroutine(result):
+                result = await result
+        except ControlError as e:
+            return {'ok': False, 'error': str(e)}
+        except Exception as e:
+            self._logger.exception(e)
+            return {'ok': False, 'error': f'Command "{command}" failed: {e}'}
+
+        return {'ok': True, 'result': result}
+
+class ControlClient:
+    def __init__(self, path: str, *, timeout: float = CONTROL_TIMEOUT):
+        self._path: str = path
+        self._timeout: float = timeout
+
+    async def request(self, command: str, **args) -> Any:
+        # raises ControlUnavailableError when no daemon is listening, ControlError when the command failed
+        try:
+            reader, writer = await asyncio.wait_for(asyncio.open_unix_connection(self._path, limit=CONTROL_LINE_LIMIT), timeout=self._timeout)
+        except (FileNotFoundError, ConnectionRefusedError, asyncio.TimeoutError) as e:
+            raise ControlUnavailableError(f'Daemon is not listening on {self._path}: {e or "timeout"}')
+
+        try:
+            writer.write(json.dumps({'command': command, **args}).encode() + b'\n')
+            await writer.drain()
+
+            line = await asyncio.wait_for(reader.readline(), timeout=self._timeout)
+        except (ConnectionError, asyncio.TimeoutError) as e:
+            raise ControlError(f'No response from daemon: {e or "timeout"}')
+        finally:
+            writer.close()
+
+        try:
+            response = json.loads(line)
+        except ValueError:
+            raise ControlError('Invalid response from daemon')
+
+        if not response.get('ok'):
+            raise ControlError(response.get('error', 'Unknown error'))
+
+        return response.get('result')
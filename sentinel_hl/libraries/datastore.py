@@ -1,40 +1,172 @@
-import shelve
+import copy
+import time
 from typing import Any
+from sentinel_hl.libraries.datastore_backends import ShelveBackend, SqliteBackend
 
 class Datastore:
-    def __init__(self, filename: str):
+    def __init__(self, filename: str, *, backend: ShelveBackend | SqliteBackend | None = None, write_behind: bool = False):
         self._filename = filename
+        self._backend: ShelveBackend | SqliteBackend = backend or ShelveBackend(filename)
+        self._write_behind = write_behind
+
+        # in memory state, only used in write behind mode
+        self._data: dict[str, Any] | None = None
+        # records as they were last read from / written to the backend
+        self._synced: dict[str, Any] = {}
+        self._dirty: set[str] = set()
+        self._deleted: set[str] = set()
+
+        # history rows waiting to be written
+        self._transitions: list[tuple] = []
+        self._samples: list[tuple] = []
+
+    @property
+    def dirty(self) -> bool:
+        return bool(self._dirty or self._deleted or self._transitions or self._samples)
+
+    def reload(self) -> set[str]:
+        # picks up the records another process (e.g. the CLI) changed since they were last read or written,
+        # local changes to every other record are kept. Returns the keys that were replaced.
+        if not self._write_behind or self._data is None:
+            return set()
+
+        stored = self._backend.read_all()
+        changed = {key for key in stored.keys() | self._synced.keys() if stored.get(key) != self._synced.get(key)}
+
+        for key in changed:
+            if key in stored:
+                self._data[key] = stored[key]
+                self._synced[key] = copy.deepcopy(stored[key])
+            else:
+                self._data.pop(key, None)
+                self._synced.pop(key, None)
+
+            self._dirty.discard(key)
+            self._deleted.discard(key)
+
+        return changed
 
     def get(self, key: str, default: Any = None) -> Any:
-        with shelve.open(self._filename) as db:
-            if key in db:
-                return dict(db[key])
+        if self._write_behind:
+            data = self._load()
+
+            if key in data:
+                return copy.deepcopy(data[key])
             else:
                 return default
 
-    def set(self, key: str, value: Any) -> None:
-        with shelve.open(self._filename) as db:
-            db[key] = value
-            
+        try:
+            return dict(self._backend.read(key))
+        except KeyError:
+            return default
+
+    def set(self, key: str, value: Any, *, flush: bool = False, fsync: bool = False) -> None:
+        if self._write_behind:
+            data = self._load()
+
+            # unchanged records are not written again
+            if key not in data or data[key] != value:
+                data[key] = copy.deepcopy(value)
+                self._dirty.add(key)
+                self._deleted.discard(key)
+
+            if flush or fsync:
+                self.flush(fsync=fsync)
+
+            return
+
+        self._backend.write({key: value}, set(), fsync=fsync)
+
     def delete(self, key: str):
-        with shelve.open(self._filename) as db:
-            if key in db:
-                del db[key]
-            else:
+        if self._write_behind:
+            data = self._load()
+
+            if key not in data:
                 raise KeyError(f"Key '{key}' not found in datastore.")
-            
+
+            del data[key]
+            self._dirty.discard(key)
+            self._deleted.add(key)
+            return
+
+        try:
+            self._backend.delete(key)
+        except KeyError:
+            raise KeyError(f"Key '{key}' not found in datastore.")
+
     def clear(self) -> None:
-        with shelve.open(self._filename) as db:
-            db.clear()
+        self._data = {} if self._write_behind else None
+        self._synced = {}
+        self._dirty.clear()
+        self._deleted.clear()
+
+        self._backend.clear()
+
+    def record_status_transition(self, name: str, previous: str | None, status: str) -> None:
+        self._transitions.append((name, time.time(), previous, status))
+
+        if not self._write_behind:
+            self.flush()
+
+    def record_ups_sample(self, name: str, status: str, charge: float | None, load: float | None, voltage: float | None, runtime: float | None) -> None:
+        self._samples.append((name, time.time(), status, charge, load, voltage, runtime))
+
+        if not self._write_behind:
+            self.flush()
+
+    def prune_history(self, max_age: int) -> None:
+        self._backend.prune(time.time() - max_age)
+
+    def flush(self, *, fsync: bool = False) -> None:
+        # writes every changed record in a single batch, records are always replaced whole
+        if not self.dirty:
+            return
+
+        if self._dirty or self._deleted:
+            data = self._load()
+
+            self._backend.write({key: data[key] for key in self._dirty}, set(self._deleted), fsync=fsync)
+
+            for key in self._dirty:
+                self._synced[key] = copy.deepcopy(data[key])
+
+            for key in self._deleted:
+                self._synced.pop(key, None)
+
+            self._dirty.clear()
+            self._deleted.clear()
+
+        if self._transitions or self._samples:
+            self._backend.append_history(self._transitions, self._samples)
+
+            self._transitions = []
+            self._samples = []
+
+    def close(self) -> None:
+        self.flush()
+        self._backend.close()
 
     def keys(self) -> list[str]:
-        with shelve.open(self._filename) as db:
-            return list(db.keys())
+        if self._write_behind:
+            return list(self._load().keys())
+
+        return list(self._backend.read_all().keys())
 
     def items(self) -> list[tuple[str, Any]]:
-        with shelve.open(self._filename) as db:
-            return list(db.items())
+        if self._write_behind:
+            return copy.deepcopy(list(self._load().items()))
+
+        return list(self._backend.read_all().items())
 
     def values(self) -> list[Any]:
-        with shelve.open(self._filename) as db:
-            return list(db.values())
\ No newline at end of file
+        if self._write_behind:
+            return copy.deepcopy(list(self._load().values()))
+
+        return list(self._backend.read_all().values())
+
+    def _load(self) -> dict[str, Any]:
+        if self._data is None:
+            self._data = self._backend.read_all()
+            self._synced = copy.deepcopy(self._data)
+
+        return self._data
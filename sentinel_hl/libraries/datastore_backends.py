@@ -0,0 +1,219 @@
+import os
+import glob
+import json
+import time
+import shelve
+import sqlite3
+import logging
+from typing import Any
+
+__all__ = ['ShelveBackend', 'SqliteBackend']
+
+class ShelveBackend:
+    def __init__(self, filename: str):
+        self._filename: str = filename
+
+    def read(self, key: str) -> Any:
+        with shelve.open(self._filename) as db:
+            return db[key]
+
+    def read_all(self) -> dict[str, Any]:
+        with shelve.open(self._filename) as db:
+            return {key: db[key] for key in db.keys()}
+
+    def write(self, upserts: dict[str, Any], deletes: set[str], *, fsync: bool = False) -> None:
+        with shelve.open(self._filename) as db:
+            for key in deletes:
+                if key in db:
+                    del db[key]
+
+            for key, value in upserts.items():
+                db[key] = value
+
+        if fsync:
+            self._fsync()
+
+    def delete(self, key: str) -> None:
+        with shelve.open(self._filename) as db:
+            del db[key]
+
+    def clear(self) -> None:
+        with shelve.open(self._filename) as db:
+            db.clear()
+
+    def append_history(self, transitions: list[tuple], samples: list[tuple]) -> None:
+        # shelve keeps no history
+        pass
+
+    def prune(self, before: float) -> None:
+        pass
+
+    def close(self) -> None:
+        # the file is only open for the duration of each call
+        pass
+
+    def _fsync(self) -> None:
+        # depending on the dbm backend, the shelve is made of one or more files
+        for filename in glob.glob(glob.escape(self._filename) + '*'):
+            fd = os.open(filename, os.O_RDONLY)
+
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+        fd = os.open(os.path.dirname(self._filename) or '.', os.O_RDONLY)
+
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+class SqliteBackend:
+    # typed columns extracted from the records of each store, the full record is kept as JSON
+    STORES = {
+        'hosts': ('host_state', ['status', 'ip', 'mac', 'ack']),
+        'ups': ('ups_state', ['hosts_halted']),
+    }
+
+    SCHEMA = [
+        'CREATE TABLE IF NOT EXISTS host_state (name TEXT PRIMARY KEY, status TEXT, ip TEXT, mac TEXT, ack INTEGER, value TEXT NOT NULL, updated_at REAL NOT NULL)',
+        'CREATE TABLE IF NOT EXISTS ups_state (name TEXT PRIMARY KEY, hosts_halted INTEGER, value TEXT NOT NULL, updated_at REAL NOT NULL)',
+        'CREATE TABLE IF NOT EXISTS status_transitions (id INTEGER PRIMARY KEY, host TEXT NOT NULL, at REAL NOT NULL, previous TEXT, status TEXT NOT NULL)',
+        'CREATE INDEX IF NOT EXISTS status_transitions_at ON status_transitions (at)',
+        'CREATE INDEX IF NOT EXISTS status_transitions_host ON status_transitions (host, at)',
+        'CREATE TABLE IF NOT EXISTS ups_samples (id INTEGER PRIMARY KEY, ups TEXT NOT NULL, at REAL NOT NULL, status TEXT, charge REAL, load REAL, voltage REAL, runtime REAL)',
+        'CREATE INDEX IF NOT EXISTS ups_samples_at ON ups_samples (at)',
+        'CREATE INDEX IF NOT EXISTS ups_samples_ups ON ups_samples (ups, at)',
+    ]
+
+    def __init__(self, filename: str, store: str, *, migrate_from: str | None = None, logger: logging.Logger | None = None):
+        if store not in self.STORES:
+            raise ValueError(f'Unknown datastore "{store}"')
+
+        self._filename: str = filename
+        self._table, self._columns = self.STORES[store]
+        self._logger: logging.Logger = logger or logging.getLogger(__name__)
+
+        # autocommit mode, transactions are opened explicitly so a whole batch is committed at once
+        self._db: sqlite3.Connection = sqlite3.connect(filename, timeout=5, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+
+        for statement in self.SCHEMA:
+            self._db.execute(statement)
+
+        columns = ', '.join(['name', *self._columns, 'value', 'updated_at'])
+        placeholders = ', '.join(['?'] * (len(self._columns) + 3))
+
+        self._upsert_sql: str = f'INSERT OR REPLACE INTO {self._table} ({columns}) VALUES ({placeholders})'
+
+        if migrate_from:
+            self._migrate(migrate_from)
+
+    def read(self, key: str) -> Any:
+        row = self._db.execute(f'SELECT value FROM {self._table} WHERE name = ?', (key,)).fetchone()
+
+        if row is None:
+            raise KeyError(key)
+
+        return json.loads(row[0])
+
+    def read_all(self) -> dict[str, Any]:
+        return {name: json.loads(value) for name, value in self._db.execute(f'SELECT name, value FROM {self._table}')}
+
+    def write(self, upserts: dict[str, Any], deletes: set[str], *, fsync: bool = False) -> None:
+        now = time.time()
+        rows = [self._to_row(key, value, now) for key, value in upserts.items()]
+
+        with self._transaction(fsync=fsync):
+            if deletes:
+                self._db.executemany(f'DELETE FROM {self._table} WHERE name = ?', [(key,) for key in deletes])
+
+            if rows:
+                self._db.executemany(self._upsert_sql, rows)
+
+    def delete(self, key: str) -> None:
+        with self._transaction():
+            cursor = self._db.execute(f'DELETE FROM {self._table} WHERE name = ?', (key,))
+
+        if not cursor.rowcount:
+            raise KeyError(key)
+
+    def clear(self) -> None:
+        with self._transaction():
+            self._db.execute(f'DELETE FROM {self._table}')
+
+    def append_history(self, transitions: list[tuple], samples: list[tuple]) -> None:
+        if not transitions and not samples:
+            return
+
+        with self._transaction():
+            if transitions:
+                self._db.executemany('INSERT INTO status_transitions (host, at, previous, status) VALUES (?, ?, ?, ?)', transitions)
+
+            if samples:
+                self._db.executemany('INSERT INTO ups_samples (ups, at, status, charge, load, voltage, runtime) VALUES (?, ?, ?, ?, ?, ?, ?)', samples)
+
+    def prune(self, before: float) -> None:
+        with self._transaction():
+            transitions = self._db.execute('DELETE FROM status_transitions WHERE at < ?', (before,)).rowcount
+            samples = self._db.execute('DELETE FROM ups_samples WHERE at < ?', (before,)).rowcount
+
+        if transitions or samples:
+            self._logger.debug(f'Pruned {transitions} status transition(s) and {samples} UPS sample(s) from history')
+
+    def close(self) -> None:
+        self._db.close()
+
+    def _to_row(self, key: str, value: Any, now: float) -> tuple:
+        typed = []
+
+        for column in self._columns:
+            field = value.get(column) if isinstance(value, dict) else None
+            typed.append(int(field) if isinstance(field, bool) else field)
+
+        return (key, *typed, json.dumps(value), now)
+
+    def _transaction(self, *, fsync: bool = False) -> 'SqliteTransaction':
+        return SqliteTransaction(self._db, fsync=fsync)
+
+    def _migrate(self, shelve_filename: str) -> None:
+        # imports an existing shelve datastore once, the shelve files are kept with a .migrated suffix
+        files = glob.glob(glob.escape(shelve_filename) + '*')
+        files = [file for file in files if not file.endswith('.migrated')]
+
+        if not files:
+            return
+
+        if self._db.execute(f'SELECT COUNT(*) FROM {self._table}').fetchone()[0]:
+            self._logger.warning(f'Not importing {shelve_filename}, {self._table} already has data')
+            return
+
+        records = ShelveBackend(shelve_filename).read_all()
+
+        self.write(records, set(), fsync=True)
+
+        for file in files:
+            os.replace(file, file + '.migrated')
+
+        self._logger.info(f'Imported {len(records)} record(s) from {shelve_filename}')
+
+class SqliteTransaction:
+    def __init__(self, db: sqlite3.Connection, *, fsync: bool = False):
+        self._db: sqlite3.Connection = db
+        self._fsync: bool = fsync
+
+    def __enter__(self) -> None:
+        # in WAL mode, synchronous=FULL syncs the WAL on commit instead of on checkpoint
+        if self._fsync:
+            self._db.execute('PRAGMA synchronous=FULL')
+
+        self._db.execute('BEGIN IMMEDIATE')
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        try:
+            self._db.execute('ROLLBACK' if exc_type else 'COMMIT')
+        finally:
+            if self._fsync:
+                self._db.execute('PRAGMA synchronous=NORMAL')
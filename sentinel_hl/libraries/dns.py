@@ -0,0 +1,175 @@
+import asyncio
+import socket
+import struct
+import random
+
+__all__ = ['DnsClient', 'DnsError', 'DnsNameError']
+
+DNS_HEADER = struct.Struct('!HHHHHH')
+DNS_RR = struct.Struct('!HHIH')
+
+QTYPE_A = 1
+QTYPE_CNAME = 5
+QCLASS_IN = 1
+
+FLAG_RD = 0x0100
+FLAG_TC = 0x0200
+RCODE_NXDOMAIN = 3
+
+class DnsError(Exception):
+    pass
+
+class DnsNameError(DnsError):
+    pass
+
+class DnsClientProtocol(asyncio.DatagramProtocol):
+    def __init__(self, future: asyncio.Future):
+        self._future: asyncio.Future = future
+
+    def datagram_received(self, data: bytes, addr) -> None:
+        if not self._future.done():
+            self._future.set_result(data)
+
+    def error_received(self, exc: Exception) -> None:
+        if not self._future.done():
+            self._future.set_exception(exc)
+
+class DnsClient:
+    @classmethod
+    def get_nameservers(cls, filename: str = '/etc/resolv.conf') -> list[str]:
+        nameservers = []
+
+        try:
+            with open(filename, 'r') as f:
+                for line in f:
+                    fields = line.split()
+
+                    if len(fields) >= 2 and fields[0] == 'nameserver':
+                        nameservers.append(fields[1])
+        except OSError:
+            pass
+
+        return nameservers
+
+    @classmethod
+    async def query_a(cls, name: str, nameservers: list[str], *, timeout: float = 2, port: int = 53) -> tuple[str, int]:
+        # returns the first A record of `name` and the lowest TTL of the answer chain
+        if not nameservers:
+            raise DnsError('No nameservers available')
+
+        errors = []
+
+        for nameserver in nameservers:
+            try:
+                return await cls._query_a(name, nameserver, timeout=timeout, port=port)
+            except DnsNameError:
+                raise
+            except (DnsError, OSError, asyncio.TimeoutError) as e:
+                errors.append(f'{nameserver}: {e or "timeout"}')
+
+        raise DnsError(f'Query for "{name}" failed: {"; ".join(errors)}')
+
+    @classmethod
+    async def _query_a(cls, name: str, nameserver: str, *, timeout: float, port: int) -> tuple[str, int]:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        query_id = random.getrandbits(16)
+        family = socket.AF_INET6 if ':' in nameserver else socket.AF_INET
+
+        transport, _ = await loop.create_datagram_endpoint(lambda: DnsClientProtocol(future), remote_addr=(nameserver, port), family=family)
+
+        try:
+            transport.sendto(cls._build_query(query_id, name))
+            response = await asyncio.wait_for(future, timeout=timeout)
+        finally:
+            transport.close()
+
+        return cls._parse_response(response, query_id, name)
+
+    @classmethod
+    def _build_query(cls, query_id: int, name: str) -> bytes:
+        return DNS_HEADER.pack(query_id, FLAG_RD, 1, 0, 0, 0) + cls._encode_name(name) + struct.pack('!HH', QTYPE_A, QCLASS_IN)
+
+    @classmethod
+    def _encode_name(cls, name: str) -> bytes:
+        encoded = b''
+
+        for label in name.rstrip('.').split('.'):
+            label_bytes = label.encode('idna')
+
+            if not label_bytes or len(label_bytes) > 63:
+                raise DnsError(f'Invalid name "{name}"')
+
+            encoded += bytes([len(label_bytes)]) + label_bytes
+
+        return encoded + b'\x00'
+
+    @classmethod
+    def _parse_response(cls, data: bytes, query_id: int, name: str) -> tuple[str, int]:
+        if len(data) < DNS_HEADER.size:
+            raise DnsError('Short DNS response')
+
+        response_id, flags, qdcount, ancount, _, _ = DNS_HEADER.unpack_from(data)
+
+        if response_id != query_id:
+            raise DnsError('Mismatched DNS response id')
+
+        if flags & FLAG_TC:
+            raise DnsError('Truncated DNS response')
+
+        rcode = flags & 0x000F
+
+        if rcode == RCODE_NXDOMAIN:
+            raise DnsNameError(f'Name "{name}" does not exist')
+
+        if rcode:
+            raise DnsError(f'DNS server returned rcode {rcode}')
+
+        offset = DNS_HEADER.size
+
+        for _ in range(qdcount):
+            offset = cls._skip_name(data, offset) + 4
+
+        ttl = None
+        address = None
+
+        for _ in range(ancount):
+            offset = cls._skip_name(data, offset)
+
+            if offset + DNS_RR.size > len(data):
+                raise DnsError('Malformed DNS response')
+
+            rr_type, rr_class, rr_ttl, rdlength = DNS_RR.unpack_from(data, offset)
+            offset += DNS_RR.size
+            rdata = data[offset:offset + rdlength]
+            offset += rdlength
+
+            if rr_class != QCLASS_IN or rr_type not in (QTYPE_A, QTYPE_CNAME):
+                continue
+
+            ttl = rr_ttl if ttl is None else min(ttl, rr_ttl)
+
+            if rr_type == QTYPE_A and len(rdata) == 4 and address is None:
+                address = socket.inet_ntoa(rdata)
+
+        if address is None or ttl is None:
+            raise DnsNameError(f'No A record found for "{name}"')
+
+        return address, ttl
+
+    @classmethod
+    def _skip_name(cls, data: bytes, offset: int) -> int:
+        while True:
+            if offset >= len(data):
+                raise DnsError('Malformed DNS response')
+
+            length = data[offset]
+
+            # compression pointer, the name ends here
+            if length & 0xC0 == 0xC0:
+                return offset + 2
+
+            offset += 1 + length
+
+            if length == 0:
+                return offset
@@ -0,0 +1,65 @@
+import asyncio
+from typing import Awaitable, Callable
+
+__all__ = ['FanOut', 'FanOutTimeoutError']
+
+class FanOutTimeoutError(Exception):
+    pass
+
+class FanOut:
+    def __init__(self, limit: int, *, timeout: float | None = None):
+        if limit < 1:
+            raise ValueError('Concurrency limit must be at least 1')
+
+        self._limit: int = limit
+        self._timeout: float | None = timeout
+
+        self._elapsed: float = 0.0
+
+    @property
+    def elapsed(self) -> float:
+        return self._elapsed
+
+    async def run(self, jobs: dict[str, Callable[[], Awaitable]]) -> dict[str, BaseException | None]:
+        # returns a map of job id -> None (success) or the exception that ended the job
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+
+        results: dict[str, BaseException | None] = {}
+
+        if not jobs:
+            self._elapsed = 0.0
+            return results
+
+        semaphore = asyncio.Semaphore(self._limit)
+
+        async def _run_job(job: Callable[[], Awaitable]) -> None:
+            async with semaphore:
+                await job()
+
+        tasks = {asyncio.create_task(_run_job(job)): id for id, job in jobs.items()}
+
+        try:
+            done, pending = await asyncio.wait(tasks.keys(), timeout=self._timeout)
+        except asyncio.CancelledError:
+            for task in tasks:
+                task.cancel()
+
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+        for task in pending:
+            task.cancel()
+
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+
+        for task, id in tasks.items():
+            if task in pending:
+                results[id] = FanOutTimeoutError(f'Deadline of {self._timeout}s exceeded')
+            else:
+                results[id] = task.exception()
+
+        self._elapsed = loop.time() - started
+
+        return results
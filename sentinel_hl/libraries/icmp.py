@@ -0,0 +1,273 @@
+import logging
+import asyncio
+import socket
+import struct
+import os
+import ipaddress
+
+__all__ = ['IcmpProber', 'IcmpError', 'IcmpUnavailableError']
+
+ICMP_ECHO_REQUEST = 8
+ICMP_ECHO_REPLY = 0
+ICMPV6_ECHO_REQUEST = 128
+ICMPV6_ECHO_REPLY = 129
+
+RECV_BUFFER_SIZE = 1024 * 1024
+
+class IcmpError(Exception):
+    pass
+
+class IcmpUnavailableError(IcmpError):
+    pass
+
+class IcmpSocket:
+    def __init__(self, family: int, *, loop: asyncio.AbstractEventLoop, logger: logging.Logger):
+        self._family: int = family
+        self._loop: asyncio.AbstractEventLoop = loop
+        self._logger: logging.Logger = logger
+
+        self._proto: int = socket.IPPROTO_ICMP if family == socket.AF_INET else socket.IPPROTO_ICMPV6
+        self._sock, self._raw = self._open()
+        self._ident: int = self._get_ident()
+        self._seq: int = 0
+
+        # (sequence) -> (destination address, future)
+        self._pending: dict[int, tuple[str, asyncio.Future]] = {}
+
+        self._loop.add_reader(self._sock.fileno(), self._on_readable)
+
+    @property
+    def raw(self) -> bool:
+        return self._raw
+
+    async def echo(self, address: str, timeout: float) -> float | None:
+        seq = self._next_seq()
+        future = self._loop.create_future()
+        self._pending[seq] = (address, future)
+
+        started = self._loop.time()
+
+        try:
+            self._sock.sendto(self._build_request(seq), (address, 0))
+            await asyncio.wait_for(future, timeout=timeout)
+        except asyncio.TimeoutError:
+            return None
+        except OSError as e:
+            self._logger.debug(f'ICMP echo to {address} failed: {e}')
+            return None
+        finally:
+            self._pending.pop(seq, None)
+
+        return self._loop.time() - started
+
+    def close(self) -> None:
+        if self._sock.fileno() != -1:
+            try:
+                self._loop.remove_reader(self._sock.fileno())
+            except Exception:
+                pass
+
+            self._sock.close()
+
+        for _, future in self._pending.values():
+            if not future.done():
+                future.cancel()
+
+        self._pending.clear()
+
+    def _open(self) -> tuple[socket.socket, bool]:
+        # prefer unprivileged ping sockets (net.ipv4.ping_group_range), fall back to raw sockets (CAP_NET_RAW)
+        errors = []
+
+        for sock_type in (socket.SOCK_DGRAM, socket.SOCK_RAW):
+            try:
+                sock = socket.socket(self._family, sock_type, self._proto)
+            except OSError as e:
+                errors.append(str(e))
+                continue
+
+            sock.setblocking(False)
+
+            # replies to a burst of probes arrive together, make room for them
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECV_BUFFER_SIZE)
+            except OSError:
+                pass
+
+            return sock, sock_type == socket.SOCK_RAW
+
+        raise IcmpUnavailableError(f'Could not open ICMP socket: {"; ".join(errors)}')
+
+    def _get_ident(self) -> int:
+        if self._raw:
+            return (os.getpid() ^ id(self)) & 0xFFFF
+
+        # the kernel rewrites the identifier of datagram ICMP sockets with the bound port
+        self._sock.bind(('', 0) if self._family == socket.AF_INET else ('::', 0))
+
+        return self._sock.getsockname()[1]
+
+    def _next_seq(self) -> int:
+        for _ in range(0x10000):
+            self._seq = (self._seq + 1) & 0xFFFF
+
+            if self._seq not in self._pending:
+                return self._seq
+
+        raise IcmpError('Too many ICMP probes in flight')
+
+    def _build_request(self, seq: int) -> bytes:
+        echo_type = ICMP_ECHO_REQUEST if self._family == socket.AF_INET else ICMPV6_ECHO_REQUEST
+        payload = struct.pack('!d', self._loop.time()).ljust(56, b'\x00')
+
+        header = struct.pack('!BBHHH', echo_type, 0, 0, self._ident, seq)
+        checksum = self._checksum(header + payload) if self._family == socket.AF_INET else 0
+
+        return struct.pack('!BBHHH', echo_type, 0, checksum, self._ident, seq) + payload
+
+    def _on_readable(self) -> None:
+        while True:
+            try:
+                data, addr = self._sock.recvfrom(2048)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                self._logger.debug(f'ICMP socket read failed: {e}')
+                return
+
+            self._handle_packet(data, addr[0])
+
+    def _handle_packet(self, data: bytes, source: str) -> None:
+        # raw IPv4 sockets deliver the IP header as well
+        if self._raw and self._family == socket.AF_INET:
+            if len(data) < 20:
+                return
+
+            data = data[(data[0] & 0x0F) * 4:]
+
+        if len(data) < 8:
+            return
+
+        echo_type, _, _, ident, seq = struct.unpack('!BBHHH', data[:8])
+
+        if echo_type != (ICMP_ECHO_REPLY if self._family == socket.AF_INET else ICMPV6_ECHO_REPLY):
+            return
+
+        if ident != self._ident:
+            return
+
+        pending = self._pending.get(seq)
+
+        if not pending:
+            return
+
+        address, future = pending
+
+        if self._normalize(source) != self._normalize(address) or future.done():
+            return
+
+        future.set_result(None)
+
+    def _normalize(self, address: str) -> str:
+        return str(ipaddress.ip_address(address.split('%', 1)[0]))
+
+    def _checksum(self, data: bytes) -> int:
+        if len(data) % 2:
+            data += b'\x00'
+
+        total = sum(struct.unpack(f'!{len(data) // 2}H', data))
+        total = (total >> 16) + (total & 0xFFFF)
+        total += total >> 16
+
+        return ~total & 0xFFFF
+
+class IcmpProber:
+    _instance: 'IcmpProber | None' = None
+
+    def __init__(self, *, loop: asyncio.AbstractEventLoop, logger: logging.Logger | None = None):
+        self._loop: asyncio.AbstractEventLoop = loop
+        self._logger: logging.Logger = logger or logging.getLogger(__name__)
+
+        self._sockets: dict[int, IcmpSocket] = {}
+
+    @classmethod
+    def get(cls) -> 'IcmpProber':
+        # one prober (and one socket per address family) is shared by every probe running on the loop
+        loop = asyncio.get_running_loop()
+
+        if cls._instance is None or cls._instance._loop is not loop:
+            if cls._instance is not None:
+                cls._instance.close()
+
+            cls._instance = cls(loop=loop)
+
+        return cls._instance
+
+    async def ping(self, host: str, *, count: int = 1, timeout: float = 5, interval: float = 1) -> float | None:
+        # sends up to `count` echo requests, returning the round-trip time of the first reply or None if none arrived
+        family, address = await self._resolve(host)
+        icmp_socket = self._get_socket(family)
+
+        probes: list[asyncio.Task] = []
+
+        try:
+            for i in range(count):
+                if i:
+                    done, _ = await asyncio.wait(probes, timeout=interval, return_when=asyncio.FIRST_COMPLETED)
+
+                    rtt = self._first_reply(done)
+
+                    if rtt is not None:
+                        return rtt
+
+                probes.append(asyncio.create_task(icmp_socket.echo(address, timeout)))
+
+            while probes:
+                done, pending = await asyncio.wait(probes, return_when=asyncio.FIRST_COMPLETED)
+
+                rtt = self._first_reply(done)
+
+                if rtt is not None:
+                    return rtt
+
+                probes = list(pending)
+
+            return None
+        finally:
+            for probe in probes:
+                probe.cancel()
+
+    def close(self) -> None:
+        for icmp_socket in self._sockets.values():
+            icmp_socket.close()
+
+        self._sockets.clear()
+
+    def _get_socket(self, family: int) -> IcmpSocket:
+        if family not in self._sockets:
+            self._sockets[family] = IcmpSocket(family, loop=self._loop, logger=self._logger)
+
+        return self._sockets[family]
+
+    def _first_reply(self, done: set[asyncio.Task]) -> float | None:
+        for probe in done:
+            if not probe.cancelled() and probe.exception() is None and probe.result() is not None:
+                return probe.result()
+
+        return None
+
+    async def _resolve(self, host: str) -> tuple[int, str]:
+        try:
+            address = ipaddress.ip_address(host)
+            return (socket.AF_INET if address.version == 4 else socket.AF_INET6), str(address)
+        except ValueError:
+            pass
+
+        try:
+            infos = await self._loop.getaddrinfo(host, None, type=socket.SOCK_RAW)
+        except socket.gaierror as e:
+            raise IcmpError(f'Could not resolve "{host}": {e}')
+
+        family, _, _, _, sockaddr = infos[0]
+
+        return family, sockaddr[0]
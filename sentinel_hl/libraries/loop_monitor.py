@@ -0,0 +1,92 @@
+import logging
+import asyncio
+import threading
+import traceback
+import time
+import sys
+from sentinel_hl.libraries.metrics import histogram
+from sentinel_hl.libraries.systemd import SdNotifier
+
+__all__ = ['LoopMonitor']
+
+LOOP_LAG = histogram('sentinel_hl_loop_lag_seconds', 'How late the event loop runs a callback scheduled at a fixed interval.', buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10))
+
+class LoopMonitor:
+    def __init__(self, *, threshold: float = 1, interval: float = 0.25, notifier: SdNotifier | None = None, logger: logging.Logger | None = None):
+        self._threshold: float = threshold
+        self._interval: float = interval
+        self._notifier: SdNotifier | None = notifier
+        self._logger: logging.Logger = logger or logging.getLogger(__name__)
+
+        # written by the loop, read by the watcher thread, a float assignment needs no lock
+        self._heartbeat: float = time.monotonic()
+        self._loop_thread: int | None = None
+        self._stop: threading.Event = threading.Event()
+
+    async def run(self) -> None:
+        # measures how late a periodic wake up happens, the watcher thread catches stalls while they last
+        loop = asyncio.get_running_loop()
+
+        self._loop_thread = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stop.clear()
+
+        watcher = threading.Thread(target=self._watch, name='loop-monitor', daemon=True)
+        watcher.start()
+
+        # the watchdog is only fed from the loop itself, a stuck loop lets systemd restart the service
+        watchdog = self._notifier.watchdog_interval if self._notifier is not None else None
+        fed_at = 0.0
+
+        expected = loop.time() + self._interval
+
+        try:
+            while True:
+                await asyncio.sleep(self._interval)
+
+                now = loop.time()
+                lag = max(0.0, now - expected)
+                expected = now + self._interval
+
+                self._heartbeat = time.monotonic()
+                LOOP_LAG.observe(lag)
+
+                if lag > self._threshold:
+                    self._logger.warning(f'Event loop lagged {lag:.2f}s behind schedule')
+
+                if watchdog is not None and now - fed_at >= watchdog / 2:
+                    self._notifier.notify('WATCHDOG=1') # type: ignore
+                    fed_at = now
+        finally:
+            self._stop.set()
+
+    def _watch(self) -> None:
+        reported = False
+
+        while not self._stop.wait(self._interval):
+            stalled = time.monotonic() - self._heartbeat
+
+            if stalled <= self._threshold + self._interval:
+                reported = False
+                continue
+
+            # once per stall, the loop thread is still inside the blocking call
+            if not reported:
+                reported = True
+                self._logger.warning(f'Event loop blocked for {stalled:.2f}s, currently running:\n{self._format_loop_stack()}')
+
+    def _format_loop_stack(self) -> str:
+        frame = sys._current_frames().get(self._loop_thread) # type: ignore
+
+        if frame is None:
+            return '  (stack unavailable)'
+
+        stack = traceback.extract_stack(frame)
+
+        # drop the event loop internals above the callback that is blocking
+        for index in range(len(stack) - 1, -1, -1):
+            if stack[index].filename == asyncio.events.__file__ and stack[index].name == '_run':
+                stack = stack[index + 1:] or stack
+                break
+
+        return ''.join(traceback.format_list(stack)).rstrip()
@@ -0,0 +1,209 @@
+import logging
+import asyncio
+import math
+from bisect import bisect_left
+from typing import Callable
+
+__all__ = ['Registry', 'Histogram', 'HistogramFamily', 'GaugeFamily', 'CounterFamily', 'MetricsServer', 'REGISTRY', 'histogram', 'gauge', 'counter']
+
+# seconds, from a local ping to a slow ssh command
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+CONTENT_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+# requests are tiny, anything bigger is not a scrape
+REQUEST_LIMIT = 8192
+REQUEST_TIMEOUT = 5
+
+class Histogram:
+    # one labelled series, the bucket counters are allocated once and only incremented
+    __slots__ = ('_bounds', 'counts', 'sum', 'count')
+
+    def __init__(self, bounds: tuple[float, ...]):
+        self._bounds: tuple[float, ...] = bounds
+        self.counts: list[int] = [0] * (len(bounds) + 1)
+        self.sum: float = 0.0
+        self.count: int = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self._bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+class HistogramFamily:
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = (), *, buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name: str = name
+        self.help: str = help
+        self._labels: tuple[str, ...] = labels
+        self._buckets: tuple[float, ...] = tuple(sorted(buckets))
+
+        self._series: dict[tuple[str, ...], Histogram] = {}
+
+    def labels(self, *values: str) -> Histogram:
+        # callers observing the same series often may keep the returned histogram
+        series = self._series.get(values)
+
+        if series is None:
+            if len(values) != len(self._labels):
+                raise ValueError(f'Metric {self.name} takes labels {", ".join(self._labels) or "(none)"}')
+
+            series = self._series[values] = Histogram(self._buckets)
+
+        return series
+
+    def observe(self, value: float, *labels: str) -> None:
+        self.labels(*labels).observe(value)
+
+    def remove(self, *values: str) -> None:
+        self._series.pop(values, None)
+
+    def render(self, lines: list[str]) -> None:
+        lines.append(f'# TYPE {self.name} histogram')
+        lines.append(f'# HELP {self.name} {self.help}')
+
+        bounds = [format_value(float(bound)) for bound in self._buckets] + ['+Inf']
+
+        for values, series in self._series.items():
+            cumulative = 0
+
+            for bound, count in zip(bounds, series.counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{format_labels(self._labels, values, le=bound)} {cumulative}')
+
+            labels = format_labels(self._labels, values)
+
+            lines.append(f'{self.name}_sum{labels} {format_value(series.sum)}')
+            lines.append(f'{self.name}_count{labels} {series.count}')
+
+class GaugeFamily:
+    type: str = 'gauge'
+    suffix: str = ''
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        self.name: str = name
+        self.help: str = help
+        self._labels: tuple[str, ...] = labels
+
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def set(self, value: float, *labels: str) -> None:
+        self._values[labels] = value
+
+    def clear(self) -> None:
+        self._values.clear()
+
+    def render(self, lines: list[str]) -> None:
+        lines.append(f'# TYPE {self.name} {self.type}')
+        lines.append(f'# HELP {self.name} {self.help}')
+
+        for values, value in self._values.items():
+            lines.append(f'{self.name}{self.suffix}{format_labels(self._labels, values)} {format_value(value)}')
+
+class CounterFamily(GaugeFamily):
+    # totals kept elsewhere (e.g. CmdExec stats) and copied here on scrape
+    type = 'counter'
+    suffix = '_total'
+
+class Registry:
+    def __init__(self):
+        self._families: dict[str, HistogramFamily | GaugeFamily] = {}
+        self._collectors: dict[str, Callable[[], None]] = {}
+
+    def register(self, family: HistogramFamily | GaugeFamily) -> HistogramFamily | GaugeFamily:
+        return self._families.setdefault(family.name, family)
+
+    def add_collector(self, key: str, collector: Callable[[], None]) -> None:
+        # collectors refresh gauges from the live state right before each scrape, a key replaces the previous collector
+        self._collectors[key] = collector
+
+    def remove_collector(self, key: str) -> None:
+        self._collectors.pop(key, None)
+
+    def render(self) -> str:
+        for collector in self._collectors.values():
+            collector()
+
+        lines: list[str] = []
+
+        for family in self._families.values():
+            family.render(lines)
+
+        lines.append('# EOF')
+
+        return '\n'.join(lines) + '\n'
+
+class MetricsServer:
+    def __init__(self, registry: Registry, host: str, port: int, *, logger: logging.Logger | None = None):
+        self._registry: Registry = registry
+        self._host: str = host
+        self._port: int = port
+        self._logger: logging.Logger = logger or logging.getLogger(__name__)
+
+        self._server: asyncio.AbstractServer | None = None
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self._serve, self._host, self._port, limit=REQUEST_LIMIT)
+
+        self._logger.info(f'Serving metrics on http://{self._host}:{self._port}/metrics')
+
+    async def close(self) -> None:
+        if self._server is None:
+            return
+
+        self._server.close()
+        await self._server.wait_closed()
+        self._server = None
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), timeout=REQUEST_TIMEOUT)
+            method, path, *_ = head.split(b'\r\n', 1)[0].decode('latin-1').split(' ')
+
+            if method != 'GET':
+                self._respond(writer, '405 Method Not Allowed', 'Method not allowed\n')
+            elif path.split('?', 1)[0] != '/metrics':
+                self._respond(writer, '404 Not Found', 'Not found\n')
+            else:
+                self._respond(writer, '200 OK', self._registry.render(), CONTENT_TYPE)
+
+            await writer.drain()
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError, ValueError) as e:
+            self._logger.debug(f'Metrics request failed: {e}')
+        finally:
+            writer.close()
+
+    def _respond(self, writer: asyncio.StreamWriter, status: str, body: str, content_type: str = 'text/plain; charset=utf-8') -> None:
+        payload = body.encode()
+
+        writer.write(f'HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\nContent-Length: {len(payload)}\r\nConnection: close\r\n\r\n'.encode() + payload)
+
+def format_labels(names: tuple[str, ...], values: tuple[str, ...], **extra: str) -> str:
+    pairs = [*zip(names, values), *extra.items()]
+
+    if not pairs:
+        return ''
+
+    return '{' + ','.join(f'{name}="{escape_label_value(value)}"' for name, value in pairs) + '}'
+
+def escape_label_value(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_value(value: float) -> str:
+    if math.isnan(value):
+        return 'NaN'
+
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+# process wide registry, libraries declare their metrics on import
+REGISTRY = Registry()
+
+def histogram(name: str, help: str, labels: tuple[str, ...] = (), *, buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> HistogramFamily:
+    return REGISTRY.register(HistogramFamily(name, help, labels, buckets=buckets)) # type: ignore
+
+def gauge(name: str, help: str, labels: tuple[str, ...] = ()) -> GaugeFamily:
+    return REGISTRY.register(GaugeFamily(name, help, labels)) # type: ignore
+
+def counter(name: str, help: str, labels: tuple[str, ...] = ()) -> CounterFamily:
+    return REGISTRY.register(CounterFamily(name, help, labels)) # type: ignore
@@ -0,0 +1,246 @@
+import logging
+import asyncio
+import socket
+import errno
+from sentinel_hl.libraries.cmd_exec import CmdExec, CmdExecProcessError
+from sentinel_hl.libraries.netlink import Netlink, NetlinkError, NeighbourEntry, RTM_NEWNEIGH, RTM_DELNEIGH, RTMGRP_NEIGH, NUD_REACHABLE, NUD_PERMANENT, NUD_NOARP
+
+__all__ = ['NeighbourTable', 'NeighbourTableError']
+
+# flags column of /proc/net/arp
+ATF_COM = 0x02
+ATF_PERM = 0x04
+
+class NeighbourTableError(Exception):
+    pass
+
+class NeighbourTable:
+    def __init__(self, *, max_age: float = 5, prime_timeout: float = 2, logger: logging.Logger | None = None):
+        # snapshots younger than `max_age` seconds are served without reading the kernel table again
+        self._max_age: float = max_age
+        self._prime_timeout: float = prime_timeout
+        self._logger: logging.Logger = logger or logging.getLogger(__name__)
+
+        self._entries: dict[str, NeighbourEntry] = {}
+        self._updated_at: float | None = None
+        self._refreshing: asyncio.Future | None = None
+        
+        self._monitor: socket.socket | None = None
+        self._resync: asyncio.Task | None = None
+
+    @property
+    def live(self) -> bool:
+        # true while the table is kept up to date by kernel notifications
+        return self._monitor is not None
+
+    async def start_monitor(self) -> bool:
+        if self._monitor is not None:
+            return True
+
+        try:
+            self._monitor = Netlink.open(groups=RTMGRP_NEIGH)
+        except NetlinkError as e:
+            self._logger.warning(f'{e}. Falling back to periodic neighbour table snapshots')
+            return False
+
+        asyncio.get_running_loop().add_reader(self._monitor.fileno(), self._on_monitor_readable)
+
+        # subscribe first, then seed the table, so no change is missed in between
+        await self.refresh(force=True)
+
+        self._logger.info('Watching kernel neighbour table for changes')
+
+        return True
+
+    def stop_monitor(self) -> None:
+        if self._monitor is None:
+            return
+
+        try:
+            asyncio.get_event_loop().remove_reader(self._monitor.fileno())
+        except Exception:
+            pass
+
+        self._monitor.close()
+        self._monitor = None
+
+        if self._resync is not None:
+            self._resync.cancel()
+            self._resync = None
+
+    async def refresh(self, *, force: bool = False) -> None:
+        loop = asyncio.get_running_loop()
+
+        if not force and (self.live or (self._updated_at is not None and loop.time() - self._updated_at < self._max_age)):
+            return
+
+        # concurrent callers share the same read
+        if self._refreshing is None:
+            self._refreshing = asyncio.ensure_future(self.dump())
+
+        refreshing = self._refreshing
+
+        try:
+            self._entries = await asyncio.shield(refreshing)
+            self._updated_at = loop.time()
+        finally:
+            if self._refreshing is refreshing:
+                self._refreshing = None
+
+    def lookup(self, ip: str) -> str:
+        entry = self._entries.get(ip)
+
+        if entry is None or not entry.mac:
+            return ''
+
+        return entry.mac
+
+    async def prime(self, ips: list[str]) -> None:
+        # ping every IP missing from the table at once, so the kernel resolves them all, then read the table again
+        await self.refresh()
+
+        missing = [ip for ip in dict.fromkeys(ips) if not self.lookup(ip)]
+
+        if not missing:
+            return
+
+        self._logger.debug(f'Priming neighbour table for {len(missing)} address(es)')
+
+        await asyncio.gather(*[self._ping(ip) for ip in missing])
+        await self.refresh(force=True)
+
+    async def get_mac(self, ip: str) -> str:
+        await self.refresh()
+
+        mac = self.lookup(ip)
+
+        if not mac:
+            await self.prime([ip])
+            mac = self.lookup(ip)
+
+        if not mac:
+            raise NeighbourTableError(f'MAC address not found in neighbour table for "{ip}"')
+
+        return mac
+
+    def _on_monitor_readable(self) -> None:
+        while self._monitor is not None:
+            try:
+                data = self._monitor.recv(65536)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                if e.errno == errno.ENOBUFS:
+                    # notifications were dropped, the table has to be read again
+                    self._logger.debug('Neighbour notifications overflowed. Resynchronizing table')
+                    self._schedule_resync()
+                    continue
+
+                self._logger.warning(f'Neighbour table monitor failed: {e}. Falling back to periodic snapshots')
+                self.stop_monitor()
+                return
+
+            try:
+                messages = Netlink.parse_neighbour_messages(data)
+            except NetlinkError as e:
+                self._logger.debug(f'Invalid neighbour notification: {e}')
+                continue
+
+            for msg_type, entry in messages:
+                if entry is not None:
+                    self._apply(msg_type, entry)
+
+    def _apply(self, msg_type: int, entry: NeighbourEntry) -> None:
+        previous = self._entries.get(entry.ip)
+
+        if msg_type == RTM_DELNEIGH:
+            self._entries.pop(entry.ip, None)
+            return
+
+        if msg_type != RTM_NEWNEIGH:
+            return
+
+        # failed / incomplete entries carry no address, keep the last one known
+        if not entry.mac and previous is not None and previous.mac:
+            entry = entry._replace(mac=previous.mac)
+
+        if previous is not None and previous.mac and entry.mac and previous.mac != entry.mac:
+            self._logger.info(f'MAC address of {entry.ip} changed from {previous.mac} to {entry.mac}')
+
+        self._entries[entry.ip] = entry
+
+    def _schedule_resync(self) -> None:
+        if self._resync is not None and not self._resync.done():
+            return
+
+        self._resync = asyncio.ensure_future(self.refresh(force=True))
+
+    async def _ping(self, ip: str) -> None:
+        try:
+            await CmdExec.ping(ip, count=1, timeout=self._prime_timeout)
+        except CmdExecProcessError:
+            pass
+
+    @classmethod
+    async def dump(cls) -> dict[str, NeighbourEntry]:
+        try:
+            entries = await Netlink.dump_neighbours()
+        except NetlinkError as e:
+            logging.debug(f'{e}. Reading neighbour table from /proc/net/arp')
+            entries = cls._read_proc_arp()
+
+        return {entry.ip: entry for entry in entries}
+
+    @classmethod
+    def is_confirmed(cls, entry: NeighbourEntry | None) -> bool:
+        if entry is None or not entry.mac:
+            return False
+
+        return bool(entry.state & (NUD_REACHABLE | NUD_PERMANENT | NUD_NOARP))
+
+    @classmethod
+    def trigger_resolution(cls, ip: str) -> None:
+        # an empty datagram to the discard port is enough for the kernel to (re)resolve the neighbour
+        family = socket.AF_INET6 if ':' in ip else socket.AF_INET
+
+        try:
+            with socket.socket(family, socket.SOCK_DGRAM) as sock:
+                sock.setblocking(False)
+                sock.sendto(b'', (ip, 9))
+        except OSError as e:
+            logging.debug(f'Could not trigger neighbour resolution for {ip}: {e}')
+
+    @classmethod
+    def _read_proc_arp(cls) -> list[NeighbourEntry]:
+        entries = []
+
+        try:
+            with open('/proc/net/arp', 'r') as f:
+                lines = f.read().splitlines()[1:]
+        except OSError as e:
+            logging.debug(f'Could not read /proc/net/arp: {e}')
+            return entries
+
+        for line in lines:
+            fields = line.split()
+
+            if len(fields) < 6:
+                continue
+
+            ip, _, flags, mac = fields[:4]
+            flags = int(flags, 16)
+
+            # /proc/net/arp has no reachability information, complete entries are the best we have
+            if flags & ATF_PERM:
+                state = NUD_PERMANENT
+            elif flags & ATF_COM:
+                state = NUD_REACHABLE
+            else:
+                state = 0
+
+            if mac == '00:00:00:00:00:00':
+                mac = ''
+
+            entries.append(NeighbourEntry(ip, mac.upper(), state, 0))
+
+        return entries
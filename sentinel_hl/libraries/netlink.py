@@ -0,0 +1,151 @@
+import asyncio
+import socket
+import struct
+import os
+from typing import NamedTuple
+
+__all__ = ['Netlink', 'NetlinkError', 'NeighbourEntry']
+
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+
+NLM_F_REQUEST = 0x01
+NLM_F_MULTI = 0x02
+NLM_F_DUMP = 0x300
+
+RTMGRP_NEIGH = 0x04
+
+RTM_NEWNEIGH = 28
+RTM_DELNEIGH = 29
+RTM_GETNEIGH = 30
+
+NDA_DST = 1
+NDA_LLADDR = 2
+
+NUD_INCOMPLETE = 0x01
+NUD_REACHABLE = 0x02
+NUD_STALE = 0x04
+NUD_DELAY = 0x08
+NUD_PROBE = 0x10
+NUD_FAILED = 0x20
+NUD_NOARP = 0x40
+NUD_PERMANENT = 0x80
+
+NLMSG_HEADER = struct.Struct('=LHHLL')
+NDMSG = struct.Struct('=BBHiHBB')
+RTATTR_HEADER = struct.Struct('=HH')
+
+class NetlinkError(Exception):
+    pass
+
+class NeighbourEntry(NamedTuple):
+    ip: str
+    mac: str
+    state: int
+    ifindex: int
+
+class Netlink:
+    @classmethod
+    def open(cls, groups: int = 0) -> socket.socket:
+        try:
+            sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, socket.NETLINK_ROUTE)
+            sock.bind((0, groups))
+        except (OSError, AttributeError) as e:
+            raise NetlinkError(f'Could not open rtnetlink socket: {e}')
+
+        sock.setblocking(False)
+
+        return sock
+
+    @classmethod
+    async def dump_neighbours(cls, family: int = socket.AF_UNSPEC) -> list[NeighbourEntry]:
+        loop = asyncio.get_running_loop()
+        seq = int(loop.time() * 1000) & 0xFFFFFFFF
+
+        request = NDMSG.pack(family, 0, 0, 0, 0, 0, 0)
+        header = NLMSG_HEADER.pack(NLMSG_HEADER.size + len(request), RTM_GETNEIGH, NLM_F_REQUEST | NLM_F_DUMP, seq, 0)
+
+        entries: list[NeighbourEntry] = []
+
+        with cls.open() as sock:
+            await loop.sock_sendall(sock, header + request)
+
+            while True:
+                data = await loop.sock_recv(sock, 65536)
+
+                if not data:
+                    raise NetlinkError('Netlink socket closed during dump')
+
+                for msg_type, entry in cls.parse_neighbour_messages(data, seq=seq):
+                    if msg_type == NLMSG_DONE:
+                        return entries
+
+                    if entry is not None:
+                        entries.append(entry)
+
+    @classmethod
+    def parse_neighbour_messages(cls, data: bytes, *, seq: int | None = None) -> list[tuple[int, NeighbourEntry | None]]:
+        messages = []
+        offset = 0
+
+        while offset + NLMSG_HEADER.size <= len(data):
+            length, msg_type, _, msg_seq, _ = NLMSG_HEADER.unpack_from(data, offset)
+
+            if length < NLMSG_HEADER.size:
+                break
+
+            body = data[offset + NLMSG_HEADER.size:offset + length]
+            offset += (length + 3) & ~3
+
+            if seq is not None and msg_seq != seq:
+                continue
+
+            if msg_type == NLMSG_ERROR:
+                error = struct.unpack_from('=i', body)[0] if len(body) >= 4 else 0
+
+                if error:
+                    raise NetlinkError(f'Netlink request failed: {os.strerror(-error)}')
+
+                continue
+
+            if msg_type == NLMSG_DONE:
+                messages.append((msg_type, None))
+                continue
+
+            if msg_type in (RTM_NEWNEIGH, RTM_DELNEIGH):
+                messages.append((msg_type, cls._parse_ndmsg(body)))
+
+        return messages
+
+    @classmethod
+    def _parse_ndmsg(cls, body: bytes) -> NeighbourEntry | None:
+        if len(body) < NDMSG.size:
+            return None
+
+        family, _, _, ifindex, state, _, _ = NDMSG.unpack_from(body)
+
+        ip = ''
+        mac = ''
+        offset = NDMSG.size
+
+        while offset + RTATTR_HEADER.size <= len(body):
+            attr_len, attr_type = RTATTR_HEADER.unpack_from(body, offset)
+
+            if attr_len < RTATTR_HEADER.size:
+                break
+
+            value = body[offset + RTATTR_HEADER.size:offset + attr_len]
+            offset += (attr_len + 3) & ~3
+
+            if attr_type == NDA_DST:
+                try:
+                    ip = socket.inet_ntop(family, value)
+                except (OSError, ValueError):
+                    return None
+            elif attr_type == NDA_LLADDR and len(value) == 6 and any(value):
+                mac = ':'.join(f'{b:02X}' for b in value)
+
+        if not ip:
+            return None
+
+        return NeighbourEntry(ip, mac, state, ifindex)
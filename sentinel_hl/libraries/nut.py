@@ -1,9 +1,21 @@
 import logging
 import asyncio
 import re
-from typing import Optional
+from typing import AsyncIterator, Awaitable, Callable, Optional, TypeVar
+from sentinel_hl.libraries.metrics import Histogram, histogram
 
-__all__ = ['Nut']
+__all__ = ['Nut', 'NutPool', 'NutError']
+
+T = TypeVar('T')
+
+# numeric variables, parsed as they are received
+FLOAT_VARS = frozenset(['battery.charge', 'battery.voltage', 'battery.voltage.high', 'battery.voltage.low', 'input.voltage', 'output.voltage', 'ups.load', 'battery.runtime'])
+# numeric variables reported as 0 when the UPS doesn't provide them
+FLOAT_DEFAULT_VARS = ['battery.charge', 'battery.voltage', 'battery.voltage.high', 'battery.voltage.low', 'input.voltage', 'output.voltage']
+# backslash escapes of quoted values (\" and \\)
+UNESCAPE_PATTERN = re.compile(r'\\(.)')
+
+ROUND_TRIP = histogram('sentinel_hl_nut_round_trip_seconds', 'Round trip time of a batch of commands sent to upsd.', ('server',))
 
 class NutError(Exception):
     pass
@@ -23,108 +35,265 @@ class Nut:
         self._reader: asyncio.StreamReader | None = None
         self._connected: bool = False
         self._initialized: bool = False
+        self._lock: asyncio.Lock = asyncio.Lock()
+        self._round_trip: Histogram = ROUND_TRIP.labels(self.server)
+        
+    @property
+    def server(self) -> str:
+        return f'{self._host}:{self._port}'
         
     @property
     def connected(self) -> bool:
         return self._connected and self._writer is not None and self._reader is not None and not self._writer.is_closing()
         
-    async def get_ups_vars(self, ups_id: str) -> dict | None:
-        if not ups_id:
+    async def get_ups_vars(self, ups_id: str, variables: list[str] | None = None) -> dict | None:
+        result = (await self.get_ups_vars_many([ups_id], variables))[ups_id]
+        
+        if isinstance(result, NutError):
+            raise result
+        
+        return result
+    
+    async def get_ups_vars_many(self, ups_ids: list[str], variables: list[str] | None = None) -> dict[str, dict | NutError | None]:
+        # all requests are written at once and the responses read back in order (one round trip).
+        # without `variables` every variable is listed (LIST VAR), otherwise only those are fetched (GET VAR)
+        if not ups_ids or not all(ups_ids):
             raise ValueError('UPS ID must be provided')
         
-        data = await self.communicate(f'LIST VAR {ups_id}')
+        ups_ids = list(dict.fromkeys(ups_ids))
         
-        if not data:
-            self._logger.warning(f'No data received for UPS ID {ups_id}')
-            return None
-
-        pattern = fr'VAR {ups_id} (\S+) "(.+?)"'
+        if variables is None:
+            responses = await self._exchange([f'LIST VAR {ups_id}' for ups_id in ups_ids], self._read_list_var)
+        else:
+            responses = await self._get_vars_many(ups_ids, list(dict.fromkeys(['ups.status', *variables])))
         
-        vars = {
-            match.group(1): match.group(2)
-            for match in re.finditer(pattern, data)
-        }
-
-        cast_float = ['battery.charge', 'battery.voltage', 'battery.voltage.high', 'battery.voltage.low', 'input.voltage', 'output.voltage']
-
-        for key in cast_float:
-            vars[key] = float(vars.get(key, 0))
+        results: dict[str, dict | NutError | None] = {}
+        
+        for ups_id, vars in zip(ups_ids, responses):
+            if isinstance(vars, NutError):
+                results[ups_id] = vars
+            elif not vars:
+                self._logger.warning(f'No data received for UPS ID {ups_id}')
+                results[ups_id] = None
+            elif variables is None:
+                results[ups_id] = self._complete_vars(vars)
+            else:
+                # a minimal poll only returns what it fetched, defaults would hide the values of the last full poll
+                results[ups_id] = {'ups.status': [], **vars}
+                
+        return results
+    
+    async def _get_vars_many(self, ups_ids: list[str], variables: list[str]) -> list[dict | NutError | None]:
+        commands = [f'GET VAR {ups_id} {name}' for ups_id in ups_ids for name in variables]
+        responses = await self._exchange(commands, self._read_get_var)
+        
+        results: list[dict | NutError | None] = []
         
-        vars['ups.status'] = vars.get('ups.status', '').split(' ')
+        for i in range(len(ups_ids)):
+            vars: dict | NutError | None = {}
+            
+            for response in responses[i * len(variables):(i + 1) * len(variables)]:
+                if response is None:
+                    vars = None
+                    break
+                
+                if isinstance(response, NutError):
+                    # a variable the driver doesn't report is simply left out
+                    if str(response) == 'VAR-NOT-SUPPORTED':
+                        continue
+                    
+                    vars = response
+                    break
+                
+                self._store_var(vars, *response)
+                
+            results.append(vars)
+            
+        return results
+    
+    def _store_var(self, vars: dict, name: str, value: str) -> None:
+        if name in FLOAT_VARS:
+            try:
+                vars[name] = float(value)
+            except ValueError:
+                self._logger.debug(f'UPS {self._host}:{self._port}: Ignoring non numeric value "{value}" of {name}')
+        elif name == 'ups.status':
+            vars[name] = value.split()
+        else:
+            vars[name] = value
+            
+    def _complete_vars(self, vars: dict) -> dict:
+        # missing values default to 0, except those where 0 would be misleading (ups.load, battery.runtime)
+        for name in FLOAT_DEFAULT_VARS:
+            vars.setdefault(name, 0.0)
+            
+        vars.setdefault('ups.status', [])
         
         return vars
 
     async def communicate(self, command: str) -> str | None:
-        # Ensure we have a valid connection
-        if not await self._ensure_connection():
-            raise ConnectionError(f'Could not connect to UPS at {self._host}:{self._port}')
+        result = (await self.communicate_many([command]))[0]
         
-        if not command:
+        if isinstance(result, NutError):
+            # Let NutError propagate to the caller
+            raise result
+        
+        return result
+    
+    async def communicate_many(self, commands: list[str]) -> list[str | NutError | None]:
+        return await self._exchange(commands, self._read_text)
+        
+    async def _exchange(self, commands: list[str], read: Callable[[str], Awaitable[T]]) -> list[T | NutError | None]:
+        if not commands or not all(commands):
             raise ValueError('Command cannot be empty')
         
-        self._logger.debug(f'UPS {self._host}:{self._port} sending command: {command}')
+        # the connection may be shared, only one batch can be in flight at a time
+        async with self._lock:
+            # Ensure we have a valid connection
+            if not await self._ensure_connection():
+                raise ConnectionError(f'Could not connect to UPS at {self._host}:{self._port}')
+            
+            started = asyncio.get_running_loop().time()
+            
+            try:
+                return await self._pipeline(commands, read)
+            finally:
+                self._round_trip.observe(asyncio.get_running_loop().time() - started)
+        
+    async def _pipeline(self, commands: list[str], read: Callable[[str], Awaitable[T]]) -> list[T | NutError | None]:
+        self._logger.debug(f'UPS {self._host}:{self._port} sending {len(commands)} command(s): {commands[0]}{", ..." if len(commands) > 1 else ""}')
             
         try:
-            # Send command with timeout
-            command_bytes = f'{command}\n'.encode('utf-8')
+            # Send all commands with timeout
+            command_bytes = ''.join(f'{command}\n' for command in commands).encode('utf-8')
             self._writer.write(command_bytes) # type: ignore
             await asyncio.wait_for(self._writer.drain(), timeout=self._write_timeout) # type: ignore
             
-            beginning = await self._readline()
-            
-            if beginning.startswith('ERR '):
-                raise NutError(beginning.replace('ERR ', '', 1).strip())
+            results: list[T | NutError | None] = []
             
-            if beginning != f"BEGIN {command}":
-                raise NutError('Unknown response from UPS: ' + beginning)
-            
-            data = ''
-            
-            while True:
-                line = await self._readline()
-                
-                if line == f"END {command}":
-                    break
-                
-                data += line + '\n'
+            for command in commands:
+                try:
+                    results.append(await asyncio.wait_for(read(command), timeout=self._read_timeout))
+                except NutError as e:
+                    if not str(e).startswith('ERR '):
+                        raise
+                    
+                    # the server refused this command, the following responses are still in order
+                    results.append(NutError(str(e)[4:]))
 
-            return data.strip()
+            return results
 
         except asyncio.TimeoutError:
+            # responses of a pipelined batch can't be matched after a timeout, start over on a new connection
             self._logger.warning(f'UPS {self._host}:{self._port}: Timeout during polling')
-            # Don't disconnect on timeout - connection might still be valid
-            return None
+            
+            if len(commands) > 1:
+                await self.disconnect()
+                
+            return [None] * len(commands)
             
         except (ConnectionResetError, ConnectionAbortedError, BrokenPipeError) as e:
             self._logger.warning(f'UPS {self._host}:{self._port}: Connection error during poll: {e}')
             await self.disconnect()
-            return None
+            return [None] * len(commands)
             
         except OSError as e:
             self._logger.error(f'UPS {self._host}:{self._port}: Network error during poll: {e}')
             await self.disconnect()
-            return None
+            return [None] * len(commands)
             
         except UnicodeDecodeError as e:
             self._logger.error(f'UPS {self._host}:{self._port}: Invalid response encoding: {e}')
-            # Don't disconnect - this might be a temporary issue
-            return None
+            # the rest of the response is still waiting to be read, the stream can't be reused
+            await self.disconnect()
+            return [None] * len(commands)
         
-        except EOFError as e:
+        except (EOFError, asyncio.IncompleteReadError) as e:
             self._logger.error(f'UPS {self._host}:{self._port}: EOFError during poll: {e}')
             # Disconnect on EOF to reset the connection
             await self.disconnect()
-            return None
+            return [None] * len(commands)
         
-        except NutError:
-            # Let NutError propagate to the caller
-            raise
+        except NutError as e:
+            # out of sync with the server, the remaining responses can't be trusted
+            self._logger.error(f'UPS {self._host}:{self._port}: {e}')
+            await self.disconnect()
+            return [e] * len(commands)
             
         except Exception as e:
             self._logger.error(f'UPS {self._host}:{self._port}: Unexpected error during poll: {e}')
             # For unexpected errors, disconnect to be safe
             await self.disconnect()
+            return [None] * len(commands)
+        
+    async def _read_text(self, command: str) -> str:
+        lines = []
+        
+        async for line in self._read_list(command):
+            lines.append(line)
+            
+        return '\n'.join(lines)
+    
+    async def _read_list_var(self, command: str) -> dict:
+        # variables are parsed as they arrive, the response is never held as a whole
+        vars: dict = {}
+        
+        async for line in self._read_list(command):
+            var = self._parse_var_line(line)
+            
+            if var is not None:
+                self._store_var(vars, *var)
+                
+        return vars
+    
+    async def _read_get_var(self, command: str) -> tuple[str, str]:
+        line = await self._readline()
+        
+        if line.startswith('ERR '):
+            raise NutError(line)
+        
+        var = self._parse_var_line(line)
+        
+        if var is None:
+            raise NutError('Unknown response from UPS: ' + line)
+        
+        return var
+        
+    async def _read_list(self, command: str) -> AsyncIterator[str]:
+        beginning = await self._readline()
+        
+        if beginning.startswith('ERR '):
+            raise NutError(beginning)
+        
+        if beginning != f"BEGIN {command}":
+            raise NutError('Unknown response from UPS: ' + beginning)
+        
+        end = f"END {command}"
+        
+        while True:
+            line = await self._readline()
+            
+            if line == end:
+                return
+            
+            yield line
+            
+    def _parse_var_line(self, line: str) -> tuple[str, str] | None:
+        # VAR <ups> <name> "<value>"
+        parts = line.split(' ', 3)
+        
+        if len(parts) != 4 or parts[0] != 'VAR':
             return None
+        
+        value = parts[3]
+        
+        if len(value) >= 2 and value[0] == '"' and value[-1] == '"':
+            value = value[1:-1]
+            
+        if '\\' in value:
+            value = UNESCAPE_PATTERN.sub(r'\1', value)
+        
+        return parts[2], value
     
     async def _ensure_connection(self) -> bool:
         if self.connected:
@@ -180,9 +349,35 @@ class Nut:
         self._logger.info(f'Closed UPS connection at {self._host}:{self._port}')
         
     async def _readline(self) -> str:
-        line = await asyncio.wait_for(self._reader.readuntil(b"\n"), timeout=self._read_timeout) # type: ignore
+        # the read timeout applies to a whole response, see _pipeline
+        line = await self._reader.readuntil(b"\n") # type: ignore
 
         if not line:
             raise EOFError('No data received from UPS')
         
-        return line.decode('utf-8').strip()
\ No newline at end of file
+        return line.decode('utf-8').strip()
+
+class NutPool:
+    def __init__(self, *, logger: Optional[logging.Logger] = None):
+        self._logger: logging.Logger = logger or logging.getLogger(__name__)
+        
+        self._clients: dict[tuple[str, int], Nut] = {}
+        
+    @property
+    def clients(self) -> list[Nut]:
+        return list(self._clients.values())
+        
+    def release_unused(self, used: list[Nut]) -> list[Nut]:
+        # forgets the clients no UPS uses anymore, the caller disconnects them
+        unused = [key for key, nut in self._clients.items() if nut not in used]
+        
+        return [self._clients.pop(key) for key in unused]
+        
+    def get(self, host: str, port: int) -> Nut:
+        # every UPS served by the same upsd shares one client (and connection)
+        key = (host, port)
+        
+        if key not in self._clients:
+            self._clients[key] = Nut(host, port, logger=self._logger)
+            
+        return self._clients[key]
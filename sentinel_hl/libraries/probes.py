@@ -0,0 +1,120 @@
+import abc
+import logging
+import asyncio
+import socket
+from sentinel_hl.libraries.cmd_exec import CmdExec, CmdExecProcessError
+from sentinel_hl.libraries.neighbours import NeighbourTable
+
+__all__ = ['Probe', 'IcmpProbe', 'TcpProbe', 'NeighbourProbe', 'ProbeChain']
+
+class Probe(abc.ABC):
+    name: str = ''
+
+    def __init__(self, *, timeout: float = 5):
+        self._timeout: float = timeout
+
+    @abc.abstractmethod
+    async def probe(self, ip: str) -> bool:
+        ...
+
+    def __repr__(self) -> str:
+        return f'{self.__class__.__name__}(timeout={self._timeout})'
+
+class IcmpProbe(Probe):
+    name = 'icmp'
+
+    def __init__(self, *, count: int = 1, timeout: float = 5):
+        super().__init__(timeout=timeout)
+        self._count: int = count
+
+    async def probe(self, ip: str) -> bool:
+        try:
+            await CmdExec.ping(ip, count=self._count, timeout=self._timeout)
+        except CmdExecProcessError:
+            return False
+
+        return True
+
+class TcpProbe(Probe):
+    name = 'tcp'
+
+    def __init__(self, ports: list[int], *, timeout: float = 5):
+        super().__init__(timeout=timeout)
+        self._ports: list[int] = ports
+
+    async def probe(self, ip: str) -> bool:
+        attempts = [asyncio.create_task(self._connect(ip, port)) for port in self._ports]
+
+        try:
+            for attempt in asyncio.as_completed(attempts, timeout=self._timeout):
+                if await attempt:
+                    return True
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            for attempt in attempts:
+                attempt.cancel()
+
+        return False
+
+    async def _connect(self, ip: str, port: int) -> bool:
+        loop = asyncio.get_running_loop()
+        family = socket.AF_INET6 if ':' in ip else socket.AF_INET
+
+        with socket.socket(family, socket.SOCK_STREAM) as sock:
+            sock.setblocking(False)
+
+            try:
+                await loop.sock_connect(sock, (ip, port))
+            except ConnectionRefusedError:
+                # a reset still proves the host is up
+                return True
+            except OSError:
+                return False
+
+        return True
+
+class NeighbourProbe(Probe):
+    name = 'neighbour'
+
+    def __init__(self, *, timeout: float = 5, poll_interval: float = 0.2):
+        super().__init__(timeout=timeout)
+        self._poll_interval: float = poll_interval
+
+    async def probe(self, ip: str) -> bool:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self._timeout
+
+        table = await NeighbourTable.dump()
+
+        if NeighbourTable.is_confirmed(table.get(ip)):
+            return True
+
+        NeighbourTable.trigger_resolution(ip)
+
+        while loop.time() < deadline:
+            await asyncio.sleep(self._poll_interval)
+
+            if NeighbourTable.is_confirmed((await NeighbourTable.dump()).get(ip)):
+                return True
+
+        return False
+
+class ProbeChain:
+    def __init__(self, probes: list[Probe], *, logger: logging.Logger | None = None):
+        if not probes:
+            raise ValueError('At least one probe must be provided')
+
+        self._probes: list[Probe] = probes
+        self._logger: logging.Logger = logger or logging.getLogger(__name__)
+
+    async def probe(self, ip: str) -> str | None:
+        # runs the probes in order and returns the name of the first one that succeeded
+        for probe in self._probes:
+            try:
+                if await probe.probe(ip):
+                    return probe.name
+            except Exception as e:
+                self._logger.debug(f'Probe {probe.name} for {ip} failed: {e}')
+
+        return None
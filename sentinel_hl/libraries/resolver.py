@@ -0,0 +1,146 @@
+import logging
+import asyncio
+import os
+from sentinel_hl.libraries.dns import DnsClient, DnsError, DnsNameError
+from sentinel_hl.libraries.host_discovery import HostDiscovery
+
+__all__ = ['Resolver', 'ResolverError']
+
+# records with a shorter TTL are still cached for this long
+MIN_TTL = 5
+# how long a record is still served when the resolver fails
+STALE_MAX_AGE = 86400
+# negative cache backoff doubles on each failure, up to this multiple of the negative TTL
+NEGATIVE_BACKOFF_MAX_FACTOR = 16
+
+class ResolverError(Exception):
+    pass
+
+class Resolver:
+    def __init__(self, *, max_ttl: int, negative_ttl: int, logger: logging.Logger | None = None):
+        self._max_ttl: int = max_ttl
+        self._negative_ttl: int = negative_ttl
+        self._logger: logging.Logger = logger or logging.getLogger(__name__)
+
+        # hostname -> (ip, expiry, resolved at)
+        self._cache: dict[str, tuple[str, float, float]] = {}
+        # hostname -> (failures, retry at, last error)
+        self._negative: dict[str, tuple[int, float, str]] = {}
+        self._inflight: dict[str, asyncio.Future] = {}
+
+        self._hosts_file: set[str] = set()
+        self._hosts_file_mtime: float | None = None
+
+    async def resolve(self, hostname: str) -> tuple[str, float]:
+        # returns the IP of the hostname and the number of seconds it can be cached for
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+
+        cached = self._cache.get(hostname)
+
+        if cached and cached[1] > now:
+            return cached[0], cached[1] - now
+
+        negative = self._negative.get(hostname)
+
+        if negative and negative[1] > now:
+            return self._serve_stale(hostname, negative[2], negative[1] - now)
+
+        # concurrent lookups for the same name share a single query
+        if hostname not in self._inflight:
+            self._inflight[hostname] = asyncio.ensure_future(self._refresh(hostname))
+            self._inflight[hostname].add_done_callback(lambda _: self._inflight.pop(hostname, None))
+
+        return await asyncio.shield(self._inflight[hostname])
+
+    async def resolve_many(self, hostnames: list[str]) -> dict[str, str | Exception]:
+        unique = list(dict.fromkeys(hostnames))
+        results = await asyncio.gather(*[self.resolve(hostname) for hostname in unique], return_exceptions=True)
+
+        return {hostname: result if isinstance(result, BaseException) else result[0] for hostname, result in zip(unique, results)} # type: ignore
+
+    def clear(self) -> None:
+        self._cache.clear()
+        self._negative.clear()
+
+    async def _refresh(self, hostname: str) -> tuple[str, float]:
+        loop = asyncio.get_running_loop()
+
+        try:
+            ip, ttl = await self._lookup(hostname)
+        except Exception as e:
+            failures = self._negative.get(hostname, (0, 0, ''))[0] + 1
+            backoff = min(self._negative_ttl * 2 ** (failures - 1), self._negative_ttl * NEGATIVE_BACKOFF_MAX_FACTOR)
+
+            self._negative[hostname] = (failures, loop.time() + backoff, str(e))
+            self._logger.debug(f'Lookup of "{hostname}" failed ({failures} time(s)), retrying in {backoff}s: {e}')
+
+            ip, retry_in = self._serve_stale(hostname, str(e), backoff)
+            self._logger.warning(f'Could not resolve "{hostname}" ({e}). Using last known IP {ip}')
+
+            return ip, retry_in
+
+        ttl = max(MIN_TTL, min(ttl, self._max_ttl))
+
+        self._cache[hostname] = (ip, loop.time() + ttl, loop.time())
+        self._negative.pop(hostname, None)
+
+        return ip, ttl
+
+    async def _lookup(self, hostname: str) -> tuple[str, float]:
+        # only fully qualified, unicast DNS names are queried directly (that's where TTLs come from),
+        # everything else (hosts file, mDNS, search domains) goes through the system resolver
+        if self._use_dns(hostname):
+            nameservers = DnsClient.get_nameservers()
+
+            if nameservers:
+                try:
+                    return await DnsClient.query_a(hostname, nameservers)
+                except DnsNameError:
+                    raise
+                except DnsError as e:
+                    self._logger.debug(f'{e}. Using system resolver for "{hostname}"')
+
+        ip = await HostDiscovery.get_ip_by_hostname(hostname)
+
+        return ip, self._max_ttl
+
+    def _use_dns(self, hostname: str) -> bool:
+        name = hostname.rstrip('.').lower()
+
+        if '.' not in name or name.endswith('.local'):
+            return False
+
+        return name not in self._get_hosts_file_names()
+
+    def _serve_stale(self, hostname: str, error: str, retry_in: float) -> tuple[str, float]:
+        cached = self._cache.get(hostname)
+
+        if cached and asyncio.get_running_loop().time() - cached[2] < STALE_MAX_AGE:
+            return cached[0], retry_in
+
+        raise ResolverError(f'Could not resolve "{hostname}": {error}')
+
+    def _get_hosts_file_names(self, filename: str = '/etc/hosts') -> set[str]:
+        try:
+            mtime = os.stat(filename).st_mtime
+        except OSError:
+            return set()
+
+        if mtime == self._hosts_file_mtime:
+            return self._hosts_file
+
+        names = set()
+
+        try:
+            with open(filename, 'r') as f:
+                for line in f:
+                    fields = line.split('#', 1)[0].split()
+                    names.update(name.rstrip('.').lower() for name in fields[1:])
+        except OSError:
+            pass
+
+        self._hosts_file = names
+        self._hosts_file_mtime = mtime
+
+        return names
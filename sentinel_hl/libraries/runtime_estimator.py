@@ -0,0 +1,206 @@
+from collections import deque
+
+try:
+    import numpy as np
+except ImportError:
+    # numpy is optional, it only speeds up refitting large windows
+    np = None
+
+__all__ = ['RuntimeEstimator']
+
+# windows at least this large are refitted with numpy when it is installed
+NUMPY_MIN_WINDOW = 256
+
+class RuntimeEstimator:
+    def __init__(self, window: int = 600, *, confirm: int = 3, min_samples: int = 5):
+        if window < 3:
+            raise ValueError('Window must hold at least 3 samples')
+
+        self._window: int = window
+        self._confirm: int = confirm
+        self._min_samples: int = max(3, min(min_samples, window))
+
+        # ring buffer of samples, preallocated once
+        self._times: list[float] = [0.0] * window
+        self._charges: list[float] = [0.0] * window
+        self._loads: list[float | None] = [None] * window
+
+        self._predictions: deque[float | None] = deque(maxlen=confirm)
+        
+        # drain (% per second) per unit of load measured by the last fit
+        self._drain_per_load: float | None = None
+
+        self.reset()
+
+    @property
+    def samples(self) -> int:
+        return self._count
+
+    @property
+    def prediction(self) -> float | None:
+        return self._predictions[-1] if self._predictions else None
+
+    def reset(self, *, keep_rate: bool = False) -> None:
+        # keep_rate starts a new window (e.g. after load was shed) but still predicts from the
+        # drain measured so far, scaled to the new load, until the new window can be fitted
+        if not keep_rate:
+            self._drain_per_load = None
+            
+        self._origin: float | None = None
+        self._next: int = 0
+        self._count: int = 0
+        self._added: int = 0
+
+        # running sums of the least squares fit of charge over time
+        self._sum_t: float = 0.0
+        self._sum_c: float = 0.0
+        self._sum_tt: float = 0.0
+        self._sum_tc: float = 0.0
+        self._sum_load: float = 0.0
+        self._load_count: int = 0
+
+        self._load: float | None = None
+        self._reported: float | None = None
+
+        self._predictions.clear()
+
+    def add(self, time: float, charge: float, load: float | None = None, runtime: float | None = None) -> float | None:
+        # adds a sample in O(1) and returns the predicted runtime in seconds
+        if self._origin is None:
+            self._origin = time
+
+        if self._count == self._window:
+            self._remove(self._next)
+        else:
+            self._count += 1
+
+        t = time - self._origin
+
+        self._times[self._next] = t
+        self._charges[self._next] = charge
+        self._loads[self._next] = load
+
+        self._sum_t += t
+        self._sum_c += charge
+        self._sum_tt += t * t
+        self._sum_tc += t * charge
+
+        if load is not None:
+            self._sum_load += load
+            self._load_count += 1
+
+        self._next = (self._next + 1) % self._window
+        self._added += 1
+
+        # subtracting evicted samples accumulates rounding errors, start from exact sums once per window
+        if self._added % self._window == 0:
+            self._refit()
+
+        self._load = load
+        self._reported = runtime if runtime else None
+
+        prediction = self.predict()
+        self._predictions.append(prediction)
+
+        return prediction
+
+    def predict(self) -> float | None:
+        # the fitted drain and the runtime reported by the driver are compared, the most pessimistic wins
+        fitted = self._fit()
+
+        if fitted is None:
+            return self._reported
+
+        if self._reported is None:
+            return fitted
+
+        return min(fitted, self._reported)
+
+    def settled_below(self, threshold: float) -> bool:
+        # a single noisy prediction is not enough, the last few ones must all agree
+        if len(self._predictions) < self._confirm:
+            return False
+
+        return all(prediction is not None and prediction <= threshold for prediction in self._predictions)
+
+    def _fit(self) -> float | None:
+        n = self._count
+
+        if n < self._min_samples:
+            return self._fit_prior()
+
+        denominator = n * self._sum_tt - self._sum_t * self._sum_t
+
+        if denominator <= 0:
+            return self._fit_prior()
+
+        # charge (%) lost per second
+        slope = (n * self._sum_tc - self._sum_t * self._sum_c) / denominator
+
+        if slope >= 0:
+            return self._fit_prior()
+
+        intercept = (self._sum_c - slope * self._sum_t) / n
+        charge = max(0.0, intercept + slope * self._times[self._next - 1])
+        drain = -slope
+
+        # the fit averages the drain over the window, scale it to the current load
+        if self._load and self._load_count:
+            mean_load = self._sum_load / self._load_count
+
+            if mean_load > 0:
+                self._drain_per_load = drain / mean_load
+                drain *= self._load / mean_load
+
+        return round(charge / drain, 2)
+    
+    def _fit_prior(self) -> float | None:
+        if self._drain_per_load is None or not self._load or not self._count:
+            return None
+        
+        return round(self._charges[self._next - 1] / (self._drain_per_load * self._load), 2)
+
+    def _remove(self, index: int) -> None:
+        t = self._times[index]
+        charge = self._charges[index]
+        load = self._loads[index]
+
+        self._sum_t -= t
+        self._sum_c -= charge
+        self._sum_tt -= t * t
+        self._sum_tc -= t * charge
+
+        if load is not None:
+            self._sum_load -= load
+            self._load_count -= 1
+
+    def _refit(self) -> None:
+        # only called with a full window, also moves the time origin to the oldest sample so the sums stay small
+        oldest = self._times[self._next]
+
+        self._origin += oldest # type: ignore
+
+        loads = [load for load in self._loads[:self._count] if load is not None]
+
+        if np is not None and self._count >= NUMPY_MIN_WINDOW:
+            times = np.asarray(self._times[:self._count]) - oldest
+            charges = np.asarray(self._charges[:self._count])
+
+            self._times[:self._count] = times.tolist()
+            self._sum_t = float(times.sum())
+            self._sum_c = float(charges.sum())
+            self._sum_tt = float(times @ times)
+            self._sum_tc = float(times @ charges)
+            self._sum_load = float(np.sum(loads)) if loads else 0.0
+        else:
+            times = [t - oldest for t in self._times[:self._count]]
+            charges = self._charges[:self._count]
+
+            self._times[:self._count] = times
+            self._sum_t = sum(times)
+            self._sum_c = sum(charges)
+            self._sum_tt = sum(t * t for t in times)
+            self._sum_tc = sum(t * c for t, c in zip(times, charges))
+            self._sum_load = sum(loads)
+
+        self._load_count = len(loads)
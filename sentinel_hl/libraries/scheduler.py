@@ -0,0 +1,88 @@
+import asyncio
+import heapq
+import itertools
+
+__all__ = ['Scheduler']
+
+class Scheduler:
+    def __init__(self, *, coalesce: float = 0.01):
+        # jobs due within `coalesce` seconds of each other are released together
+        self._coalesce: float = coalesce
+
+        self._heap: list[tuple[float, int, str]] = []
+        self._due: dict[str, tuple[float, int]] = {}
+        self._counter = itertools.count()
+        self._changed: asyncio.Event = asyncio.Event()
+
+    def __len__(self) -> int:
+        return len(self._due)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._due
+
+    def schedule(self, key: str, due: float) -> None:
+        # rescheduling a key replaces its previous entry, stale heap entries are dropped lazily
+        entry = (due, next(self._counter))
+
+        self._due[key] = entry
+        heapq.heappush(self._heap, (*entry, key))
+
+        if self._heap[0][2] == key:
+            self._changed.set()
+
+    def unschedule(self, key: str) -> None:
+        if self._due.pop(key, None) is not None:
+            self._changed.set()
+
+    def next_due(self) -> float | None:
+        self._drop_stale()
+
+        if not self._heap:
+            return None
+
+        return self._heap[0][0]
+
+    def pop_due(self, now: float) -> list[tuple[str, float]]:
+        due = []
+
+        while True:
+            self._drop_stale()
+
+            if not self._heap or self._heap[0][0] > now + self._coalesce:
+                break
+
+            time, _, key = heapq.heappop(self._heap)
+            del self._due[key]
+
+            due.append((key, time))
+
+        return due
+
+    async def wait_due(self) -> list[tuple[str, float]]:
+        # returns (key, due time) of every job that is due, waiting for the earliest one if needed
+        loop = asyncio.get_running_loop()
+
+        while True:
+            self._changed.clear()
+
+            next_due = self.next_due()
+            now = loop.time()
+
+            if next_due is not None and next_due <= now + self._coalesce:
+                return self.pop_due(now)
+
+            timeout = None if next_due is None else next_due - now
+
+            try:
+                await asyncio.wait_for(self._changed.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def _drop_stale(self) -> None:
+        while self._heap:
+            time, counter, key = self._heap[0]
+
+            if self._due.get(key) == (time, counter):
+                return
+
+            heapq.heappop(self._heap)
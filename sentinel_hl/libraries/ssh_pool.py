@@ -0,0 +1,94 @@
+import logging
+import asyncio
+import os
+from sentinel_hl.libraries.cmd_exec import CmdExec, CmdExecHost, CmdExecProcessError
+
+__all__ = ['SshPool']
+
+# how long an idle master connection is kept open
+SSH_CONTROL_PERSIST = 600
+SSH_CONNECT_TIMEOUT = 10
+# timeout of the control commands (-O check / exit), they only talk to the local socket
+SSH_CONTROL_TIMEOUT = 5
+
+class SshPool:
+    def __init__(self, control_dir: str, *, persist: int = SSH_CONTROL_PERSIST, logger: logging.Logger | None = None):
+        self._control_dir: str = control_dir
+        self._persist: int = persist
+        self._logger: logging.Logger = logger or logging.getLogger(__name__)
+
+        self._masters: dict[tuple, CmdExecHost] = {}
+        self._warming: dict[tuple, asyncio.Future] = {}
+
+    @property
+    def control_path(self) -> str:
+        # %C is a hash of the local host, remote host, port and user, short enough for a unix socket path
+        return os.path.join(self._control_dir, '%C')
+
+    def client_options(self) -> list[str]:
+        # commands go through a master connection when one is up, and connect directly otherwise.
+        # they never become a master themselves, a persisting master would hold their output pipes open
+        return ['-o', 'ControlMaster=no', '-o', f'ControlPath={self.control_path}']
+
+    async def check(self, host: CmdExecHost) -> bool:
+        try:
+            await CmdExec.ssh(host, ['-O', 'check', '-o', f'ControlPath={self.control_path}'], timeout=SSH_CONTROL_TIMEOUT)
+        except CmdExecProcessError:
+            return False
+
+        return True
+
+    async def warm(self, host: CmdExecHost) -> bool:
+        # opens a master connection to the host unless a healthy one is already up
+        key = self._key(host)
+
+        # concurrent callers share the same attempt
+        if key not in self._warming:
+            self._warming[key] = asyncio.ensure_future(self._warm(host))
+            self._warming[key].add_done_callback(lambda _: self._warming.pop(key, None))
+
+        return await asyncio.shield(self._warming[key])
+
+    async def warm_many(self, hosts: list[CmdExecHost]) -> dict[str, bool]:
+        results = await asyncio.gather(*[self.warm(host) for host in hosts])
+
+        return {host.host: result for host, result in zip(hosts, results)}
+
+    async def close(self) -> None:
+        for host in list(self._masters.values()):
+            try:
+                await CmdExec.ssh(host, ['-O', 'exit', '-o', f'ControlPath={self.control_path}'], timeout=SSH_CONTROL_TIMEOUT)
+            except CmdExecProcessError as e:
+                self._logger.debug(f'Could not close SSH master connection to {host.host}: {e}')
+
+        self._masters.clear()
+
+    async def _warm(self, host: CmdExecHost) -> bool:
+        if await self.check(host):
+            self._masters[self._key(host)] = host
+            return True
+
+        os.makedirs(self._control_dir, mode=0o700, exist_ok=True)
+
+        opts = [
+            '-M', '-N', '-f',
+            '-o', 'ControlMaster=yes',
+            '-o', f'ControlPath={self.control_path}',
+            '-o', f'ControlPersist={self._persist}',
+            '-o', f'ConnectTimeout={SSH_CONNECT_TIMEOUT}',
+        ]
+
+        try:
+            # -f backgrounds the master once authenticated, it must not inherit our pipes
+            await CmdExec.ssh(host, opts, timeout=SSH_CONNECT_TIMEOUT * 2, stdin=asyncio.subprocess.DEVNULL, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL)
+        except CmdExecProcessError as e:
+            self._logger.warning(f'Could not open SSH master connection to {host.host} ({e or f"exit code {e.code}"})')
+            return False
+
+        self._masters[self._key(host)] = host
+        self._logger.debug(f'SSH master connection to {host.host} ready')
+
+        return True
+
+    def _key(self, host: CmdExecHost) -> tuple:
+        return (host.host, host.port, host.user)
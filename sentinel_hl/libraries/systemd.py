@@ -0,0 +1,59 @@
+import logging
+import socket
+import os
+
+__all__ = ['SdNotifier']
+
+class SdNotifier:
+    # minimal sd_notify(3), does nothing when not started by systemd with Type=notify
+    def __init__(self, *, logger: logging.Logger | None = None):
+        self._logger: logging.Logger = logger or logging.getLogger(__name__)
+        self._address: str | None = os.environ.get('NOTIFY_SOCKET') or None
+        self._socket: socket.socket | None = None
+
+        # abstract namespace socket
+        if self._address and self._address.startswith('@'):
+            self._address = '\0' + self._address[1:]
+
+    @property
+    def enabled(self) -> bool:
+        return self._address is not None
+
+    @property
+    def watchdog_interval(self) -> float | None:
+        # WatchdogSec of the unit, in seconds
+        usec = os.environ.get('WATCHDOG_USEC', '')
+        pid = os.environ.get('WATCHDOG_PID', '')
+
+        if not usec.isdigit() or not int(usec):
+            return None
+
+        if pid.isdigit() and int(pid) != os.getpid():
+            return None
+
+        return int(usec) / 1_000_000
+
+    def notify(self, state: str) -> bool:
+        if self._address is None:
+            return False
+
+        try:
+            if self._socket is None:
+                self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM | socket.SOCK_CLOEXEC)
+                self._socket.setblocking(False)
+
+            self._socket.sendto(state.encode(), self._address)
+        except OSError as e:
+            self._logger.debug(f'Could not notify systemd ({state}): {e}')
+            return False
+
+        return True
+
+    def extend_timeout(self, seconds: float) -> bool:
+        # pushes the start / stop timeout of the unit to at least `seconds` from now (systemd 236+)
+        return self.notify(f'EXTEND_TIMEOUT_USEC={int(seconds * 1_000_000)}')
+
+    def close(self) -> None:
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
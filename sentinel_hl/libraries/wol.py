@@ -0,0 +1,145 @@
+import logging
+import asyncio
+import socket
+import re
+
+__all__ = ['WolSender', 'WolError', 'TokenBucket']
+
+MAC_SEPARATORS = re.compile(r'[:.\-]')
+MAC_PATTERN = re.compile(r'[0-9a-fA-F]{12}')
+
+class WolError(Exception):
+    pass
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int):
+        if rate <= 0 or burst < 1:
+            raise ValueError('Rate must be positive and burst at least 1')
+
+        self._rate: float = rate
+        self._burst: int = burst
+        self._tokens: float = burst
+        self._updated: float | None = None
+
+    async def acquire(self) -> None:
+        # callers are served one at a time by the sender, no lock needed
+        loop = asyncio.get_running_loop()
+
+        while True:
+            now = loop.time()
+
+            if self._updated is not None:
+                self._tokens = min(self._burst, self._tokens + (now - self._updated) * self._rate)
+
+            self._updated = now
+
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+
+            await asyncio.sleep((1 - self._tokens) / self._rate)
+
+class WolSender:
+    def __init__(self, *, repeat: int = 3, interval: float = 0.1, rate: float = 100, burst: int = 20, logger: logging.Logger | None = None):
+        self._repeat: int = max(1, repeat)
+        self._interval: float = interval
+        self._bucket: TokenBucket = TokenBucket(rate, burst)
+        self._logger: logging.Logger = logger or logging.getLogger(__name__)
+
+        # one broadcast socket per (broadcast, port), kept open for the lifetime of the sender
+        self._transports: dict[tuple[str, int], asyncio.DatagramTransport] = {}
+        self._payloads: dict[str, bytes] = {}
+
+        # (payload, address, future) waiting for the next batch
+        self._queue: list[tuple[bytes, tuple[str, int], asyncio.Future]] = []
+        self._sender: asyncio.Task | None = None
+
+    async def send(self, mac: str, broadcast: str, port: int) -> None:
+        # resolves once every repetition of the packet went out
+        future = asyncio.get_running_loop().create_future()
+
+        self._queue.append((self._get_payload(mac), (broadcast, port), future))
+
+        # wakes requested while a batch is running are sent with the next one
+        if self._sender is None or self._sender.done():
+            self._sender = asyncio.create_task(self._send_batches())
+
+        await asyncio.shield(future)
+
+    def close(self) -> None:
+        if self._sender is not None:
+            self._sender.cancel()
+            self._sender = None
+
+        for _, _, future in self._queue:
+            if not future.done():
+                future.cancel()
+
+        self._queue.clear()
+
+        for transport in self._transports.values():
+            transport.close()
+
+        self._transports.clear()
+
+    async def _send_batches(self) -> None:
+        while self._queue:
+            batch, self._queue = self._queue, []
+            errors: dict[int, Exception] = {}
+
+            try:
+                for i in range(self._repeat):
+                    if i:
+                        await asyncio.sleep(self._interval)
+
+                    for index, (payload, address, _) in enumerate(batch):
+                        if index in errors:
+                            continue
+
+                        await self._bucket.acquire()
+
+                        try:
+                            transport = await self._get_transport(address)
+                            transport.sendto(payload, address)
+                        except OSError as e:
+                            errors[index] = WolError(f'Could not send magic packet to {address[0]}:{address[1]}: {e}')
+            except BaseException:
+                for _, _, future in batch:
+                    if not future.done():
+                        future.cancel()
+                raise
+
+            self._logger.debug(f'Sent {len(batch)} magic packet(s) {self._repeat} time(s)')
+
+            for index, (_, _, future) in enumerate(batch):
+                if future.done():
+                    continue
+
+                if index in errors:
+                    future.set_exception(errors[index])
+                else:
+                    future.set_result(None)
+
+    async def _get_transport(self, address: tuple[str, int]) -> asyncio.DatagramTransport:
+        transport = self._transports.get(address)
+
+        if transport is None or transport.is_closing():
+            transport, _ = await asyncio.get_running_loop().create_datagram_endpoint(asyncio.DatagramProtocol, family=socket.AF_INET, allow_broadcast=True)
+            self._transports[address] = transport
+
+        return transport
+
+    def _get_payload(self, mac: str) -> bytes:
+        payload = self._payloads.get(mac)
+
+        if payload is None:
+            digits = MAC_SEPARATORS.sub('', mac)
+
+            if not MAC_PATTERN.fullmatch(digits):
+                raise WolError(f'Invalid MAC address "{mac}"')
+
+            # 6 bytes of 0xff followed by the MAC address 16 times
+            payload = b'\xff' * 6 + bytes.fromhex(digits) * 16
+            self._payloads[mac] = payload
+
+        return payload
@@ -3,21 +3,64 @@ import sys
 import logging
 import signal
 import yaml
-import datetime
 import asyncio
+import random
+import tempfile
+from typing import Any, Awaitable, Callable
 from logging.handlers import TimedRotatingFileHandler
 from sentinel_hl.exceptions import SentinelHlRuntimeError, ExitSignal, SIGHUPSignal
 from sentinel_hl.utils.logging import NoExceptionFormatter
 from sentinel_hl.libraries.cleanup_queue import CleanupQueue
 from sentinel_hl.libraries.datastore import Datastore
+from sentinel_hl.libraries.datastore_backends import SqliteBackend
 from sentinel_hl.libraries.cmd_exec import CmdExec, CmdExecProcessError
+from sentinel_hl.libraries.fan_out import FanOut, FanOutTimeoutError
+from sentinel_hl.libraries.scheduler import Scheduler
+from sentinel_hl.libraries.resolver import Resolver
+from sentinel_hl.libraries.neighbours import NeighbourTable
+from sentinel_hl.libraries.nut import Nut, NutPool, ROUND_TRIP
+from sentinel_hl.libraries.ssh_pool import SshPool
+from sentinel_hl.libraries.ack_tracker import AckTracker
+from sentinel_hl.libraries.control import ControlServer, ControlClient, ControlError, ControlUnavailableError
+from sentinel_hl.libraries.metrics import REGISTRY, MetricsServer, histogram, gauge, counter
+from sentinel_hl.libraries.systemd import SdNotifier
+from sentinel_hl.libraries.loop_monitor import LoopMonitor
 from sentinel_hl.models.sentinel_nl import SentinelHlModel
+from sentinel_hl.models.host import HostModel
+from sentinel_hl.models.ups import UpsModel
 from sentinel_hl.services.wol import WolService
-from sentinel_hl.services.host import HostService
+from sentinel_hl.services.host import HostService, PROBE_DURATION
 from sentinel_hl.services.ups import UpsService
 
 __all__ = ['SentinelHlManager']
 
+# fraction of a host check interval used to randomly spread consecutive checks
+CHECK_JITTER = 0.1
+# how often old status transitions / UPS samples are removed from the datastore history
+HISTORY_PRUNE_INTERVAL = 3600
+# slack added to the hosts check timeout when extending the systemd start timeout for a startup phase
+STARTUP_TIMEOUT_MARGIN = 30
+# settings only read at startup, changing them restarts the service on reload
+RESTART_SETTINGS = ['wol', 'metrics', 'datastore_backend', 'loop_lag_threshold']
+RESTART_HOSTS_POLICY_SETTINGS = ['mac_monitor', 'ack_probe_interval', 'ack_probe_interval_max', 'ip_cache_ttl', 'ip_negative_cache_ttl']
+
+CHECK_CYCLE_DURATION = histogram('sentinel_hl_hosts_check_cycle_seconds', 'Duration of a full hosts check cycle (startup and run once).', buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 15, 30, 60, 120, 300))
+HOST_CHECK_DURATION = histogram('sentinel_hl_host_check_duration_seconds', 'Duration of a scheduled host check, discovery included.', buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60))
+HOST_CHECK_DELAY = histogram('sentinel_hl_host_check_delay_seconds', 'How late scheduled host checks start compared with their due time.', buckets=(0.01, 0.05, 0.1, 0.5, 1, 5, 15, 30, 60, 120))
+HOSTS_CHECK_INTERVAL = gauge('sentinel_hl_hosts_check_interval_seconds', 'Configured base interval between host checks.')
+HOST_UP = gauge('sentinel_hl_host_up', 'Whether the last check found the host up (1) or down (0).', ('host',))
+HOST_ACKNOWLEDGED = gauge('sentinel_hl_host_acknowledged', 'Whether the host is acknowledged as down.', ('host',))
+HOST_OPERATION = gauge('sentinel_hl_host_operation', 'Wake / shutdown waiting for the host to confirm its status.', ('host', 'operation'))
+UPS_CONNECTED = gauge('sentinel_hl_ups_connected', 'Whether the connection to the upsd serving the UPS is open.', ('ups',))
+UPS_STATUS = gauge('sentinel_hl_ups_status', 'Status flags reported by the UPS (OL, OB, LB, ...).', ('ups', 'flag'))
+UPS_CHARGE = gauge('sentinel_hl_ups_battery_charge_percent', 'Battery charge reported by the UPS.', ('ups',))
+UPS_LOAD = gauge('sentinel_hl_ups_load_percent', 'Load reported by the UPS.', ('ups',))
+UPS_RUNTIME = gauge('sentinel_hl_ups_battery_runtime_seconds', 'Battery runtime reported by the UPS.', ('ups',))
+UPS_RUNTIME_ESTIMATE = gauge('sentinel_hl_ups_battery_runtime_estimate_seconds', 'Battery runtime predicted from the discharge while on battery.', ('ups',))
+UPS_HOSTS_HALTED = gauge('sentinel_hl_ups_hosts_halted', 'Whether hosts were shut down because of this UPS.', ('ups',))
+COMMANDS = counter('sentinel_hl_commands', 'Commands run by the daemon.', ('command',))
+COMMAND_FAILURES = counter('sentinel_hl_command_failures', 'Commands that failed or timed out.', ('command',))
+
 class SentinelHlManager:
     def __init__(self, *, log_file: str = '', log_level: str = '', config_file: str = '') -> None:
         self._log_file: str = log_file
@@ -33,21 +76,85 @@ class SentinelHlManager:
         self._run_main(self._do_run_forever)
     
     def clear_cache(self) -> None:
-        self._run_main(self._do_clear_cache)
+        try:
+            self._request_daemon('clear-cache')
+        except ControlUnavailableError:
+            # no daemon listening, the datastores are cleared directly
+            self._run_main(self._do_clear_cache)
+            return
+        except ControlError as e:
+            self._logger.error(f'Failed to clear caches: {e}')
+            return
+        
+        self._logger.info("All caches cleared")
         
     def reload(self) -> None:
         self._run_main(self._do_reload)
         
     def ack_host(self, name: str, clear: bool = False) -> None:
-        self._run_main(self._do_ack_host, name, clear=clear)
+        try:
+            self._request_daemon('clear-ack' if clear else 'ack', host=name)
+        except ControlUnavailableError:
+            self._run_main(self._do_ack_host, name, clear=clear)
+            return
+        except ControlError as e:
+            if clear:
+                self._logger.error(f'Failed to clear acknowledgment of host "{name}": {e}')
+            else:
+                self._logger.error(f'Failed to acknowledge host "{name}": {e}')
+            return
+        
+        if clear:
+            self._logger.info(f'Host "{name}" acknowledgment cleared')
+        else:
+            self._logger.info(f'Host "{name}" acknowledged down')
+            
+    def query(self, command: str) -> Any:
+        # live state of the running daemon (status, ups, pending)
+        try:
+            return self._request_daemon(command)
+        except ControlUnavailableError:
+            raise SentinelHlRuntimeError("Service is not running")
+        except ControlError as e:
+            raise SentinelHlRuntimeError(str(e))
+        
+    def _request_daemon(self, command: str, **args) -> Any:
+        return asyncio.run(ControlClient(self._get_control_socket_path()).request(command, **args))
 
     def _init(self) -> None:
         self._config: SentinelHlModel = SentinelHlModel(**self._load_config(file=self._config_file))
+        # the services update their models (e.g. discovered IP / MAC), reloads compare against the config as loaded
+        self._config_dump: dict = self._config.model_dump()
+        self._hot_reload: bool = False
         self._cleanup: CleanupQueue = CleanupQueue()
-        self._hosts_datastore: Datastore = Datastore(self._get_datastore_filepath('hosts'))
-        self._ups_datastore: Datastore = Datastore(self._get_datastore_filepath('ups'))
+        self._hosts_datastore: Datastore = self._datastore_factory('hosts')
+        self._ups_datastore: Datastore = self._datastore_factory('ups')
+        
+        # pushed first so they run last, after every other cleanup job had the chance to persist data
+        self._cleanup.push('close_datastores', self._close_datastores)
+        self._cleanup.push('flush_datastores', self._flush_datastores)
+        
+        self._resolver: Resolver = self._resolver_factory()
+        self._neighbours: NeighbourTable = NeighbourTable(logger=self._logger.getChild('neighbours'))
+        self._wol: WolService = self._wol_factory()
+        self._acks: AckTracker = AckTracker(interval=self._config.hosts_policy.ack_probe_interval, interval_max=self._config.hosts_policy.ack_probe_interval_max, logger=self._logger.getChild('ack'))
         self._hosts: list[HostService] = self._hosts_factory()
+        self._nut_pool: NutPool = NutPool(logger=self._logger.getChild('ups'))
+        self._ssh_pool: SshPool = SshPool(self._get_ssh_control_dir(), logger=self._logger.getChild('ssh'))
+        
+        # remote commands use the master connections of the pool when they are up
+        CmdExec.configure_ssh(self._ssh_pool.client_options())
+        CmdExec.configure_limit(self._config.cmd_exec_concurrency)
         self._ups_units: list[UpsService] = self._ups_units_factory()
+        
+        self._hosts_by_name: dict[str, HostService] = {host.name: host for host in self._hosts}
+        self._ups_units_by_name: dict[str, UpsService] = {ups.name: ups for ups in self._ups_units}
+        
+        REGISTRY.add_collector('manager', self._collect_metrics)
+        
+        # set by the polling tasks once they run
+        self._hosts_scheduler: Scheduler | None = None
+        self._ups_scheduler: Scheduler | None = None
 
     def _load_config(self, *, file: str = '') -> dict:
         config_files = [
@@ -89,13 +196,29 @@ class SentinelHlManager:
         else:
             return 'tmp/sentinel-hl.pid'
 
-    def _get_datastore_filepath(self, name: str) -> str:
+    def _get_control_socket_path(self) -> str:
+        if os.getuid() == 0:
+            return '/var/run/sentinel-hl.sock'
+        elif os.environ.get('XDG_RUNTIME_DIR'):
+            return os.path.join(os.environ['XDG_RUNTIME_DIR'], 'sentinel-hl.sock')
+        else:
+            return 'tmp/sentinel-hl.sock'
+
+    def _get_ssh_control_dir(self) -> str:
+        if os.getuid() == 0:
+            return '/var/run/sentinel-hl/ssh'
+        elif os.environ.get('XDG_RUNTIME_DIR'):
+            return os.path.join(os.environ['XDG_RUNTIME_DIR'], 'sentinel-hl', 'ssh')
+        else:
+            return os.path.join(tempfile.gettempdir(), f'sentinel-hl-{os.getuid()}', 'ssh')
+
+    def _get_datastore_filepath(self, name: str, ext: str = 'db') -> str:
         if self._is_venv():
-            filepath = os.path.join(sys.prefix, 'var', f'{name}.db')
+            filepath = os.path.join(sys.prefix, 'var', f'{name}.{ext}')
         elif os.getuid() == 0:
-            filepath = f'/var/lib/sentinel-hl/{name}.db'
+            filepath = f'/var/lib/sentinel-hl/{name}.{ext}'
         else:
-            filepath = os.path.expanduser(f'~/.sentinel-hl/{name}.db')
+            filepath = os.path.expanduser(f'~/.sentinel-hl/{name}.{ext}')
 
         directory = os.path.dirname(filepath)
         
@@ -142,43 +265,236 @@ class SentinelHlManager:
 
         return logger
 
+    def _datastore_factory(self, name: str) -> Datastore:
+        filepath = self._get_datastore_filepath(name)
+        
+        if self._config.datastore_backend == 'sqlite':
+            # all stores share one database, existing shelve files are imported on first use
+            backend = SqliteBackend(self._get_datastore_filepath('sentinel-hl', 'sqlite'), name, migrate_from=filepath, logger=self._logger.getChild('datastore'))
+            
+            return Datastore(filepath, backend=backend, write_behind=True)
+        
+        return Datastore(filepath, write_behind=True)
+    
     def _wol_factory(self) -> WolService:
         wol_logger = self._logger.getChild('wol')
         
         return WolService(self._config.wol, logger=wol_logger)
     
+    def _resolver_factory(self) -> Resolver:
+        resolver_logger = self._logger.getChild('resolver')
+        
+        return Resolver(max_ttl=self._config.hosts_policy.ip_cache_ttl, negative_ttl=self._config.hosts_policy.ip_negative_cache_ttl, logger=resolver_logger)
+    
     def _hosts_factory(self) -> list[HostService]:
+        return [self._host_factory(host) for host in self._config.hosts]
+    
+    def _host_factory(self, host: HostModel) -> HostService:
         hosts_logger = self._logger.getChild('host')
-        wol = self._wol_factory()
-
-        instances = []
         
-        for host in self._config.hosts:
-            instances.append(HostService(host, self._config.hosts_policy, datastore=self._hosts_datastore, wol=wol, logger=hosts_logger))
-
-        return instances
+        return HostService(host, self._config.hosts_policy, datastore=self._hosts_datastore, wol=self._wol, acks=self._acks, resolver=self._resolver, neighbours=self._neighbours, logger=hosts_logger)
     
     def _ups_units_factory(self) -> list[UpsService]:
-        ups_logger = self._logger.getChild('ups')
-        
         instances = []
         
         for ups in self._config.ups:
-            ups_hosts = [host for host in self._hosts if host.name in ups.hosts]
+            ups_hosts = self._get_ups_hosts(ups)
             
             if not ups_hosts:
                 self._logger.warning(f'UPS "{ups.name}" has no hosts configured. Skipping')
                 continue
             
-            instances.append(UpsService(ups, ups_hosts, self._config.ups_units_policy, datastore=self._ups_datastore, logger=ups_logger))
+            instances.append(self._ups_unit_factory(ups, ups_hosts))
             
         return instances
     
+    def _ups_unit_factory(self, ups: UpsModel, hosts: list[HostService]) -> UpsService:
+        ups_logger = self._logger.getChild('ups')
+        nut = self._nut_pool.get(ups.nut_host, ups.nut_port)
+        
+        return UpsService(ups, hosts, self._config.ups_units_policy, datastore=self._ups_datastore, nut=nut, ssh_pool=self._ssh_pool, logger=ups_logger)
+    
+    def _get_ups_hosts(self, ups: UpsModel) -> list[HostService]:
+        ups_host_names = [ups_host.name for ups_host in ups.hosts]
+        
+        return [host for host in self._hosts if host.name in ups_host_names]
+    
     def _exit_signal_handler(self) -> None:
         raise ExitSignal
     
     def _sighup_signal_handler(self) -> None:
-        raise SIGHUPSignal
+        # the running daemon applies config changes in place, everything else starts over
+        if not self._hot_reload:
+            raise SIGHUPSignal
+        
+        self._logger.info("Reloading config")
+        
+        try:
+            config = SentinelHlModel(**self._load_config(file=self._config_file))
+        except Exception as e:
+            self._logger.error(f'Not reloading, the config is invalid: {e}')
+            return
+        
+        restart = self._get_restart_settings(config)
+        
+        if restart:
+            self._logger.info(f'Restarting to apply changes to {", ".join(restart)}')
+            raise SIGHUPSignal
+        
+        try:
+            self._reload(config)
+        except Exception as e:
+            self._logger.exception(f'Reload failed: {e}')
+    
+    def _get_restart_settings(self, config: SentinelHlModel) -> list[str]:
+        dump = config.model_dump()
+        
+        changed = [name for name in RESTART_SETTINGS if dump[name] != self._config_dump[name]]
+        changed += [f'hosts_policy.{name}' for name in RESTART_HOSTS_POLICY_SETTINGS if dump['hosts_policy'][name] != self._config_dump['hosts_policy'][name]]
+        
+        return changed
+    
+    def _reload(self, config: SentinelHlModel) -> None:
+        # only services whose settings changed are rebuilt, the others keep their connections, timers and locks
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        
+        previous = self._config_dump
+        
+        self._config = config
+        self._config_dump = config.model_dump()
+        
+        # records the CLI changed (ack, clear-cache) since they were last read
+        changed_hosts = self._hosts_datastore.reload()
+        changed_ups = self._ups_datastore.reload()
+        
+        rebuilt = self._reload_hosts(previous, changed_hosts)
+        self._reload_ups_units(previous, rebuilt, changed_ups)
+        
+        if previous['cmd_exec_concurrency'] != config.cmd_exec_concurrency:
+            CmdExec.configure_limit(config.cmd_exec_concurrency)
+        
+        if previous['hosts_check_concurrency'] != config.hosts_check_concurrency and self._hosts_scheduler is not None:
+            # checks already running release the previous semaphore
+            self._hosts_check_semaphore = asyncio.Semaphore(config.hosts_check_concurrency)
+        
+        self._logger.info(f'Config reloaded in {(loop.time() - started) * 1000:.1f}ms')
+    
+    def _reload_hosts(self, previous: dict, changed: set[str]) -> set[str]:
+        # returns the names of the hosts that were added or rebuilt
+        loop = asyncio.get_running_loop()
+        
+        policy_changed = previous['hosts_policy'] != self._config_dump['hosts_policy']
+        previous_specs = {spec['name']: spec for spec in previous['hosts']}
+        current = {host.name: host for host in self._hosts}
+        
+        instances: list[HostService] = []
+        rebuilt: set[str] = set()
+        
+        for model, spec in zip(self._config.hosts, self._config_dump['hosts']):
+            host = current.pop(model.name, None)
+            
+            if host is not None and not policy_changed and previous_specs.get(model.name) == spec:
+                if model.name in changed:
+                    host.reload_cache()
+                    
+                instances.append(host)
+                continue
+            
+            instance = self._host_factory(model)
+            
+            if host is not None:
+                self._acks.cancel(host.name)
+                instance.carry_over(host)
+                    
+                self._logger.info(f'Host "{model.name}" updated')
+            else:
+                self._logger.info(f'Host "{model.name}" added')
+            
+            instances.append(instance)
+            rebuilt.add(model.name)
+            
+        for host in current.values():
+            self._acks.cancel(host.name)
+            
+            if self._hosts_scheduler is not None:
+                self._hosts_scheduler.unschedule(host.name)
+                
+            PROBE_DURATION.remove(host.name)
+            self._logger.info(f'Host "{host.name}" removed')
+            
+        self._hosts = instances
+        self._hosts_by_name = {host.name: host for host in instances}
+        
+        # new and updated hosts are discovered and checked right away
+        if self._hosts_scheduler is not None:
+            for name in rebuilt:
+                self._hosts_scheduler.schedule(name, loop.time())
+        
+        return rebuilt
+    
+    def _reload_ups_units(self, previous: dict, rebuilt_hosts: set[str], changed: set[str]) -> None:
+        loop = asyncio.get_running_loop()
+        
+        policy_changed = previous['ups_units_policy'] != self._config_dump['ups_units_policy']
+        previous_specs = {spec['name']: spec for spec in previous['ups']}
+        current = {ups.name: ups for ups in self._ups_units}
+        
+        instances: list[UpsService] = []
+        added: list[str] = []
+        
+        for model, spec in zip(self._config.ups, self._config_dump['ups']):
+            ups = current.pop(model.name, None)
+            ups_hosts = self._get_ups_hosts(model)
+            
+            if ups is not None and not policy_changed and previous_specs.get(model.name) == spec and ups_hosts:
+                if model.name in changed:
+                    ups.reload_cache()
+                    
+                if ups_hosts != ups.hosts:
+                    ups.replace_hosts(ups_hosts)
+                    
+                instances.append(ups)
+                continue
+            
+            if ups is not None:
+                ups.close()
+                
+            if not ups_hosts:
+                self._logger.warning(f'UPS "{model.name}" has no hosts configured. Skipping')
+                continue
+            
+            instances.append(self._ups_unit_factory(model, ups_hosts))
+            added.append(model.name)
+            
+            self._logger.info(f'UPS "{model.name}" {"updated" if ups is not None else "added"}')
+            
+        for ups in current.values():
+            ups.close()
+            
+            # nothing will wake the hosts this UPS was holding down anymore
+            for host in self._hosts:
+                host.unlock_wake(ups.name)
+                
+            if self._ups_scheduler is not None:
+                self._ups_scheduler.unschedule(ups.name)
+                
+            self._logger.info(f'UPS "{ups.name}" removed')
+            
+        self._ups_units = instances
+        self._ups_units_by_name = {ups.name: ups for ups in instances}
+        
+        if self._ups_scheduler is not None:
+            for name in added:
+                self._ups_scheduler.schedule(name, loop.time())
+        
+        unused = self._nut_pool.release_unused([ups.nut for ups in instances])
+        
+        for nut in unused:
+            ROUND_TRIP.remove(nut.server)
+            
+        if unused:
+            asyncio.create_task(self._disconnect_nut_clients(unused))
     
     def _run_main(self, main_task, *args, **kwargs) -> None:
         run = True
@@ -271,18 +587,60 @@ class SentinelHlManager:
 
         self._logger.info(f'Sentinel-Hl daemon started with pid {pid}')
         
-        tasks = []
+        # the CLI sends its commands here instead of writing to the datastores
+        control = ControlServer(self._get_control_socket_path(), self._control_handlers(), logger=self._logger.getChild('control'))
+        
+        try:
+            await control.start()
+            self._cleanup.push('close_control_socket', control.close)
+        except OSError as e:
+            self._logger.error(f'Failed to open control socket: {e}')
+            
+        if self._config.metrics.enabled:
+            metrics = MetricsServer(REGISTRY, self._config.metrics.host, self._config.metrics.port, logger=self._logger.getChild('metrics'))
+            
+            try:
+                await metrics.start()
+                self._cleanup.push('close_metrics_server', metrics.close)
+            except OSError as e:
+                self._logger.error(f'Failed to serve metrics on {self._config.metrics.host}:{self._config.metrics.port}: {e}')
+        
+        # started before the initial discovery so a blocking call there is caught too
+        notifier = SdNotifier(logger=self._logger.getChild('systemd'))
+        monitor = LoopMonitor(threshold=self._config.loop_lag_threshold, notifier=notifier, logger=self._logger.getChild('loop'))
+        
+        tasks = [asyncio.create_task(monitor.run())]
+        
+        self._cleanup.push('close_systemd_notifier', notifier.close)
         
+        if self._config.hosts_policy.mac_monitor and await self._neighbours.start_monitor():
+            self._cleanup.push('stop_neighbours_monitor', self._neighbours.stop_monitor)
+        
+        # each phase is bounded by the hosts check timeout, together they can outlast TimeoutStartSec
+        notifier.extend_timeout(self._get_hosts_check_timeout() + STARTUP_TIMEOUT_MARGIN)
         await self._discover_hosts()
         await self._poll_ups_units()
+        
+        notifier.extend_timeout(self._get_hosts_check_timeout() + STARTUP_TIMEOUT_MARGIN)
         await self._check_hosts(run_discovery = False)
         
         self._cleanup.push('disconnect_ups_units', self._disconnect_ups_units)
+        self._cleanup.push('close_ssh_pool', self._ssh_pool.close)
+        self._cleanup.push('close_wol', self._wol.close)
+        self._cleanup.push('close_ack_tracker', self._acks.close)
+        self._cleanup.push('log_cmd_exec_stats', self._log_cmd_exec_stats)
+        
+        # from now on SIGHUP reloads the config in place
+        self._hot_reload = True
+        
+        # a full restart on SIGHUP runs this again in the same process, systemd ignores the repeated READY
+        notifier.notify('READY=1')
         
         self._logger.info("Polling for new events...")
         
         tasks.append(asyncio.create_task(self._poll_ups_units_task()))
         tasks.append(asyncio.create_task(self._check_hosts_task()))
+        tasks.append(asyncio.create_task(self._flush_datastores_task()))
 
         await asyncio.gather(*tasks, return_exceptions=True)
         
@@ -294,87 +652,406 @@ class SentinelHlManager:
                 self._logger.exception(f'Task failed with exception: {task.exception()}')
 
     async def _poll_ups_units_task(self) -> None:
-        run_time = datetime.datetime.now().replace(microsecond=0)
-        
+        # the task keeps running without UPS units, a reload may add some
         if not self._ups_units:
-            self._logger.info("No UPS units configured. Skipping UPS polling task")
-            return
+            self._logger.info("No UPS units configured")
+        
+        loop = asyncio.get_running_loop()
+        
+        # each UPS has its own cadence (see UpsService.get_poll_interval), units due together are polled in one batch
+        scheduler = self._ups_scheduler = Scheduler()
+        
+        for ups in self._ups_units:
+            scheduler.schedule(ups.name, loop.time() + ups.get_poll_interval(self._config.ups_poll_interval))
 
         while True:
-            # calculate the next scheduled run_time
-            run_time += datetime.timedelta(seconds=self._config.ups_poll_interval)
+            due = await scheduler.wait_due()
+            # units may have been added or removed by a reload meanwhile
+            batch = [self._ups_units_by_name[name] for name, _ in due if name in self._ups_units_by_name]
             
-            # calculate the time left until the next run_time
-            time_left = (run_time - datetime.datetime.now()).total_seconds()
-
-            if time_left > 0:
-                self._logger.debug(f'Sleeping for {time_left}s until next UPS poll')
-                await asyncio.sleep(time_left)
-            else:
-                self._logger.debug('Running UPS polling now')
-                run_time = datetime.datetime.now().replace(microsecond=0) + datetime.timedelta(seconds=self._config.ups_poll_interval)
+            await self._poll_ups_units(batch)
+            
+            now = loop.time()
+            base = self._config.ups_poll_interval
+            
+            for name, due_at in due:
+                ups = self._ups_units_by_name.get(name)
+                
+                if ups is None:
+                    continue
+                
+                # keep the cadence from drifting, unless the poll ran late
+                next_run = due_at + ups.get_poll_interval(base)
                 
-            await self._poll_ups_units()
+                if next_run <= now:
+                    self._logger.debug(f'UPS "{name}" poll is running behind schedule')
+                    next_run = now
+                    
+                scheduler.schedule(name, next_run)
             
     async def _check_hosts_task(self) -> None:
-        run_time = datetime.datetime.now().replace(microsecond=0)
+        loop = asyncio.get_running_loop()
+        interval = self._config.hosts_check_interval
+        
+        self._hosts_check_semaphore: asyncio.Semaphore = asyncio.Semaphore(self._config.hosts_check_concurrency)
+        self._hosts_scheduler = Scheduler()
+        
+        running: set[asyncio.Task] = set()
+        
+        # spread the first checks across the interval so hosts don't all get checked at once
+        for host in self._hosts:
+            self._hosts_scheduler.schedule(host.name, loop.time() + random.uniform(0, interval))
 
         while True:
-            # calculate the next scheduled run_time
-            run_time += datetime.timedelta(seconds=self._config.hosts_check_interval)
-
-            # calculate the time left until the next run_time
-            time_left = (run_time - datetime.datetime.now()).total_seconds()
-
-            if time_left > 0:
-                self._logger.debug(f'Sleeping for {time_left}s until next hosts check')
-                await asyncio.sleep(time_left)
-            else:
-                self._logger.debug('Running hosts check now')
-                run_time = datetime.datetime.now().replace(microsecond=0) + datetime.timedelta(seconds=self._config.hosts_check_interval)
+            for name, due in await self._hosts_scheduler.wait_due():
+                # hosts may have been added or removed by a reload meanwhile
+                host = self._hosts_by_name.get(name)
+                
+                if host is None:
+                    continue
                 
-            await self._check_hosts()
+                task = asyncio.create_task(self._run_scheduled_host_check(host, due))
+                running.add(task)
+                task.add_done_callback(running.discard)
+                
+    async def _run_scheduled_host_check(self, host: HostService, due: float) -> None:
+        loop = asyncio.get_running_loop()
+        interval = self._config.hosts_check_interval
+        
+        try:
+            async with self._hosts_check_semaphore:
+                late = loop.time() - due
+                HOST_CHECK_DELAY.observe(max(0.0, late))
+                
+                if late > interval:
+                    self._logger.warning(f'Check for host "{host.name}" is running {late:.2f}s behind schedule')
+                elif late > 1:
+                    self._logger.debug(f'Check for host "{host.name}" is running {late:.2f}s behind schedule')
+                
+                started = loop.time()
+                await asyncio.wait_for(self._check_host_job(host, True)(), timeout=self._get_hosts_check_timeout())
+                HOST_CHECK_DURATION.observe(loop.time() - started)
+        except asyncio.TimeoutError:
+            self._logger.warning(f'Check for host "{host.name}" did not finish within {self._get_hosts_check_timeout()}s')
+        except Exception as e:
+            self._logger.exception(e)
+        finally:
+            # missed checks are not replayed, the next one is scheduled from the time this one finished
+            # a host must never drop out of the schedule, whatever goes wrong computing its interval
+            try:
+                next_interval = host.get_check_interval(interval)
+            except Exception as e:
+                self._logger.exception(e)
+                next_interval = interval
+                
+            self._hosts_scheduler.schedule(host.name, loop.time() + next_interval * random.uniform(1 - CHECK_JITTER, 1 + CHECK_JITTER))
             
-    async def _discover_hosts(self) -> None:
-        self._logger.info("Running initial hosts discovery...")
+            self._logger.debug(f'Next check for host "{host.name}" in {next_interval:.2f}s')
+            
+    async def _flush_datastores_task(self) -> None:
+        loop = asyncio.get_running_loop()
+        pruned_at = loop.time()
         
-        for host in self._hosts:
+        while True:
+            await asyncio.sleep(self._config.datastore_flush_interval)
+            
+            self._flush_datastores()
+            
+            if loop.time() - pruned_at >= HISTORY_PRUNE_INTERVAL:
+                pruned_at = loop.time()
+                self._prune_history()
+            
+    def _prune_history(self) -> None:
+        for datastore in (self._hosts_datastore, self._ups_datastore):
             try:
-                await host.discover()
-                self._logger.info(f'Host "{host.name}" ip: {host.ip}, MAC: {host.mac}')
+                datastore.prune_history(self._config.history_retention)
+            except Exception as e:
+                self._logger.error(f'Failed to prune datastore history: {e}')
                 
-                if host.acknowledged:
-                    self._logger.warning(f'Host "{host.name}" is acknowledged as down. Won\'t check its status')
+
+    def _flush_datastores(self) -> None:
+        for datastore in (self._hosts_datastore, self._ups_datastore):
+            try:
+                datastore.flush()
             except Exception as e:
-                self._logger.warning(f'Discovery failed for host "{host.name}": {e}')
+                self._logger.error(f'Failed to flush datastore: {e}')
                 
-    async def _poll_ups_units(self) -> None:
-        for ups in self._ups_units:
+    def _close_datastores(self) -> None:
+        for datastore in (self._hosts_datastore, self._ups_datastore):
             try:
-                await ups.poll()
+                datastore.close()
             except Exception as e:
-                self._logger.exception(e)
-
-    async def _check_hosts(self, run_discovery: bool = True) -> None:
+                self._logger.error(f'Failed to close datastore: {e}')
+                
+    async def _discover_hosts(self) -> None:
+        self._logger.info("Running initial hosts discovery...")
+        
+        await self._prime_neighbours(await self._resolve_hostnames())
+        
+        fan_out = FanOut(self._config.hosts_check_concurrency, timeout=self._get_hosts_check_timeout())
+        results = await fan_out.run({host.name: host.discover for host in self._hosts})
+        
         for host in self._hosts:
+            error = results.get(host.name)
+            
+            if error is not None:
+                self._logger.warning(f'Discovery failed for host "{host.name}": {error}')
+                continue
+            
+            self._logger.info(f'Host "{host.name}" ip: {host.ip}, MAC: {host.mac}')
+            
+            if host.acknowledged:
+                self._logger.warning(f'Host "{host.name}" is acknowledged as down. Won\'t check its status')
+                
+    async def _poll_ups_units(self, units: list[UpsService] | None = None) -> None:
+        # UPS units served by the same upsd are fetched in a single round trip, each upsd is polled concurrently
+        groups: dict[Nut, list[UpsService]] = {}
+        
+        for ups in (self._ups_units if units is None else units):
+            groups.setdefault(ups.nut, []).append(ups)
+            
+        await asyncio.gather(*[self._poll_ups_group(nut, units) for nut, units in groups.items()])
+        
+    async def _poll_ups_group(self, nut: Nut, units: list[UpsService]) -> None:
+        # the whole group is listed in full as soon as one of the units asks for it
+        variables: list[str] | None = []
+        
+        for ups in units:
+            ups_variables = ups.poll_variables
+            
+            if ups_variables is None:
+                variables = None
+                break
+            
+            variables = list(dict.fromkeys([*variables, *ups_variables])) # type: ignore
+        
+        try:
+            results = await nut.get_ups_vars_many([ups.nut_id for ups in units], variables)
+        except Exception as e:
+            for ups in units:
+                self._logger.error(f'Error polling UPS "{ups.name}": {e}')
+            return
+        
+        for ups in units:
             try:
-                if run_discovery:
-                    await host.discover()
-                    
-                await host.check()
+                await ups.process(results.get(ups.nut_id), full=variables is None)
             except Exception as e:
                 self._logger.exception(e)
+
+    async def _check_hosts(self, run_discovery: bool = True) -> None:
+        if run_discovery:
+            await self._prime_neighbours(await self._resolve_hostnames())
+            
+        jobs = {host.name: self._check_host_job(host, run_discovery) for host in self._hosts}
+        
+        fan_out = FanOut(self._config.hosts_check_concurrency, timeout=self._get_hosts_check_timeout())
+        results = await fan_out.run(jobs)
+        
+        timed_out = []
+        
+        for name, error in results.items():
+            if error is None:
+                continue
+            
+            if isinstance(error, FanOutTimeoutError):
+                timed_out.append(name)
+            else:
+                self._logger.error(f'Check failed for host "{name}": {error}', exc_info=error)
+                
+        if timed_out:
+            self._logger.warning(f'Hosts check deadline reached before checking {len(timed_out)} host(s): {", ".join(timed_out)}')
+                
+        interval = self._config.hosts_check_interval
+        CHECK_CYCLE_DURATION.observe(fan_out.elapsed)
+        
+        if fan_out.elapsed > interval:
+            self._logger.warning(f'Hosts check cycle took {fan_out.elapsed:.2f}s, longer than the check interval of {interval}s')
+        else:
+            self._logger.debug(f'Hosts check cycle took {fan_out.elapsed:.2f}s of the {interval}s check interval ({len(jobs)} hosts)')
+            
+    async def _resolve_hostnames(self) -> dict[str, str]:
+        # resolve every hostname in one pass so the per host discovery is served from the resolver cache
+        hostnames = [host.hostname for host in self._hosts if host.resolves_hostname]
+        
+        if not hostnames:
+            return {}
+        
+        results = await self._resolver.resolve_many(hostnames)
+        resolved = {hostname: result for hostname, result in results.items() if isinstance(result, str)}
+        
+        self._logger.debug(f'Resolved {len(resolved)}/{len(results)} hostname(s)')
+        
+        return resolved
+        
+    async def _prime_neighbours(self, resolved: dict[str, str]) -> None:
+        # read the neighbour table once and resolve all missing MACs together, per host discovery then only does lookups
+        ips = [resolved.get(host.hostname, host.ip) for host in self._hosts if host.resolves_mac]
+        ips = [ip for ip in ips if ip]
+        
+        if not ips:
+            return
+        
+        try:
+            await self._neighbours.prime(ips)
+        except Exception as e:
+            self._logger.warning(f'Failed to prime neighbour table: {e}')
+        
+    def _check_host_job(self, host: HostService, run_discovery: bool) -> Callable[[], Awaitable]:
+        async def job() -> None:
+            if run_discovery:
+                await host.discover()
+                
+            await host.check()
+            
+        return job
     
-    async def _disconnect_ups_units(self) -> None:
+    def _get_hosts_check_timeout(self) -> int:
+        return self._config.hosts_check_timeout or self._config.hosts_check_interval
+    
+    def _collect_metrics(self) -> None:
+        # gauges mirror the live state of the services, refreshed on every scrape
+        for family in (HOST_UP, HOST_ACKNOWLEDGED, HOST_OPERATION, UPS_CONNECTED, UPS_STATUS, UPS_CHARGE, UPS_LOAD, UPS_RUNTIME, UPS_RUNTIME_ESTIMATE, UPS_HOSTS_HALTED):
+            family.clear()
+        
+        HOSTS_CHECK_INTERVAL.set(self._config.hosts_check_interval)
+        
+        for host in self._hosts:
+            if host.status is not None:
+                HOST_UP.set(int(host.status == 'up'), host.name)
+                
+            HOST_ACKNOWLEDGED.set(int(host.acknowledged), host.name)
+            
+            if host.operation is not None:
+                HOST_OPERATION.set(1, host.name, host.operation)
+            
         for ups in self._ups_units:
-            if not ups.connected:
+            UPS_CONNECTED.set(int(ups.connected), ups.name)
+            UPS_HOSTS_HALTED.set(int(ups.hosts_halted), ups.name)
+            
+            if ups.runtime_prediction is not None:
+                UPS_RUNTIME_ESTIMATE.set(ups.runtime_prediction, ups.name)
+            
+            data = ups.data or {}
+            
+            for flag in data.get('ups.status', []):
+                UPS_STATUS.set(1, ups.name, flag)
+                
+            for family, variable in ((UPS_CHARGE, 'battery.charge'), (UPS_LOAD, 'ups.load'), (UPS_RUNTIME, 'battery.runtime')):
+                if isinstance(data.get(variable), float):
+                    family.set(data[variable], ups.name)
+                    
+        for kind, stats in CmdExec.get_stats().items():
+            COMMANDS.set(stats.count, kind)
+            COMMAND_FAILURES.set(stats.failures, kind)
+    
+    def _log_cmd_exec_stats(self) -> None:
+        for kind, stats in sorted(CmdExec.get_stats().items(), key=lambda item: -item[1].total_time):
+            self._logger.debug(f'Command "{kind}": {stats}')
+            
+    async def _disconnect_nut_clients(self, clients: list[Nut]) -> None:
+        for nut in clients:
+            if not nut.connected:
                 continue
                 
             try:
-                await ups.disconnect()
+                await nut.disconnect()
             except Exception as e:
                 self._logger.exception(e)
                 
+    async def _disconnect_ups_units(self) -> None:
+        # connections are shared between UPS units, each one is closed once
+        await self._disconnect_nut_clients(self._nut_pool.clients)
+                
+    def _control_handlers(self) -> dict[str, Callable[..., Any]]:
+        return {
+            'ack': self._control_ack,
+            'clear-ack': self._control_clear_ack,
+            'clear-cache': self._control_clear_cache,
+            'status': self._control_status,
+            'ups': self._control_ups,
+            'pending': self._control_pending,
+        }
+        
+    def _control_ack(self, host: str) -> dict:
+        instance = self._get_control_host(host)
+        instance.ack()
+        
+        self._logger.info(f'Host "{host}" acknowledged down')
+        
+        return self._get_host_state(instance)
+    
+    def _control_clear_ack(self, host: str) -> dict:
+        instance = self._get_control_host(host)
+        
+        if not instance.acknowledged:
+            raise ControlError(f'Host "{host}" is not acknowledged')
+        
+        instance.clear_ack()
+        
+        # checked right away instead of on its next turn
+        if self._hosts_scheduler is not None:
+            self._hosts_scheduler.schedule(host, asyncio.get_running_loop().time())
+        
+        self._logger.info(f'Host "{host}" acknowledgment cleared')
+        
+        return self._get_host_state(instance)
+    
+    def _control_clear_cache(self) -> None:
+        self._hosts_datastore.clear()
+        self._ups_datastore.clear()
+        
+        for host in self._hosts:
+            host.reload_cache()
+            
+        for ups in self._ups_units:
+            ups.reload_cache()
+            
+        # everything is discovered again
+        if self._hosts_scheduler is not None:
+            for host in self._hosts:
+                self._hosts_scheduler.schedule(host.name, asyncio.get_running_loop().time())
+            
+        self._logger.info("All caches cleared")
+        
+    def _control_status(self) -> list[dict]:
+        return [self._get_host_state(host) for host in self._hosts]
+    
+    def _control_ups(self) -> list[dict]:
+        return [{
+            'name': ups.name,
+            'connected': ups.connected,
+            'data': ups.data,
+            'hosts_halted': ups.hosts_halted,
+            'shed': ups.shed_hosts,
+            'runtime_prediction': ups.runtime_prediction,
+            'waking': ups.waking,
+        } for ups in self._ups_units]
+    
+    def _control_pending(self) -> dict:
+        return {
+            'acks': {name: {'status': status, 'remaining': round(remaining, 1)} for name, (status, remaining) in self._acks.pending.items()},
+            'wake_sequences': [ups.name for ups in self._ups_units if ups.waking],
+        }
+    
+    def _get_control_host(self, name: str) -> HostService:
+        host = self._hosts_by_name.get(name)
+        
+        if host is None:
+            raise ControlError(f'Host "{name}" not found in configuration')
+        
+        return host
+    
+    def _get_host_state(self, host: HostService) -> dict:
+        return {
+            'name': host.name,
+            'status': host.status,
+            'ip': host.ip,
+            'mac': host.mac,
+            'acknowledged': host.acknowledged,
+            'operation': host.operation,
+            'wake_locks': host.wake_locks,
+        }
+        
     async def _do_clear_cache(self) -> None:
         self._hosts_datastore.clear()
         self._ups_datastore.clear()
@@ -1,4 +1,5 @@
-from pydantic import BaseModel, ConfigDict, model_validator
+from pydantic import BaseModel, ConfigDict, Field, model_validator
+from sentinel_hl.models.probe import ProbeModel
 
 class HostModel(BaseModel):
     name: str
@@ -8,6 +9,8 @@ class HostModel(BaseModel):
     ssh_user: str | None = None
     ssh_port: int | None = None
     wol_broadcast: str | None = None
+    probes: list[ProbeModel] | None = Field(default=None, min_length=1)
+    wake_after: list[str] = []
 
     model_config = ConfigDict(extra='forbid')
     
@@ -17,5 +20,8 @@ class HostModel(BaseModel):
         # make sure we have hostname or ip
         if not values.hostname and not values.ip:
             raise ValueError("Either 'hostname' or 'ip' must be provided")
+        
+        if values.name in values.wake_after:
+            raise ValueError('A host cannot be woken after itself')
 
         return values
\ No newline at end of file
@@ -1,10 +1,19 @@
 from pydantic import BaseModel, ConfigDict, Field
+from sentinel_hl.models.probe import ProbeModel
 
 class HostsPolicyModel(BaseModel):
     ack_status_interval: int = Field(default=15, ge=5)
     ack_status_retry: int = Field(default=3, ge=1)
+    ack_probe_interval: float = Field(default=1, gt=0)
+    ack_probe_interval_max: float = Field(default=5, gt=0)
     wake_backoff: int = Field(default=600, ge=0)
     ip_cache_ttl: int = Field(default=3600, ge=0)
+    ip_negative_cache_ttl: int = Field(default=30, ge=1)
     mac_cache_ttl: int = Field(default=3600, ge=0)
+    mac_monitor: bool = True
+    check_interval_min: int = Field(default=15, ge=5)
+    check_interval_max: int = Field(default=300, ge=5)
+    check_unstable_window: int = Field(default=300, ge=0)
+    probes: list[ProbeModel] = Field(default_factory=lambda: [ProbeModel(type='icmp')], min_length=1)
 
     model_config = ConfigDict(extra='forbid')
\ No newline at end of file
@@ -0,0 +1,8 @@
+from pydantic import BaseModel, ConfigDict, Field
+
+class MetricsModel(BaseModel):
+    enabled: bool = False
+    host: str = '127.0.0.1'
+    port: int = Field(default=9817, ge=1, le=65535)
+
+    model_config = ConfigDict(extra='forbid')
\ No newline at end of file
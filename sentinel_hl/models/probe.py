@@ -0,0 +1,31 @@
+from pydantic import BaseModel, ConfigDict, Field, model_validator
+from typing import Literal
+
+class ProbeModel(BaseModel):
+    type: Literal['icmp', 'tcp', 'neighbour']
+    ports: list[int] = [22]
+    count: int = Field(default=1, ge=1)
+    timeout: float = Field(default=5, gt=0)
+
+    model_config = ConfigDict(extra='forbid')
+    
+    @model_validator(mode='before')
+    @classmethod
+    def validate_before(cls, values):
+        # allow probes to be given by type only (eg. "icmp")
+        if isinstance(values, str):
+            values = {'type': values}
+            
+        return values
+    
+    @model_validator(mode='after')
+    @classmethod
+    def validate_after(cls, values):
+        if values.type == 'tcp' and not values.ports:
+            raise ValueError('At least one port must be provided for tcp probes')
+        
+        for port in values.ports:
+            if not (1 <= port <= 65535):
+                raise ValueError(f'Invalid port {port} provided')
+            
+        return values
@@ -1,9 +1,12 @@
 from pydantic import BaseModel, ConfigDict, Field, model_validator
+from typing import Literal
 from sentinel_hl.models.host import HostModel
 from sentinel_hl.models.hosts_policy import HostsPolicyModel
 from sentinel_hl.models.ups import UpsModel
 from sentinel_hl.models.ups_units_policy import UpsUnitsPolicyModel
 from sentinel_hl.models.wol import WolModel
+from sentinel_hl.models.metrics import MetricsModel
+from sentinel_hl.utils.graph import topological_layers
 
 class SentinelHlModel(BaseModel):
     hosts: list[HostModel] = []
@@ -11,8 +14,16 @@ class SentinelHlModel(BaseModel):
     ups: list[UpsModel] = []
     ups_units_policy: UpsUnitsPolicyModel = Field(default_factory=UpsUnitsPolicyModel)
     wol: WolModel = Field(default_factory=WolModel)
+    metrics: MetricsModel = Field(default_factory=MetricsModel)
     ups_poll_interval: int = Field(default=10, ge=5)
     hosts_check_interval: int = Field(default=60, ge=30)
+    hosts_check_concurrency: int = Field(default=32, ge=1)
+    hosts_check_timeout: int | None = Field(default=None, ge=1)
+    cmd_exec_concurrency: int = Field(default=32, ge=1)
+    datastore_backend: Literal['shelve', 'sqlite'] = 'shelve'
+    datastore_flush_interval: int = Field(default=30, ge=1)
+    history_retention: int = Field(default=2592000, ge=3600)
+    loop_lag_threshold: float = Field(default=1, gt=0)
 
     model_config = ConfigDict(extra='forbid')
     
@@ -23,6 +34,15 @@ class SentinelHlModel(BaseModel):
         host_names = [host.name for host in values.hosts]
         if len(host_names) != len(set(host_names)):
             raise ValueError('Host names must be unique')
+        
+        # ensure that hosts[].wake_after only references known hosts, without cycles
+        for host in values.hosts:
+            unknown = [name for name in host.wake_after if name not in host_names]
+            
+            if unknown:
+                raise ValueError(f'Host "{host.name}" is woken after unknown host(s): {", ".join(unknown)}')
+            
+        topological_layers({host.name: host.wake_after for host in values.hosts})
 
         # ensure that ups[].name is unique
         ups_names = [ups.name for ups in values.ups]
@@ -1,10 +1,11 @@
 from pydantic import BaseModel, ConfigDict
+from sentinel_hl.models.ups_host import UpsHostModel
 
 class UpsModel(BaseModel):
     name: str
     nut_id: str
     nut_host: str
     nut_port: int
-    hosts: list[str]
+    hosts: list[UpsHostModel]
 
     model_config = ConfigDict(extra='forbid')
\ No newline at end of file
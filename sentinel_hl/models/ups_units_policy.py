@@ -4,8 +4,20 @@ from typing import Literal
 
 class UpsUnitsPolicyModel(BaseModel):
     wake_cooldown: int = Field(default=120, ge=0)
+    wake_wave_delay: float = Field(default=0, ge=0)
     shutdown_threshold: int = Field(default=30, ge=0)
     shutdown_threshold_unit: Literal['%', 's'] = '%'
+    poll_mode: Literal['full', 'minimal'] = 'full'
+    full_poll_interval: int = Field(default=300, ge=0)
+    poll_interval_idle: float = Field(default=30, gt=0)
+    poll_interval_fast: float = Field(default=0.5, gt=0)
+    fast_poll_hold: int = Field(default=120, ge=0)
+    fast_poll_charge_drop: float = Field(default=2, gt=0)
+    runtime_window: int = Field(default=600, ge=3)
+    shutdown_concurrency: int = Field(default=8, ge=1)
+    shutdown_timeout: int = Field(default=120, ge=1)
+    shutdown_retries: int = Field(default=2, ge=0)
+    shutdown_retry_delay: float = Field(default=5, ge=0)
 
     model_config = ConfigDict(extra='forbid')
     
@@ -1,7 +1,11 @@
-from pydantic import BaseModel, ConfigDict
+from pydantic import BaseModel, ConfigDict, Field
 
 class WolModel(BaseModel):
     port: int = 9
     broadcast: str = '255.255.255.255'
+    repeat: int = Field(default=3, ge=1)
+    repeat_interval: float = Field(default=0.1, ge=0)
+    rate: float = Field(default=100, gt=0)
+    burst: int = Field(default=20, ge=1)
 
-    model_config = ConfigDict(extra='forbid')
\ No newline at end of file
+    model_config = ConfigDict(extra='forbid')
@@ -2,34 +2,57 @@ import logging
 import asyncio
 import socket
 import re
+import math
 from sentinel_hl.libraries.datastore import Datastore
-from sentinel_hl.libraries.host_discovery import HostDiscovery
+from sentinel_hl.libraries.neighbours import NeighbourTable
 from sentinel_hl.libraries.cmd_exec import CmdExec, CmdExecHost, CmdExecProcessError
+from sentinel_hl.libraries.resolver import Resolver
+from sentinel_hl.libraries.probes import Probe, IcmpProbe, TcpProbe, NeighbourProbe, ProbeChain
 from sentinel_hl.models.host import HostModel
 from sentinel_hl.models.hosts_policy import HostsPolicyModel
+from sentinel_hl.models.probe import ProbeModel
 from sentinel_hl.services.wol import WolService
+from sentinel_hl.libraries.ack_tracker import AckTracker
+from sentinel_hl.libraries.metrics import Histogram, histogram
 
 __all__ = ['HostService', 'HostUpdatePrereqError']
 
+# growth factor of the check interval for each check that finds a host in the same status
+STABLE_INTERVAL_GROWTH = 1.5
+STABLE_CHECKS_BEFORE_GROWTH = 3
+# the ssh connection of a halting host may hang instead of closing, don't wait for it forever
+SHUTDOWN_COMMAND_TIMEOUT = 30
+
+PROBE_DURATION = histogram('sentinel_hl_host_probe_duration_seconds', 'Duration of the probes checking whether a host is up.', ('host',))
+
 class HostUpdatePrereqError(Exception):
     pass 
 
 class HostService:
-    def __init__(self, host: HostModel, policy: HostsPolicyModel, *, datastore: Datastore, wol: WolService, logger: logging.Logger):
+    def __init__(self, host: HostModel, policy: HostsPolicyModel, *, datastore: Datastore, wol: WolService, acks: AckTracker, resolver: Resolver, neighbours: NeighbourTable, logger: logging.Logger):
         self._host: HostModel = host
         self._policy: HostsPolicyModel = policy
 
         self._datastore: Datastore = datastore
         self._wol: WolService = wol
+        self._acks: AckTracker = acks
+        self._resolver: Resolver = resolver
+        self._neighbours: NeighbourTable = neighbours
         self._logger: logging.Logger = logger
         
         self._cache: dict = self._datastore.get(self._host.name, {})
         self._cache_ip: bool = bool(not self._host.ip)
         self._cache_mac: bool = bool(not self._host.mac)
+        self._probes: ProbeChain = self._probes_factory()
         
         self._wake_locked: list[str] = []
         self._wake_in_progress: bool = False
         self._shutdown_in_progress: bool = False
+        
+        self._status_changed_at: float | None = None
+        self._stable_checks: int = 0
+        self._status_waiters: list[tuple[str, asyncio.Future]] = []
+        self._probe_duration: Histogram = PROBE_DURATION.labels(host.name)
 
     @property
     def name(self) -> str:
@@ -51,10 +74,64 @@ class HostService:
     def status(self) -> str | None:
         return self._cache.get('status')
     
+    @property
+    def resolves_hostname(self) -> bool:
+        return self._cache_ip and bool(self._host.hostname)
+    
+    @property
+    def resolves_mac(self) -> bool:
+        return self._cache_mac
+    
     @property
     def acknowledged(self) -> bool:
         return self._cache.get('ack', False)
     
+    @property
+    def operation(self) -> str | None:
+        # wake / shutdown waiting for the host to confirm its status
+        if self._wake_in_progress:
+            return 'wake'
+        
+        if self._shutdown_in_progress:
+            return 'shutdown'
+        
+        return None
+    
+    @property
+    def wake_locks(self) -> list[str]:
+        return list(self._wake_locked)
+    
+    @property
+    def wake_after(self) -> list[str]:
+        return self._host.wake_after
+    
+    @property
+    def ssh_host(self) -> CmdExecHost | None:
+        # only hosts with an ssh_user get master connections opened ahead of a shutdown
+        if not self._host.ssh_user or not self._host.ip:
+            return None
+        
+        return self._get_cmd_exec_host()
+    
+    def get_check_interval(self, base: int) -> float:
+        # hosts that recently changed status or have an operation in progress are checked more often,
+        # hosts that stay up are checked less and less often
+        if self._wake_in_progress or self._shutdown_in_progress:
+            return self._policy.check_interval_min
+        
+        if self._status_changed_at is not None:
+            if asyncio.get_event_loop().time() - self._status_changed_at < self._policy.check_unstable_window:
+                return self._policy.check_interval_min
+        
+        if self.status != 'up' or self.acknowledged:
+            return base
+        
+        ceiling = max(base, self._policy.check_interval_max)
+        # growing past the ceiling changes nothing, and the power would overflow after enough stable checks
+        steps = min(max(0, self._stable_checks - STABLE_CHECKS_BEFORE_GROWTH + 1), math.ceil(math.log(ceiling / base, STABLE_INTERVAL_GROWTH)))
+        
+        return min(base * STABLE_INTERVAL_GROWTH ** steps, ceiling)
+    
     async def check(self) -> None:
         self._logger.debug(f'Checking host "{self.name}"...')
 
@@ -88,12 +165,12 @@ class HostService:
                 self._logger.debug(f'Attempting to fetch IP address for "{self._host.name}" by hostname "{self._host.hostname}"...')
 
                 try:
-                    ip = await HostDiscovery.get_ip_by_hostname(self._host.hostname)
+                    ip, ttl = await self._resolver.resolve(self._host.hostname)
                     
-                    self._logger.debug(f'Found IP address {ip} for "{self._host.name}"')
+                    self._logger.debug(f'Found IP address {ip} for "{self._host.name}" (valid for {ttl:.0f}s)')
 
                     self._cache['ip'] = ip
-                    self._cache['ip_expiry'] = asyncio.get_event_loop().time() + self._policy.ip_cache_ttl
+                    self._cache['ip_expiry'] = asyncio.get_event_loop().time() + ttl
                 except Exception as e:
                     self._logger.error(f'Failed to resolve IP for "{self._host.name}" by hostname "{self._host.hostname}": {e}')
                     
@@ -103,11 +180,20 @@ class HostService:
             self._host.ip = self._cache.get('ip', '')
                             
         if self._cache_mac and self._host.ip:
-            if self._cache.get('mac_expiry', 0) <= asyncio.get_event_loop().time():
+            # a live neighbour table always has the current MAC, no need to wait for the cache to expire
+            live_mac = self._neighbours.lookup(self._host.ip) if self._neighbours.live else ''
+            
+            if live_mac:
+                if live_mac != self._cache.get('mac'):
+                    self._logger.info(f'MAC address for "{self._host.name}" is now {live_mac}')
+                    
+                self._cache['mac'] = live_mac
+                self._cache['mac_expiry'] = asyncio.get_event_loop().time() + self._policy.mac_cache_ttl
+            elif self._cache.get('mac_expiry', 0) <= asyncio.get_event_loop().time():
                 self._logger.debug(f'Attempting to fetch MAC address for "{self._host.name}" by IP address "{self._host.ip}"...')
 
                 try:
-                    mac = await HostDiscovery.get_mac_by_ip(self._host.ip)
+                    mac = await self._neighbours.get_mac(self._host.ip)
 
                     self._logger.debug(f'Found MAC address {mac} for "{self._host.name}"')
 
@@ -142,11 +228,18 @@ class HostService:
 
         self._logger.info(f'Waking up host "{self._host.name}" via Wake-on-LAN')
 
+        # set before sending so a concurrent wake is refused while the packets are batched
+        self._wake_in_progress = True
+        
         # try to wake the host up using Wake-on-LAN
-        self._wol.wake_host(self._host)
-        self._logger.debug(f'Wake-on-LAN packet sent to {self._host.mac}')
+        try:
+            await self._wol.wake_host(self._host)
+        except BaseException:
+            self._wake_in_progress = False
+            raise
         
-        asyncio.create_task(self._poll_wake_ack())
+        self._logger.debug(f'Wake-on-LAN packets sent to {self._host.mac}')
+        self._acks.expect(self._host.name, 'up', self._probe_status, timeout=self._get_ack_timeout()).add_done_callback(self._on_wake_ack)
     
     async def shutdown(self) -> None:
         if self._shutdown_in_progress:
@@ -157,93 +250,168 @@ class HostService:
 
         self._logger.info(f'Shutting down host "{self._host.name}"...')
 
-        await CmdExec.exec(['shutdown', 'now'], host=CmdExecHost(host=self._host.ip, user=self._host.ssh_user, port=self._host.ssh_port))
+        # set before running the command so a check or another tier can't shut the host down twice
+        self._shutdown_in_progress = True
+        
+        try:
+            await CmdExec.exec(['shutdown', 'now'], host=self._get_cmd_exec_host(), timeout=SHUTDOWN_COMMAND_TIMEOUT)
+        except BaseException:
+            self._shutdown_in_progress = False
+            raise
+        
+        self._acks.expect(self._host.name, 'down', self._probe_status, timeout=self._get_ack_timeout()).add_done_callback(self._on_shutdown_ack)
 
-        asyncio.create_task(self._poll_shutdown_ack())
+    async def wait_for_status(self, status: str, timeout: float | None = None) -> bool:
+        # resolves as soon as a check finds the host in this status, by default waits as long as a wake / shutdown ack
+        if self.status == status:
+            return True
+        
+        if timeout is None:
+            timeout = self._get_ack_timeout()
+        
+        waiter = (status, asyncio.get_running_loop().create_future())
+        self._status_waiters.append(waiter)
+        
+        try:
+            await asyncio.wait_for(waiter[1], timeout=timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            if waiter in self._status_waiters:
+                self._status_waiters.remove(waiter)
 
     def lock_wake(self, token: str) -> None:
         self._wake_locked.append(token)
 
     def unlock_wake(self, token: str) -> None:
-        self._wake_locked.remove(token)
+        if token in self._wake_locked:
+            self._wake_locked.remove(token)
+        
+    def carry_over(self, previous: 'HostService') -> None:
+        # a rebuilt instance keeps the status history and the wake locks of the one it replaces,
+        # so the scheduler and the UPS units see no difference until the next check
+        if previous.status is not None:
+            self._cache['status'] = previous.status
+            
+        self._status_changed_at = previous._status_changed_at
+        self._stable_checks = previous._stable_checks
+        
+        for token in previous.wake_locks:
+            self.lock_wake(token)
+        
+    def reload_cache(self) -> None:
+        # the record was changed by another process (ack, clear-cache), discovery fills in whatever was cleared
+        self._cache = self._datastore.get(self._host.name, {})
         
     def ack(self) -> None:
         self._cache['ack'] = True
-        self._persist_cache()
+        self._persist_cache(flush=True)
         
     def clear_ack(self) -> None:
         if self.acknowledged:
             del self._cache['ack']
-            self._persist_cache()
+            self._persist_cache(flush=True)
         else:
             self._logger.warning(f'No acknowledgment found for host "{self._host.name}" to clear')
 
-    def _persist_cache(self) -> None:
+    def _get_cmd_exec_host(self) -> CmdExecHost:
+        return CmdExecHost(host=self._host.ip, user=self._host.ssh_user, port=self._host.ssh_port)
+
+    def _persist_cache(self, flush: bool = False) -> None:
         if not self._cache:
             self._logger.debug(f'No cache data for host to write')
             return
         
-        self._datastore.set(self._host.name, self._cache)
+        self._datastore.set(self._host.name, self._cache, flush=flush)
         
         self._logger.debug(f'Cache data for host persisted')
         
-    async def _check_status(self) -> None:
-        # ping the host to check if it's reachable
-        try:
-            await CmdExec.ping(self._host.ip, count=1, timeout=5)
-            self._cache['status'] = 'up'
-        except CmdExecProcessError as e:
-            self._cache['status'] = 'down'
-            
-        self._persist_cache()
-
-    async def _poll_wake_ack(self) -> None:
-        self._wake_in_progress = True
+    def _probes_factory(self) -> ProbeChain:
+        probes: list[Probe] = []
+        
+        for probe in self._host.probes or self._policy.probes:
+            probes.append(self._probe_factory(probe))
             
-        updated = False
+        return ProbeChain(probes, logger=self._logger)
+    
+    def _probe_factory(self, probe: ProbeModel) -> Probe:
+        if probe.type == 'tcp':
+            return TcpProbe(probe.ports, timeout=probe.timeout)
+        elif probe.type == 'neighbour':
+            return NeighbourProbe(timeout=probe.timeout)
         
-        self._logger.debug(f'Polling host "{self._host.name}" status to ack wake action...')
-
-        for _ in range(self._policy.ack_status_retry):
-            # sleep for a while to allow the host to respond
-            await asyncio.sleep(self._policy.ack_status_interval)
+        return IcmpProbe(count=probe.count, timeout=probe.timeout)
+        
+    async def _check_status(self) -> None:
+        # run the configured probes to check if the host is reachable
+        started = asyncio.get_running_loop().time()
+        probe = await self._probes.probe(self._host.ip)
+        self._probe_duration.observe(asyncio.get_running_loop().time() - started)
+        
+        if probe:
+            self._logger.debug(f'Host "{self._host.name}" answered {probe} probe')
             
-            await self._check_status()
+        changed = self._update_status('up' if probe else 'down')
             
-            if self.status == 'up':
-                updated = True   
-                self._logger.info(f'Host "{self._host.name}" confirmed up after wake')
-                break
+        # status changes are written out right away, everything else is left to the periodic flush
+        self._persist_cache(flush=changed)
+        
+    def _update_status(self, status: str) -> bool:
+        previous = self.status
+        
+        if previous == status:
+            self._stable_checks += 1
+        else:
+            self._stable_checks = 0
             
-        self._wake_in_progress = False
+            if previous is not None:
+                self._status_changed_at = asyncio.get_event_loop().time()
+                
+        self._cache['status'] = status
+        
+        if previous != status:
+            self._datastore.record_status_transition(self._host.name, previous, status)
             
-        if not updated:            
-            self._cache['wake_backoff'] = asyncio.get_event_loop().time() + self._policy.wake_backoff
-            self._persist_cache()
-
-            self._logger.error(f'Host "{self._host.name}" did not confirm status after wake action. Considering it still down and backing off for {self._policy.wake_backoff}s')
+        for waiter_status, future in self._status_waiters:
+            if waiter_status == status and not future.done():
+                future.set_result(True)
+        
+        return previous != status
 
-    async def _poll_shutdown_ack(self) -> None:
-        self._shutdown_in_progress = True
+    async def _probe_status(self) -> str | None:
+        await self._check_status()
+        
+        return self.status
 
-        updated = False
+    def _get_ack_timeout(self) -> float:
+        return self._policy.ack_status_interval * self._policy.ack_status_retry
 
-        self._logger.debug(f'Polling host "{self._host.name}" status to ack shutdown action...')
+    def _on_wake_ack(self, future: asyncio.Future) -> None:
+        self._wake_in_progress = False
+        
+        # replaced by another operation
+        if future.cancelled():
+            return
+        
+        if future.result():
+            self._logger.info(f'Host "{self._host.name}" confirmed up after wake')
+            return
+        
+        self._cache['wake_backoff'] = asyncio.get_event_loop().time() + self._policy.wake_backoff
+        self._persist_cache(flush=True)
 
-        for _ in range(self._policy.ack_status_retry):
-            # sleep for a while to allow the host to respond
-            await asyncio.sleep(self._policy.ack_status_interval)
+        self._logger.error(f'Host "{self._host.name}" did not confirm status after wake action. Considering it still down and backing off for {self._policy.wake_backoff}s')
 
-            await self._check_status()
-            
-            if self.status == 'down':
-                updated = True
-                self._logger.info(f'Host "{self._host.name}" confirmed down after shutdown')
-                break
-            
+    def _on_shutdown_ack(self, future: asyncio.Future) -> None:
         self._shutdown_in_progress = False
-            
-        if not updated:
+        
+        if future.cancelled():
+            return
+        
+        if future.result():
+            self._logger.info(f'Host "{self._host.name}" confirmed down after shutdown')
+        else:
             self._logger.error(f'Host "{self._host.name}" did not confirm status after shutdown action. Considering it still up')
             
     def __str__(self) -> str:
@@ -1,46 +1,189 @@
 import asyncio
 import logging
+from typing import Awaitable, Callable, Literal, NamedTuple
+from sentinel_hl.libraries.cmd_exec import CmdExecProcessError
 from sentinel_hl.libraries.datastore import Datastore
-from sentinel_hl.libraries.nut import Nut
+from sentinel_hl.libraries.fan_out import FanOut, FanOutTimeoutError
+from sentinel_hl.libraries.nut import Nut, NutError
+from sentinel_hl.libraries.runtime_estimator import RuntimeEstimator
+from sentinel_hl.libraries.ssh_pool import SshPool
 from sentinel_hl.models.ups import UpsModel
 from sentinel_hl.models.ups_units_policy import UpsUnitsPolicyModel
-from sentinel_hl.services.host import HostService
+from sentinel_hl.services.host import HostService, HostUpdatePrereqError
+from sentinel_hl.utils.graph import topological_layers
 
-__all__ = ['UpsService']
+__all__ = ['UpsService', 'ShutdownOutcome']
+
+# variables the shutdown / wake logic and the history rely on, the only ones fetched in minimal poll mode
+POLL_VARS = ['ups.status', 'battery.charge', 'battery.runtime', 'ups.load', 'battery.voltage']
+# share of the predicted runtime the shutdown commands may take, the rest is left for the hosts to halt
+SHUTDOWN_RUNTIME_SHARE = 0.5
+# shortest shutdown deadline, however little runtime is left
+SHUTDOWN_MIN_DEADLINE = 10
+# while on battery, SSH master connections are checked (and reopened) this often
+SSH_WARM_INTERVAL = 60
+
+class ShutdownOutcome(NamedTuple):
+    host: str
+    result: Literal['sent', 'skipped', 'failed', 'timeout']
+    attempts: int
+    error: str | None = None
 
 class UpsService:
-    def __init__(self, ups: UpsModel, hosts: list[HostService], policy: UpsUnitsPolicyModel, *, datastore: Datastore, logger: logging.Logger):
+    def __init__(self, ups: UpsModel, hosts: list[HostService], policy: UpsUnitsPolicyModel, *, datastore: Datastore, nut: Nut, ssh_pool: SshPool, logger: logging.Logger):
         self._ups: UpsModel = ups
         self._hosts: list[HostService] = hosts
         self._policy: UpsUnitsPolicyModel = policy
 
         self._datastore: Datastore = datastore
+        self._ssh_pool: SshPool = ssh_pool
         self._logger: logging.Logger = logger
         
-        self._nut: Nut = Nut(ups.nut_host, ups.nut_port, logger=logger)
+        # shared with every other UPS on the same upsd
+        self._nut: Nut = nut
         self._cache: dict = self._datastore.get(self._ups.name, {})
         
         self._wake_cooldown: float | None = None
+        self._wake_task: asyncio.Task | None = None
+        self._shutdown_task: asyncio.Task | None = None
+        self._ssh_warm_task: asyncio.Task | None = None
+        self._ssh_warmed_at: float | None = None
         self._last_status: str | None = None
+        
+        self._full_polled_at: float | None = None
+        self._data: dict | None = None
+        self._supported_vars: list[str] = []
+        
+        self._runtime: RuntimeEstimator = RuntimeEstimator(policy.runtime_window)
+        self._thresholds: dict[str, tuple[int, str]] = self._thresholds_factory()
+        
+        # poll rate state
+        self._fast_poll_until: float | None = None
+        self._previous_status: list[str] | None = None
+        self._previous_charge: float | None = None
+        self._charge_steady: bool = False
     
     @property
     def name(self) -> str:
         return self._ups.name    
     
+    @property
+    def hosts(self) -> list[HostService]:
+        return self._hosts
+    
+    @property
+    def data(self) -> dict | None:
+        # variables of the last polls, minimal polls only refresh part of them
+        return self._data
+    
+    @property
+    def hosts_halted(self) -> bool:
+        return bool(self._cache.get('hosts_halted'))
+    
+    @property
+    def shed_hosts(self) -> list[str]:
+        return sorted(self._get_shed_hosts())
+    
+    @property
+    def runtime_prediction(self) -> float | None:
+        return self._runtime.prediction
+    
+    @property
+    def waking(self) -> bool:
+        return self._wake_task is not None and not self._wake_task.done()
+    
+    @property
+    def nut(self) -> Nut:
+        return self._nut
+    
+    @property
+    def nut_id(self) -> str:
+        return self._ups.nut_id
+    
     @property
     def connected(self) -> bool:
         return self._nut.connected
+    
+    @property
+    def poll_variables(self) -> list[str] | None:
+        # variables to fetch on the next poll, None when every variable has to be listed
+        if self._policy.poll_mode == 'full' or self._full_polled_at is None:
+            return None
+        
+        if asyncio.get_event_loop().time() - self._full_polled_at >= self._policy.full_poll_interval:
+            return None
+        
+        return self._supported_vars
+
+    def get_poll_interval(self, base: int) -> float:
+        # fast while on battery and for a while after anything happened, slow while on line power with a steady charge
+        status = self._previous_status or []
+        
+        if 'OB' in status or 'LB' in status:
+            return self._policy.poll_interval_fast
+        
+        if self._fast_poll_until is not None and asyncio.get_event_loop().time() < self._fast_poll_until:
+            return self._policy.poll_interval_fast
+        
+        if 'OL' in status and self._charge_steady:
+            return max(base, self._policy.poll_interval_idle)
+        
+        return base
 
+    def replace_hosts(self, hosts: list[HostService]) -> None:
+        # hosts were added, removed or rebuilt by a config reload
+        self._hosts = hosts
+        
+        # a running wake sequence restarts with the new hosts, hosts that are already up are skipped
+        if self._wake_task is not None and not self._wake_task.done():
+            self._wake_task.cancel()
+            self._wake_task = asyncio.create_task(self._wake_hosts())
+    
+    def reload_cache(self) -> None:
+        self._cache = self._datastore.get(self._ups.name, {})
+        
+    def close(self) -> None:
+        for task in (self._wake_task, self._shutdown_task, self._ssh_warm_task):
+            if task is not None and not task.done():
+                task.cancel()
+    
     async def poll(self) -> None:
+        variables = self.poll_variables
+        
         try:
-            ups_data = await self._nut.get_ups_vars(self._ups.nut_id)
+            ups_data = await self._nut.get_ups_vars(self._ups.nut_id, variables)
         except Exception as e:
             self._logger.error(f'Error polling UPS "{self._ups.name}": {e}')
             return
         
+        await self.process(ups_data, full=variables is None)
+    
+    async def process(self, ups_data: dict | NutError | None, *, full: bool = True) -> None:
+        # handles the variables of one poll, they may have been fetched in a batch with other UPS units
+        if isinstance(ups_data, NutError):
+            self._logger.error(f'Error polling UPS "{self._ups.name}": {ups_data}')
+            return
+        
         if not ups_data:
             return
         
+        if full:
+            # minimal polls only ask for the variables this UPS actually reports
+            self._full_polled_at = asyncio.get_event_loop().time()
+            self._supported_vars = [name for name in POLL_VARS if name in ups_data]
+            
+        self._data = ups_data if full or self._data is None else {**self._data, **ups_data}
+        self._update_poll_rate(ups_data)
+        
+        self._datastore.record_ups_sample(
+            self._ups.name,
+            ' '.join(ups_data['ups.status']),
+            ups_data.get('battery.charge'),
+            ups_data.get('ups.load'),
+            ups_data.get('battery.voltage'),
+            ups_data.get('battery.runtime'),
+        )
+        
         if 'OL' in ups_data['ups.status']: await self._handle_online_status(ups_data)
         elif 'OB' in ups_data['ups.status']: await self._handle_onbatt_status(ups_data)
             
@@ -54,11 +197,10 @@ class UpsService:
             self._logger.info(f'UPS "{self._ups.name}" is back online')
             
         self._last_status = 'OL'
+        self._ssh_warmed_at = None
         
-        if self._cache.get('onbatt'):
-            # unset on battery info if UPS is back online
-            self._cache['onbatt'] = None
-            self._persist_cache()
+        # a new discharge starts from an empty window
+        self._runtime.reset()
 
         if not self._cache.get('hosts_halted'):
             return
@@ -75,89 +217,273 @@ class UpsService:
         self._wake_cooldown = None
             
         self._cache['hosts_halted'] = False
-        self._persist_cache()
+        self._cache.pop('shed', None)
+        self._persist_cache(fsync=True)
         self._logger.info(f'UPS "{self._ups.name}" was stable for {self._policy.wake_cooldown}s. Waking hosts')
 
-        for host in self._hosts:
-            try:
-                host.unlock_wake(self._ups.name)
-                await host.wake()
-            except Exception as e:
-                self._logger.error(f'Could not wake host "{host.name}": {e}')
+        # runs in the background, waiting for hosts to come up must not hold the UPS polls
+        self._wake_task = asyncio.create_task(self._wake_hosts())
     
     async def _handle_onbatt_status(self, ups_data: dict) -> None:
         if self._last_status == 'OL':
             self._logger.info(f'UPS "{self._ups.name}" has switched to battery power')
         
         self._last_status = 'OB'
+        
+        if self._wake_task is not None and not self._wake_task.done():
+            self._logger.warning(f'UPS "{self._ups.name}" is on battery again. Stopping wake sequence')
+            self._wake_task.cancel()
+        
+        # every sample on battery feeds the estimator, whatever the threshold unit
+        runtime = self._runtime.add(
+            asyncio.get_event_loop().time(),
+            ups_data.get('battery.charge', 0),
+            ups_data.get('ups.load'),
+            ups_data.get('battery.runtime'),
+        )
             
         if self._wake_cooldown:
             # unset wake cooldown if UPS is on battery
             self._wake_cooldown = None
             return
         
-        if self._cache.get('hosts_halted'):
+        # the next tier is decided once the hosts being shut down are done
+        if self._shutdown_task is not None and not self._shutdown_task.done():
             return
         
-        if self._policy.shutdown_threshold_unit == 's':
-            # process shutdown based on time left
-            if not self._cache.get('onbatt'):
-                self._cache['onbatt'] = (asyncio.get_event_loop().time(), ups_data.get('battery.charge', 0))
-                self._persist_cache()
-                
-            current = self._get_battery_time_left(ups_data)
+        shed = self._get_shed_hosts()
+        pending = [host for host in self._hosts if host.name not in shed]
+        
+        if not pending:
+            return
+        
+        self._warm_ssh(pending)
+        
+        charge = ups_data.get('battery.charge', 0)
+        
+        # hosts are shut down in tiers, each host when its own threshold is reached
+        tiers: dict[tuple[int, str], list[HostService]] = {}
+        
+        for host in pending:
+            threshold, unit = self._thresholds[host.name]
             
-            if current is None or current > self._policy.shutdown_threshold:
-                return
-        elif self._policy.shutdown_threshold_unit == '%':
-            # process shutdown based on battery percentage
-            current = ups_data.get('battery.charge', 0)
+            if self._is_below_threshold(threshold, unit, charge, runtime):
+                tiers.setdefault((threshold, unit), []).append(host)
+                
+        if not tiers:
+            return
+        
+        due: list[HostService] = []
+        
+        for (threshold, unit), hosts in tiers.items():
+            current = runtime if unit == 's' else charge
             
-            if current > self._policy.shutdown_threshold:
-                return
-
-        self._logger.warning(f'UPS "{self._ups.name}" is on battery and below shutdown threshold {self._policy.shutdown_threshold}{self._policy.shutdown_threshold_unit} ({current}{self._policy.shutdown_threshold_unit}). Initiating shutdown')
+            self._logger.warning(f'UPS "{self._ups.name}" is on battery and below shutdown threshold {threshold}{unit} ({current}{unit}). Shutting down {", ".join(host.name for host in hosts)}')
+            due.extend(hosts)
 
-        for host in self._hosts:
-            # skip hosts that are already down
-            if host.status == 'down':
-                continue
-            
-            try:
-                # try to shut down the host
-                await host.shutdown()
-                host.lock_wake(self._ups.name)
-            except Exception as e:
-                self._logger.error(f'Error shutting down host "{host.name}": {e}')
+        # runs in the background, a shutdown running until its deadline must not hold the UPS polls
+        self._shutdown_task = asyncio.create_task(self._shed_hosts(runtime, due))
+        
+    async def _shed_hosts(self, runtime: float | None, hosts: list[HostService]) -> None:
+        outcomes = await self._shutdown_hosts(runtime, hosts)
+        
+        # hosts whose shutdown failed are tried again on the next poll below their threshold
+        failed = {outcome.host for outcome in outcomes.values() if outcome.result in ('failed', 'timeout')}
+        shed = self._get_shed_hosts() | {host.name for host in hosts if host.name not in failed}
 
         self._cache['hosts_halted'] = True
-        self._persist_cache()
+        self._cache['shed'] = sorted(shed)
+        self._persist_cache(fsync=True)
+        
+        if len(shed) < len(self._hosts) and len(failed) < len(hosts):
+            # the load just dropped, the remaining tiers are decided on predictions made with the new load
+            self._runtime.reset(keep_rate=True)
+            
+    def _warm_ssh(self, hosts: list[HostService]) -> None:
+        # shutdowns may be close, open SSH master connections now so they skip the handshake
+        now = asyncio.get_event_loop().time()
+        
+        if self._ssh_warmed_at is not None and now - self._ssh_warmed_at < SSH_WARM_INTERVAL:
+            return
+        
+        if self._ssh_warm_task is not None and not self._ssh_warm_task.done():
+            return
+        
+        ssh_hosts = [host.ssh_host for host in hosts if host.ssh_host is not None and host.status != 'down']
+        
+        if not ssh_hosts:
+            return
+        
+        self._ssh_warmed_at = now
+        self._ssh_warm_task = asyncio.create_task(self._ssh_pool.warm_many(ssh_hosts)) # type: ignore
+    
+    def _is_below_threshold(self, threshold: int, unit: str, charge: float, runtime: float | None) -> bool:
+        if unit == 's':
+            # based on time left, once the prediction is consistently below the threshold
+            return runtime is not None and self._runtime.settled_below(threshold)
+        
+        # based on battery percentage
+        return charge <= threshold
+    
+    def _get_shed_hosts(self) -> set[str]:
+        if 'shed' in self._cache:
+            return set(self._cache['shed'])
+        
+        # cache written before tiers existed, all hosts were shut down at once
+        if self._cache.get('hosts_halted'):
+            return {host.name for host in self._hosts}
+        
+        return set()
+    
+    def _thresholds_factory(self) -> dict[str, tuple[int, str]]:
+        thresholds = {}
+        
+        for ups_host in self._ups.hosts:
+            if ups_host.shutdown_threshold is None:
+                thresholds[ups_host.name] = (self._policy.shutdown_threshold, self._policy.shutdown_threshold_unit)
+            else:
+                thresholds[ups_host.name] = (ups_host.shutdown_threshold, ups_host.shutdown_threshold_unit or self._policy.shutdown_threshold_unit)
+                
+        return thresholds
+    
+    async def _wake_hosts(self) -> None:
+        # hosts are woken in waves following hosts[].wake_after, a wave starts once the hosts it depends on are confirmed up
+        hosts = {host.name: host for host in self._hosts}
+        waves = topological_layers({host.name: host.wake_after for host in self._hosts})
+        
+        loop = asyncio.get_running_loop()
+        wave_started: float | None = None
+        
+        for index, wave in enumerate(waves, 1):
+            if wave_started is not None:
+                # spread the power-on inrush of consecutive waves
+                delay = wave_started + self._policy.wake_wave_delay - loop.time()
+                
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            
+            wave_started = loop.time()
+            
+            if len(waves) > 1:
+                self._logger.info(f'Waking hosts of UPS "{self._ups.name}" (wave {index}/{len(waves)}): {", ".join(wave)}')
+            
+            confirmed = await asyncio.gather(*[self._wake_host(hosts[name]) for name in wave])
+            
+            failed = [name for name, up in zip(wave, confirmed) if not up]
+            
+            if failed and index < len(waves):
+                self._logger.warning(f'Host(s) {", ".join(failed)} not confirmed up. Continuing with next wake wave')
+                
+    async def _wake_host(self, host: HostService) -> bool:
+        try:
+            host.unlock_wake(self._ups.name)
+            await host.wake()
+        except HostUpdatePrereqError as e:
+            if host.status == 'up':
+                return True
+            
+            self._logger.error(f'Could not wake host "{host.name}": {e}')
+            return False
+        except Exception as e:
+            self._logger.error(f'Could not wake host "{host.name}": {e}')
+            return False
+        
+        return await host.wait_for_status('up')
     
-    def _persist_cache(self) -> None:
+    async def _shutdown_hosts(self, runtime: float | None, hosts: list[HostService]) -> dict[str, ShutdownOutcome]:
+        # every host is shut down at once (up to shutdown_concurrency), failures are retried until the deadline
+        deadline = self._get_shutdown_deadline(runtime)
+        outcomes: dict[str, ShutdownOutcome] = {}
+        
+        jobs = {host.name: self._shutdown_host_job(host, outcomes) for host in hosts if host.status != 'down'}
+        
+        fan_out = FanOut(self._policy.shutdown_concurrency, timeout=deadline)
+        results = await fan_out.run(jobs)
+        
+        for name, error in results.items():
+            if isinstance(error, FanOutTimeoutError):
+                attempts = outcomes[name].attempts if name in outcomes else 0
+                outcomes[name] = ShutdownOutcome(name, 'timeout', attempts, str(error))
+        
+        report = ', '.join(
+            f'{outcome.host}: {outcome.result}' + (f' after {outcome.attempts} attempt(s) ({outcome.error})' if outcome.error else '')
+            for outcome in outcomes.values()
+        )
+        
+        failed = [outcome for outcome in outcomes.values() if outcome.result in ('failed', 'timeout')]
+        log = self._logger.error if failed else self._logger.info
+        
+        log(f'Shutdown of {len(jobs)} host(s) for UPS "{self._ups.name}" done in {fan_out.elapsed:.2f}s (deadline {deadline:.0f}s). {report or "No host to shut down"}')
+        
+        return outcomes
+    
+    def _shutdown_host_job(self, host: HostService, outcomes: dict[str, ShutdownOutcome]) -> Callable[[], Awaitable[None]]:
+        async def job() -> None:
+            for attempt in range(1, self._policy.shutdown_retries + 2):
+                # kept up to date so a deadline hit still reports how far the host got
+                outcomes[host.name] = ShutdownOutcome(host.name, 'failed', attempt)
+                
+                try:
+                    await host.shutdown()
+                except HostUpdatePrereqError as e:
+                    outcomes[host.name] = ShutdownOutcome(host.name, 'skipped', attempt, str(e))
+                    return
+                except Exception as e:
+                    # ssh reports the connection dropped by the halting host as an error
+                    if isinstance(e, CmdExecProcessError) and e.code == 255 and 'closed by remote host' in str(e):
+                        self._logger.debug(f'Connection to host "{host.name}" closed during shutdown')
+                    else:
+                        outcomes[host.name] = ShutdownOutcome(host.name, 'failed', attempt, str(e) or type(e).__name__)
+                        self._logger.warning(f'Error shutting down host "{host.name}" (attempt {attempt}): {e}')
+                        
+                        if attempt <= self._policy.shutdown_retries:
+                            await asyncio.sleep(self._policy.shutdown_retry_delay)
+                            
+                        continue
+                
+                host.lock_wake(self._ups.name)
+                outcomes[host.name] = ShutdownOutcome(host.name, 'sent', attempt)
+                return
+            
+        return job
+    
+    def _get_shutdown_deadline(self, runtime: float | None) -> float:
+        if runtime is None:
+            return self._policy.shutdown_timeout
+        
+        return min(self._policy.shutdown_timeout, max(SHUTDOWN_MIN_DEADLINE, runtime * SHUTDOWN_RUNTIME_SHARE))
+    
+    def _update_poll_rate(self, ups_data: dict) -> None:
+        status = ups_data['ups.status']
+        charge = ups_data.get('battery.charge', 0)
+        
+        reasons = []
+        
+        if self._previous_status is not None and set(status) != set(self._previous_status):
+            reasons.append(f'status changed to {" ".join(status)}')
+            
+        if self._previous_charge is not None and self._previous_charge - charge >= self._policy.fast_poll_charge_drop:
+            reasons.append(f'charge dropped from {self._previous_charge}% to {charge}%')
+            
+        if reasons:
+            if self._fast_poll_until is None or asyncio.get_event_loop().time() >= self._fast_poll_until:
+                self._logger.debug(f'UPS "{self._ups.name}" {", ".join(reasons)}. Polling every {self._policy.poll_interval_fast}s')
+                
+            self._fast_poll_until = asyncio.get_event_loop().time() + self._policy.fast_poll_hold
+            
+        self._charge_steady = self._previous_charge is not None and charge == self._previous_charge
+        self._previous_status = status
+        self._previous_charge = charge
+    
+    def _persist_cache(self, flush: bool = False, fsync: bool = False) -> None:
         if not self._cache:
             self._logger.debug(f'No cache data for UPS "{self._ups.name}" to write')
             return
 
-        self._datastore.set(self._ups.name, self._cache)
+        # hosts_halted decides whether hosts are woken after a restart, it must survive a power loss
+        self._datastore.set(self._ups.name, self._cache, flush=flush, fsync=fsync)
 
         self._logger.debug(f'Cache data for UPS "{self._ups.name}" persisted')
         
-    def _get_battery_time_left(self, ups_data: dict) -> float | None:
-        onbatt_time, onbatt_charge = self._cache.get('onbatt', (0, 0))
-
-        elapsed = asyncio.get_event_loop().time() - onbatt_time
-        charge_used = onbatt_charge - ups_data.get('battery.charge', 0)
-        
-        if charge_used <= 0 or elapsed <= 0:
-            return None
-        
-        # Calculate time left based on charge used and elapsed time
-        drain_rate = charge_used / elapsed
-        
-        if drain_rate <= 0:
-            return None
-        
-        return round(ups_data.get('battery.charge', 0) / drain_rate, 2)
-    
     def __str__(self) -> str:
         return self.name
\ No newline at end of file
@@ -1,5 +1,5 @@
 import logging
-from wakeonlan import send_magic_packet
+from sentinel_hl.libraries.wol import WolSender
 from sentinel_hl.models.wol import WolModel
 from sentinel_hl.models.host import HostModel
 
@@ -10,11 +10,15 @@ class WolService:
         self._config: WolModel = config
         
         self._logger: logging.Logger = logger
+        self._sender: WolSender = WolSender(repeat=config.repeat, interval=config.repeat_interval, rate=config.rate, burst=config.burst, logger=logger)
         
-    def wake_host(self, host: HostModel) -> None:
+    async def wake_host(self, host: HostModel) -> None:
         if not host.mac:
             self._logger.warning(f'Host "{host.name}" does not have a MAC address configured. Cannot wake.')
             return
         
         broadcast = host.wol_broadcast if host.wol_broadcast is not None else self._config.broadcast
-        send_magic_packet(host.mac, ip_address=broadcast, port=self._config.port)
\ No newline at end of file
+        await self._sender.send(host.mac, broadcast, self._config.port)
+
+    def close(self) -> None:
+        self._sender.close()
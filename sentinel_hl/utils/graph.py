@@ -0,0 +1,21 @@
+def topological_layers(dependencies: dict[str, list[str]]) -> list[list[str]]:
+    # groups nodes in layers where every node only depends on nodes of the previous layers.
+    # dependencies on nodes that are not in the graph are ignored
+    remaining = {node: {dependency for dependency in deps if dependency in dependencies and dependency != node} for node, deps in dependencies.items()}
+    layers: list[list[str]] = []
+
+    while remaining:
+        layer = [node for node, deps in remaining.items() if not deps]
+
+        if not layer:
+            raise ValueError(f'Dependency cycle between {", ".join(sorted(remaining))}')
+
+        for node in layer:
+            del remaining[node]
+
+        for deps in remaining.values():
+            deps.difference_update(layer)
+
+        layers.append(layer)
+
+    return layers